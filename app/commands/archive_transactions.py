@@ -0,0 +1,48 @@
+"""
+Move old transactions out of the transactions table, into the archive.
+
+    python -m app.commands.archive_transactions
+    python -m app.commands.archive_transactions --older-than-days 730
+
+Every calendar month that ended more than `settings.archive_after_days` ago (or
+--older-than-days) is moved, on every shard, to a compressed segment file per month under
+`settings.archive_dir`, and recorded in the archived_months catalog (see
+`utils/archive.py`). Account history, transaction and transfer lookups, point-in-time
+balances, reconcile and rebuild_aggregates keep reading archived months.
+
+Accounts are moved in batches, each committed on its own, so the command can be stopped
+and run again at any time; run it periodically, e.g. monthly from cron. Back up
+archive_dir with the database: the segments hold the only copy of the archived rows.
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+from ..utils.archive import archive_shard
+from ..utils.config import settings
+from ..utils.database import ShardWriteSessionLocal, init_db
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--older-than-days", type=int, default=settings.archive_after_days, help="default: MEOW_ARCHIVE_AFTER_DAYS"
+    )
+    args = parser.parse_args()
+
+    init_db()
+    horizon = datetime.now(timezone.utc) - timedelta(days=args.older_than_days)
+    started = time.perf_counter()
+    moved = 0
+    for sessionFactory in ShardWriteSessionLocal:
+        with sessionFactory() as db:
+            moved += archive_shard(db, horizon)
+    print(
+        f"Archived {moved} transaction(s) dated before {horizon:%Y-%m} to {settings.archive_dir} "
+        f"in {time.perf_counter() - started:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
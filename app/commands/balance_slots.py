@@ -0,0 +1,106 @@
+"""
+Split the balance of a hot account into slots, or merge it back.
+
+    python -m app.commands.balance_slots ACCOUNT_ID --slots 8
+    python -m app.commands.balance_slots ACCOUNT_ID --slots 1     # merge back
+
+Transfers to and from one account wait on its row lock, one after the other. A split
+account keeps its balance in N slot rows and a transfer locks only one of them, see
+`utils/balance_slots.py`. The balance is divided evenly over the slots, the remainder of
+the division going to slot 0; the account's balance and history do not change.
+
+The account and its slots are locked while they are rewritten, so it is safe to run while
+transfers are applied. Running it again with another --slots re-splits the account.
+"""
+
+import argparse
+from datetime import datetime, timezone
+from decimal import ROUND_DOWN, Decimal
+
+from sqlalchemy import delete, insert, select, update
+
+from ..utils import balance_slots, ledger
+from ..utils.database import ShardWriteSessionLocal, init_db
+from ..utils.money import MONEY_SCALE, currency_exponent
+from ..utils.sharding import shard_of
+
+accounts = balance_slots.accounts
+slots = balance_slots.slots
+
+MAX_SLOTS = 64
+
+
+def split_account(db, accountId: str, slotCount: int) -> dict:
+    """Fold the account's slots into its row, then split it into `slotCount` slots; None when missing."""
+    account = db.execute(
+        select(accounts).where(accounts.c.accountId == accountId).with_for_update()
+    ).first()
+    if account is None:
+        return None
+    held = db.execute(
+        select(slots).where(slots.c.accountId == accountId).order_by(slots.c.slot).with_for_update()
+    ).all()
+
+    month = ledger.current_month(datetime.now(timezone.utc))
+    balance = account.balance + sum(slot.balance for slot in held)
+    ownMonth = account.monthTransactions if account.monthKey == month else 0
+    merged = {
+        "totalTransactions": account.totalTransactions + sum(slot.totalTransactions for slot in held),
+        "totalCredits": account.totalCredits + sum(slot.totalCredits for slot in held),
+        "totalDebits": account.totalDebits + sum(slot.totalDebits for slot in held),
+        "monthKey": month,
+        "monthTransactions": ownMonth
+        + sum(slot.monthTransactions for slot in held if slot.monthKey == month),
+    }
+    db.execute(delete(slots).where(slots.c.accountId == accountId))
+
+    if slotCount > 1:
+        unit = Decimal(1).scaleb(-min(currency_exponent(account.currency), MONEY_SCALE))
+        share = (balance / slotCount).quantize(unit, rounding=ROUND_DOWN)
+        db.execute(
+            insert(slots),
+            [
+                {
+                    "accountId": accountId,
+                    "slot": slot,
+                    "balance": share + (balance - share * slotCount if slot == 0 else 0),
+                    "totalTransactions": 0,
+                    "totalCredits": 0,
+                    "totalDebits": 0,
+                    "monthKey": month,
+                    "monthTransactions": 0,
+                }
+                for slot in range(slotCount)
+            ],
+        )
+        rowBalance = Decimal(0)
+    else:
+        rowBalance = balance
+
+    db.execute(
+        update(accounts)
+        .where(accounts.c.accountId == accountId)
+        .values(balance=rowBalance, balanceSlots=max(slotCount, 1), **merged)
+    )
+    return {"balance": balance, "slots": max(slotCount, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("accountId")
+    parser.add_argument("--slots", type=int, required=True, help=f"1 to {MAX_SLOTS}; 1 merges the slots back")
+    args = parser.parse_args()
+    if not 1 <= args.slots <= MAX_SLOTS:
+        parser.error(f"--slots must be between 1 and {MAX_SLOTS}")
+
+    init_db()
+    with ShardWriteSessionLocal[shard_of(args.accountId)]() as db:
+        result = split_account(db, args.accountId, args.slots)
+        if result is None:
+            raise SystemExit(f"Account with ID {args.accountId} not found")
+        db.commit()
+    print(f"Account {args.accountId}: balance {result['balance']} in {result['slots']} slot(s)")
+
+
+if __name__ == "__main__":
+    main()
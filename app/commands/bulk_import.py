@@ -0,0 +1,252 @@
+"""
+Bulk import customers, or accounts with their opening balances, from CSV or JSONL.
+
+    python -m app.commands.bulk_import customers partner_customers.csv
+    python -m app.commands.bulk_import accounts partner_accounts.jsonl --rejects rejected.jsonl
+
+Customer rows have the fields of POST /api/v1/customers (firstName, lastName, email,
+phoneNumber). Account rows have the fields of POST /api/v1/accounts (name, accountType,
+currency, balance) and name their owner either by customerId or by customerEmail, so a
+partner's accounts can be loaded right after its customers.
+
+The file is streamed in chunks. Each chunk is validated with the API schemas and written
+with one executemany INSERT per table, in one transaction. Emails are deduplicated in
+memory against an index of the existing customers, fetched once, and against the rows
+already imported. An account gets its opening balance checkpoint like one opened through
+the API.
+
+Rows that fail are written to the reject file, one JSON object per line with the input
+line number, the row and the errors, and the import carries on. The command exits with
+status 1 when rows were rejected.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterator, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from ..utils import schemas
+from ..utils.config import settings
+from ..utils.database import WriteSessionLocal, init_db
+from ..utils.models import Account, BalanceCheckpoint, Customer, generate_uuid
+
+CHUNK_ROWS = 5000
+
+# Core tables: one executemany per chunk. ORM bulk inserts split a chunk into a statement
+# per run of rows with the same non-null columns
+customers = Customer.__table__
+accounts = Account.__table__
+checkpoints = BalanceCheckpoint.__table__
+
+
+def read_rows(path: str, fileFormat: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(line number, row, parse error) for every record of the file; "-" is stdin."""
+    source = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        if fileFormat == "csv":
+            reader = csv.DictReader(source)
+            for row in reader:
+                # Empty cells are missing values, so optional fields fall back to their defaults
+                row = {key: value for key, value in row.items() if key is not None and value not in ("", None)}
+                yield reader.line_num, row, None
+        else:
+            for lineNumber, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield lineNumber, None, f"Invalid JSON: {e}"
+                    continue
+                if isinstance(row, dict):
+                    yield lineNumber, row, None
+                else:
+                    yield lineNumber, None, "Expected a JSON object"
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def validation_errors(error: ValidationError) -> list:
+    return [
+        f"{'.'.join(str(part) for part in detail['loc']) or 'row'}: {detail['msg']}"
+        for detail in error.errors()
+    ]
+
+
+class BulkImporter:
+    """Imports chunks of rows; keeps the email index and the counts across chunks."""
+
+    def __init__(self, db, rejects) -> None:
+        self.db = db
+        self.rejects = rejects
+        self.imported = 0
+        self.rejected = 0
+        # email -> customerId of every customer, existing or imported
+        self.customerIds = dict(db.execute(select(Customer.email, Customer.customerId)).all())
+        self.knownCustomerIds = set(self.customerIds.values())
+
+    def reject(self, lineNumber: int, row, errors: list) -> None:
+        self.rejected += 1
+        self.rejects.write(json.dumps({"line": lineNumber, "row": row, "errors": errors}, default=str) + "\n")
+
+    def import_customers(self, chunk: list) -> None:
+        now = datetime.now(timezone.utc)
+        accepted = []  # (line number, row, values)
+        for lineNumber, row, parseError in chunk:
+            if parseError:
+                self.reject(lineNumber, row, [parseError])
+                continue
+            try:
+                customer = schemas.CustomerCreate.model_validate(row)
+            except ValidationError as e:
+                self.reject(lineNumber, row, validation_errors(e))
+                continue
+            if customer.email in self.customerIds:
+                self.reject(lineNumber, row, [f"Customer with email {customer.email} already exists"])
+                continue
+            values = {**customer.model_dump(), "customerId": generate_uuid(), "createdAt": now, "updatedAt": now}
+            self.customerIds[customer.email] = values["customerId"]
+            accepted.append((lineNumber, row, values))
+
+        def write(rows):
+            self.db.execute(insert(customers), [values for _, _, values in rows])
+
+        for _, _, values in self.write_chunk(accepted, write):
+            self.knownCustomerIds.add(values["customerId"])
+
+    def import_accounts(self, chunk: list) -> None:
+        now = datetime.now(timezone.utc)
+        accepted = []
+        for lineNumber, row, parseError in chunk:
+            if parseError:
+                self.reject(lineNumber, row, [parseError])
+                continue
+            fields = dict(row)
+            customerEmail = fields.pop("customerEmail", None)
+            if "customerId" not in fields and customerEmail is not None:
+                if customerEmail not in self.customerIds:
+                    self.reject(lineNumber, row, [f"Customer with email {customerEmail} not found"])
+                    continue
+                fields["customerId"] = self.customerIds[customerEmail]
+            try:
+                account = schemas.AccountCreate.model_validate(fields)
+            except ValidationError as e:
+                self.reject(lineNumber, row, validation_errors(e))
+                continue
+            if account.customerId not in self.knownCustomerIds:
+                self.reject(lineNumber, row, [f"Customer with ID {account.customerId} not found"])
+                continue
+            values = {
+                **account.model_dump(),
+                "accountId": generate_uuid(),
+                "createdAt": now,
+                "updatedAt": now,
+                "checkpointAt": now,
+            }
+            accepted.append((lineNumber, row, values))
+
+        def write(rows):
+            self.db.execute(insert(accounts), [values for _, _, values in rows])
+            # The opening balance is the account's first checkpoint, as in create_account
+            self.db.execute(
+                insert(checkpoints),
+                [
+                    {
+                        "checkpointId": generate_uuid(),
+                        "accountId": values["accountId"],
+                        "asOf": now,
+                        "balance": values["balance"],
+                        "createdAt": now,
+                    }
+                    for _, _, values in rows
+                ],
+            )
+
+        self.write_chunk(accepted, write)
+
+    def write_chunk(self, accepted: list, write) -> list:
+        """
+        Write the accepted rows of a chunk in one transaction. When the database refuses the
+        batch (an email taken since the index was fetched), rows are retried one at a time
+        so only the failing ones are rejected. Returns the rows written.
+        """
+        if not accepted:
+            return []
+        try:
+            write(accepted)
+            self.db.commit()
+            self.imported += len(accepted)
+            return accepted
+        except IntegrityError:
+            self.db.rollback()
+
+        written = []
+        for item in accepted:
+            try:
+                with self.db.begin_nested():
+                    write([item])
+                written.append(item)
+            except IntegrityError as e:
+                lineNumber, row, values = item
+                self.customerIds.pop(values.get("email"), None)
+                self.reject(lineNumber, row, [f"Rejected by the database: {e.orig}"])
+        self.db.commit()
+        self.imported += len(written)
+        return written
+
+
+def bulk_import(kind: str, path: str, fileFormat: str, rejects, chunkRows: int = CHUNK_ROWS) -> BulkImporter:
+    rows = read_rows(path, fileFormat)
+    with WriteSessionLocal() as db:
+        importer = BulkImporter(db, rejects)
+        importChunk = importer.import_customers if kind == "customers" else importer.import_accounts
+        while True:
+            chunk = list(islice(rows, chunkRows))
+            if not chunk:
+                return importer
+            importChunk(chunk)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=["customers", "accounts"])
+    parser.add_argument("path", help='CSV or JSONL file, "-" for stdin')
+    parser.add_argument("--format", choices=["csv", "jsonl"], dest="fileFormat", help="default: from the file extension")
+    parser.add_argument("--rejects", help="reject file (default: <path>.rejects.jsonl)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="rows per transaction")
+    args = parser.parse_args()
+    if settings.shard_urls:
+        parser.error("customers are placed on shards by the API; the import does not support MEOW_SHARD_URLS yet")
+
+    fileFormat = args.fileFormat or ("csv" if args.path.lower().endswith(".csv") else "jsonl")
+    rejectsPath = args.rejects or f"{'import' if args.path == '-' else args.path}.rejects.jsonl"
+
+    init_db()
+    started = time.perf_counter()
+    with open(rejectsPath, "w", encoding="utf-8") as rejects:
+        importer = bulk_import(args.kind, args.path, fileFormat, rejects, args.chunk)
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"Imported {importer.imported} {args.kind} in {elapsed:.1f} s "
+        f"({importer.imported / elapsed:.0f} rows/s), rejected {importer.rejected}"
+    )
+    if not importer.rejected:
+        os.remove(rejectsPath)
+        return
+    print(f"Rejected rows written to {rejectsPath}")
+    raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Convert the UUID key columns of a database between text and 16-byte binary storage.
+
+    python -m app.commands.migrate_ids --to binary
+    python -m app.commands.migrate_ids --to text
+
+Stop the API first, and start it again with the matching MEOW_ID_STORAGE. Keys keep their
+value, only their stored form changes, so primary and foreign keys stay consistent. Every
+key column is rewritten in one transaction: in place on SQLite, with ALTER COLUMN ... TYPE
+on PostgreSQL (foreign keys are dropped for the conversion and added back).
+"""
+
+import argparse
+import uuid
+
+from sqlalchemy import inspect, select, update
+from sqlalchemy.schema import AddConstraint, DropConstraint
+
+from ..utils.database import Base, engine
+from ..utils.models import StorageSetting, UUIDKey
+
+
+def key_columns():
+    return [
+        (table, column)
+        for table in Base.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, UUIDKey)
+    ]
+
+
+def _to_binary(value):
+    return value if value is None or isinstance(value, bytes) else uuid.UUID(value).bytes
+
+
+def _to_text(value):
+    return str(uuid.UUID(bytes=value)) if isinstance(value, bytes) else value
+
+
+def convert_sqlite(connection, columns, target: str) -> None:
+    # SQLite keeps whatever is stored whatever the declared type, so values are rewritten
+    # in place by a function registered on this connection
+    dbapiConnection = connection.connection.driver_connection
+    dbapiConnection.create_function("convert_key", 1, _to_binary if target == "binary" else _to_text, deterministic=True)
+    for table, column in columns:
+        name = f'"{column.name}"'
+        connection.exec_driver_sql(f"UPDATE {table.name} SET {name} = convert_key({name})")
+
+
+def convert_postgresql(connection, columns, target: str) -> None:
+    newType, using = ("UUID", "{}::uuid") if target == "binary" else ("VARCHAR", "{}::text")
+    foreignKeys = [
+        constraint
+        for table in Base.metadata.sorted_tables
+        for constraint in table.foreign_key_constraints
+    ]
+    for constraint in foreignKeys:
+        connection.execute(DropConstraint(constraint))
+    for table, column in columns:
+        name = f'"{column.name}"'
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table.name} ALTER COLUMN {name} TYPE {newType} USING {using.format(name)}"
+        )
+    for constraint in foreignKeys:
+        connection.execute(AddConstraint(constraint))
+
+
+def migrate_ids(target: str) -> int:
+    """Rewrite every key column into `target` storage; returns the number of columns converted."""
+    with engine.begin() as connection:
+        stored = inspect(connection).has_table(StorageSetting.__tablename__) and connection.scalar(
+            select(StorageSetting.value).where(StorageSetting.name == "id_storage")
+        )
+        if not stored:
+            raise SystemExit(
+                "The database does not record its id storage yet; "
+                "start the API once with the current MEOW_ID_STORAGE first"
+            )
+        if stored == target:
+            return 0
+
+        columns = key_columns()
+        if connection.dialect.name == "sqlite":
+            convert_sqlite(connection, columns, target)
+        elif connection.dialect.name == "postgresql":
+            convert_postgresql(connection, columns, target)
+        else:
+            raise SystemExit(f"Key conversion is not implemented for {connection.dialect.name}")
+        connection.execute(
+            update(StorageSetting)
+            .where(StorageSetting.name == "id_storage")
+            .values(value=target)
+        )
+    return len(columns)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", required=True, choices=["text", "binary"], dest="target")
+    args = parser.parse_args()
+
+    converted = migrate_ids(args.target)
+    if converted:
+        print(f"Converted {converted} key column(s) to {args.target}")
+    else:
+        print(f"Keys are already stored as {args.target}")
+    print(f"Start the API with MEOW_ID_STORAGE={args.target}")
+
+
+if __name__ == "__main__":
+    main()
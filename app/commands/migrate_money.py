@@ -0,0 +1,98 @@
+"""
+Convert the money columns of a database between NUMERIC and integer minor units.
+
+    python -m app.commands.migrate_money --to minor_units
+    python -m app.commands.migrate_money --to numeric
+
+Stop the API first, and start it again with the matching MEOW_MONEY_STORAGE. Every money
+column is rewritten in one transaction: in place on SQLite, with ALTER COLUMN ... TYPE on
+PostgreSQL.
+"""
+
+import argparse
+
+from sqlalchemy import inspect, select, update
+
+from ..utils.database import Base, engine
+from ..utils.models import Money, StorageSetting
+from ..utils.money import MONEY_SCALE
+
+
+def money_columns():
+    return [
+        (table, column)
+        for table in Base.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, Money)
+    ]
+
+
+def convert_column(connection, table, column, target: str) -> None:
+    factor = 10**MONEY_SCALE
+    name = f'"{column.name}"'
+    if connection.dialect.name == "sqlite":
+        value = (
+            f"CAST(ROUND({name} * {factor}) AS INTEGER)"
+            if target == "minor_units"
+            else f"{name} / {factor}.0"
+        )
+        connection.exec_driver_sql(f"UPDATE {table.name} SET {name} = {value}")
+    elif connection.dialect.name == "postgresql":
+        newType, using = (
+            ("BIGINT", f"round({name} * {factor})::bigint")
+            if target == "minor_units"
+            else (f"NUMERIC(18, {MONEY_SCALE})", f"{name} / {factor}.0")
+        )
+        if column.server_default is not None:
+            connection.exec_driver_sql(f"ALTER TABLE {table.name} ALTER COLUMN {name} DROP DEFAULT")
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table.name} ALTER COLUMN {name} TYPE {newType} USING {using}"
+        )
+        if column.server_default is not None:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {table.name} ALTER COLUMN {name} SET DEFAULT {column.server_default.arg}"
+            )
+    else:
+        raise SystemExit(f"Money conversion is not implemented for {connection.dialect.name}")
+
+
+def migrate_money(target: str) -> int:
+    """Rewrite every money column into `target` storage; returns the number of columns converted."""
+    with engine.begin() as connection:
+        stored = inspect(connection).has_table(StorageSetting.__tablename__) and connection.scalar(
+            select(StorageSetting.value).where(StorageSetting.name == "money_storage")
+        )
+        if not stored:
+            raise SystemExit(
+                "The database does not record its money storage yet; "
+                "start the API once with the current MEOW_MONEY_STORAGE first"
+            )
+        if stored == target:
+            return 0
+
+        columns = money_columns()
+        for table, column in columns:
+            convert_column(connection, table, column, target)
+        connection.execute(
+            update(StorageSetting)
+            .where(StorageSetting.name == "money_storage")
+            .values(value=target)
+        )
+    return len(columns)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", required=True, choices=["numeric", "minor_units"], dest="target")
+    args = parser.parse_args()
+
+    converted = migrate_money(args.target)
+    if converted:
+        print(f"Converted {converted} money column(s) to {args.target}")
+    else:
+        print(f"Money is already stored as {args.target}")
+    print(f"Start the API with MEOW_MONEY_STORAGE={args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Delete expired idempotency keys.
+
+    python -m app.commands.purge_idempotency_keys
+
+Expired keys are already ignored by the transfer endpoint; this only reclaims their rows.
+Run it periodically, e.g. from cron.
+"""
+
+import argparse
+
+from ..utils import idempotency
+from ..utils.database import ShardWriteSessionLocal, init_db
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    init_db()
+    deleted = 0
+    for sessionFactory in ShardWriteSessionLocal:  # keys are kept on the shard of the source account
+        with sessionFactory() as db:
+            deleted += idempotency.purge_expired(db)
+            db.commit()
+    print(f"Purged {deleted} expired idempotency key(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Recompute the summary aggregates of accounts from the ledger.
+
+    python -m app.commands.rebuild_aggregates            # every account
+    python -m app.commands.rebuild_aggregates --account ID [--account ID ...]
+
+Each account is rewritten by one correlated UPDATE, using the account history index,
+so the counters and the ledger are read in the same statement. Archived months count
+with the totals of the archive catalog. The counters of balance slots are zeroed, the
+rebuilt ones on the account row cover the whole ledger. With MEOW_SHARD_URLS the accounts
+of every shard are rebuilt, each in its shard's own transaction.
+"""
+
+import argparse
+from datetime import datetime, timezone
+
+from sqlalchemy import case, func, select, update
+
+from ..utils import ledger
+from ..utils.database import ShardWriteSessionLocal, init_db
+from ..utils.models import Account, ArchivedMonth, BalanceSlot, Transaction
+from ..utils.sharding import shard_of
+
+
+def rebuild_aggregates(db, accountIds=None) -> int:
+    """Rewrite the aggregates of `accountIds` (all accounts when None); returns rows updated."""
+    accounts = Account.__table__
+    transactions = Transaction.__table__
+    archivedMonths = ArchivedMonth.__table__
+    month = ledger.current_month(datetime.now(timezone.utc))
+    monthStart = datetime.strptime(month, "%Y-%m")
+
+    def ledgerTotal(expression, *criteria):
+        return (
+            select(func.coalesce(expression, 0))
+            .where(transactions.c.accountId == accounts.c.accountId, *criteria)
+            .scalar_subquery()
+        )
+
+    def archivedTotal(column):
+        return (
+            select(func.coalesce(func.sum(column), 0))
+            .where(archivedMonths.c.accountId == accounts.c.accountId)
+            .scalar_subquery()
+        )
+
+    statement = update(accounts).values(
+        totalTransactions=ledgerTotal(func.count()) + archivedTotal(archivedMonths.c.rows),
+        totalCredits=ledgerTotal(
+            func.sum(case((transactions.c.amount > 0, transactions.c.amount), else_=0))
+        )
+        + archivedTotal(archivedMonths.c.credits),
+        totalDebits=ledgerTotal(
+            func.sum(case((transactions.c.amount < 0, -transactions.c.amount), else_=0))
+        )
+        + archivedTotal(archivedMonths.c.debits),
+        monthKey=month,
+        monthTransactions=ledgerTotal(func.count(), transactions.c.date >= monthStart),
+    )
+    slotStatement = update(BalanceSlot.__table__).values(
+        totalTransactions=0, totalCredits=0, totalDebits=0, monthKey=None, monthTransactions=0
+    )
+    if accountIds:
+        statement = statement.where(accounts.c.accountId.in_(accountIds))
+        slotStatement = slotStatement.where(BalanceSlot.__table__.c.accountId.in_(accountIds))
+
+    db.execute(slotStatement)
+    return db.execute(statement).rowcount
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--account", action="append", dest="accounts", help="only rebuild this account")
+    args = parser.parse_args()
+
+    init_db()
+    updated = 0
+    for shard, sessionFactory in enumerate(ShardWriteSessionLocal):
+        # An account's ledger is on its own shard, which its key names
+        accountIds = [accountId for accountId in args.accounts or () if shard_of(accountId) == shard]
+        if args.accounts and not accountIds:
+            continue
+        with sessionFactory() as db:
+            updated += rebuild_aggregates(db, accountIds or None)
+            db.commit()
+    print(f"Rebuilt aggregates of {updated} account(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+Reconcile the ledger: every account balance against its transactions, and every transfer
+against its two legs.
+
+    python -m app.commands.reconcile
+    python -m app.commands.reconcile --workers 8 --ranges 256 --output reconciliation.json
+
+Two checks, each split into key ranges that a process pool works through:
+
+- accounts: opening balance + SUM(amount) of the later transactions must equal
+  Account.balance. The opening balance is the account's first balance checkpoint,
+  written when it was opened (for accounts opened before checkpoints existed, the first
+  checkpoint includes every transaction dated at or before it). Archived months count
+  with the totals of the archive catalog. Accounts without any checkpoint cannot be
+  checked and are only counted.
+- transfers: every transferId must have exactly one debit and one credit, which net to
+  zero when both are in one currency; a converted credit is not checked against its rate.
+  Archived transfers were checked while in the table and are not read again.
+
+Every range is one aggregate statement, so it reads a consistent snapshot while transfers
+keep committing, and its rows are streamed rather than loaded. Transfer ranges only
+return the transfers that fail the check. Ranges split the key space between the lowest
+and the highest key evenly, which balances random UUID4 keys and, for UUIDv7 keys, slices
+of time.
+
+With MEOW_SHARD_URLS every shard is checked the same way, its accounts against its own
+ledger. The legs of a transfer between two shards are on different databases: the
+transfers failing the check on one shard are grouped by transferId across all of them,
+and the ones still failing are read again, legs and intent, after one another (see
+`recheck_transfers`). A cross-shard transfer whose credit is still to be written is
+counted as pending, not as a discrepancy; `recover_transfers` completes it.
+
+Discrepancies are printed and, with --output, written as a JSON report. The command exits
+with status 1 when it found any, so a nightly job can alert on it.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, case, func, select
+
+from ..utils import balance_slots
+from ..utils.database import shardEngines
+from ..utils.ids import from_int, to_int
+from ..utils.models import Account, ArchivedMonth, BalanceCheckpoint, ShardTransfer, Transaction
+from ..utils.sharding import shard_of
+
+accounts = Account.__table__
+transactions = Transaction.__table__
+checkpoints = BalanceCheckpoint.__table__
+archivedMonths = ArchivedMonth.__table__
+shardTransfers = ShardTransfer.__table__
+
+STREAM_ROWS = 10000
+# transferIds per IN list when cross-shard transfers are read again
+RECHECK_CHUNK = 1000
+
+
+def key_ranges(shard: int, column, parts: int) -> list:
+    """`parts` (low, high) ranges covering every key of `column` on `shard`; None is unbounded."""
+    with shardEngines[shard].connect() as connection:
+        lowest, highest = connection.execute(select(func.min(column), func.max(column))).one()
+    if lowest is None:
+        return []
+    try:
+        low, high = to_int(lowest), to_int(highest)
+    except ValueError:  # keys that are not UUIDs cannot be split
+        return [(None, None)]
+
+    bounds = sorted({low + (high - low) * part // parts for part in range(1, parts)})
+    edges = [None, *(from_int(bound) for bound in bounds), None]
+    return list(zip(edges, edges[1:]))
+
+
+def in_range(column, low, high):
+    criteria = []
+    if low is not None:
+        criteria.append(column >= low)
+    if high is not None:
+        criteria.append(column < high)
+    return and_(True, *criteria)
+
+
+def account_statement(low, high):
+    ranked = (
+        select(
+            checkpoints.c.accountId,
+            checkpoints.c.asOf,
+            checkpoints.c.balance,
+            func.row_number()
+            .over(partition_by=checkpoints.c.accountId, order_by=checkpoints.c.asOf)
+            .label("rowNumber"),
+        )
+        .where(in_range(checkpoints.c.accountId, low, high))
+        .subquery()
+    )
+    opening = select(ranked).where(ranked.c.rowNumber == 1).subquery()
+
+    def archivedTotal(expression):
+        return (
+            select(func.coalesce(func.sum(expression), 0))
+            .where(
+                archivedMonths.c.accountId == accounts.c.accountId,
+                archivedMonths.c.lastDate > opening.c.asOf,
+            )
+            .scalar_subquery()
+        )
+
+    # Each account joins a range scan of its history index, summed in the same pass
+    return (
+        select(
+            accounts.c.accountId,
+            balance_slots.total(accounts.c.balance).label("balance"),
+            opening.c.balance.label("openingBalance"),
+            opening.c.asOf.label("openingAsOf"),
+            (
+                func.coalesce(func.sum(transactions.c.amount), 0)
+                + archivedTotal(archivedMonths.c.credits - archivedMonths.c.debits)
+            ).label("movement"),
+            (
+                func.count(transactions.c.transactionId) + archivedTotal(archivedMonths.c.rows)
+            ).label("entries"),
+        )
+        .select_from(
+            accounts.outerjoin(opening, opening.c.accountId == accounts.c.accountId).outerjoin(
+                transactions,
+                and_(
+                    transactions.c.accountId == accounts.c.accountId,
+                    transactions.c.date > opening.c.asOf,
+                ),
+            )
+        )
+        .where(in_range(accounts.c.accountId, low, high))
+        .group_by(
+            accounts.c.accountId,
+            accounts.c.balance,
+            accounts.c.balanceSlots,
+            opening.c.balance,
+            opening.c.asOf,
+        )
+        .order_by(accounts.c.accountId)
+    )
+
+
+def transfer_legs(*criteria):
+    """The legs of the transfers matching `criteria`, summed per transferId."""
+    return (
+        select(
+            transactions.c.transferId,
+            func.count().label("legs"),
+            func.sum(case((transactions.c.amount < 0, 1), else_=0)).label("debits"),
+            func.sum(case((transactions.c.amount > 0, 1), else_=0)).label("credits"),
+            func.sum(transactions.c.amount).label("net"),
+            func.min(transactions.c.currency).label("lowestCurrency"),
+            func.max(transactions.c.currency).label("highestCurrency"),
+        )
+        .where(transactions.c.transferId.isnot(None), *criteria)
+        .group_by(transactions.c.transferId)
+    )
+
+
+def transfer_statement(low, high):
+    debits = func.sum(case((transactions.c.amount < 0, 1), else_=0))
+    credits = func.sum(case((transactions.c.amount > 0, 1), else_=0))
+    currencies = func.count(transactions.c.currency.distinct())
+    return transfer_legs(in_range(transactions.c.transferId, low, high)).having(
+        (func.count() != 2)
+        | (debits != 1)
+        | (credits != 1)
+        | ((currencies == 1) & (func.sum(transactions.c.amount) != 0))
+    )
+
+
+def add_legs(transfers: dict, row: dict) -> None:
+    """Add the legs of one shard's `transfer_legs` row to the totals of its transferId."""
+    total = transfers.setdefault(
+        row["transferId"], {"legs": 0, "debits": 0, "credits": 0, "net": 0, "currencies": set()}
+    )
+    for field in ("legs", "debits", "credits", "net"):
+        total[field] += row[field]
+    total["currencies"].update((row["lowestCurrency"], row["highestCurrency"]))
+
+
+def is_balanced(total: dict) -> bool:
+    return (
+        total["legs"] == 2
+        and total["debits"] == 1
+        and total["credits"] == 1
+        and (len(total["currencies"]) > 1 or total["net"] == 0)
+    )
+
+
+def transfer_discrepancy(transferId, total: dict) -> dict:
+    return {
+        "transferId": transferId,
+        "legs": total["legs"],
+        "debits": total["debits"],
+        "credits": total["credits"],
+        "net": str(total["net"]),
+    }
+
+
+def reconcile_accounts(shard: int, low, high) -> dict:
+    checked = unverified = 0
+    discrepancies = []
+    with shardEngines[shard].connect() as connection:
+        rows = connection.execution_options(stream_results=True, yield_per=STREAM_ROWS).execute(
+            account_statement(low, high)
+        )
+        for row in rows:
+            checked += 1
+            if row.openingAsOf is None:
+                unverified += 1
+                continue
+            expected = row.openingBalance + row.movement
+            if expected != row.balance:
+                discrepancies.append(
+                    {
+                        "accountId": row.accountId,
+                        "balance": str(row.balance),
+                        "expected": str(expected),
+                        "difference": str(row.balance - expected),
+                        "openingBalance": str(row.openingBalance),
+                        "openingAsOf": row.openingAsOf.isoformat(),
+                        "entries": row.entries,
+                    }
+                )
+    return {"checked": checked, "unverified": unverified, "discrepancies": discrepancies}
+
+
+def reconcile_transfers(shard: int, low, high) -> list:
+    """The transfers of one key range of `shard` failing the check there, as `transfer_legs` rows."""
+    with shardEngines[shard].connect() as connection:
+        rows = connection.execution_options(stream_results=True, yield_per=STREAM_ROWS).execute(
+            transfer_statement(low, high)
+        )
+        return [dict(row._mapping) for row in rows]
+
+
+def recheck_transfers(transferIds: list) -> tuple:
+    """
+    Read transfers failing the check again, across every shard; returns their discrepancies
+    and how many are pending.
+
+    The shards are not read at one snapshot, so the first pass can see the debit of a
+    cross-shard transfer without the credit it committed since. The intents are read
+    first: phase 2 commits the credit before it marks the intent completed, so the legs
+    read afterwards include the credit of every completed intent. A transfer still
+    prepared is pending, unless its credit has been written meanwhile. Transfers archived
+    in between are not read again, like in the first pass.
+    """
+    chunks = [
+        transferIds[start : start + RECHECK_CHUNK] for start in range(0, len(transferIds), RECHECK_CHUNK)
+    ]
+    prepared = set()
+    for chunk in chunks:
+        byShard = {}
+        for transferId in chunk:  # the intent is on the source shard, whose key it carries
+            byShard.setdefault(shard_of(transferId), []).append(transferId)
+        for shard, shardTransferIds in byShard.items():
+            with shardEngines[shard].connect() as connection:
+                prepared.update(
+                    connection.scalars(
+                        select(shardTransfers.c.transferId).where(
+                            shardTransfers.c.transferId.in_(shardTransferIds),
+                            shardTransfers.c.status == "prepared",
+                        )
+                    )
+                )
+
+    transfers = {}
+    for shardEngine in shardEngines:
+        with shardEngine.connect() as connection:
+            for chunk in chunks:
+                for row in connection.execute(transfer_legs(transactions.c.transferId.in_(chunk))):
+                    add_legs(transfers, row._mapping)
+
+    discrepancies = []
+    pending = 0
+    for transferId, total in transfers.items():
+        if is_balanced(total):
+            continue
+        if transferId in prepared:
+            pending += 1
+        else:
+            discrepancies.append(transfer_discrepancy(transferId, total))
+    return discrepancies, pending
+
+
+def reconcile(workers: int, ranges: int) -> dict:
+    """Run both checks on every shard over `ranges` key ranges each, on `workers` processes."""
+    started = time.perf_counter()
+    accountRanges = [
+        (shard, low, high)
+        for shard in range(len(shardEngines))
+        for low, high in key_ranges(shard, accounts.c.accountId, ranges)
+    ]
+    transferRanges = [
+        (shard, low, high)
+        for shard in range(len(shardEngines))
+        for low, high in key_ranges(shard, transactions.c.transferId, ranges)
+    ]
+
+    # Child processes open their own connections, see database.py
+    for shardEngine in shardEngines:
+        shardEngine.dispose()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        accountResults = pool.map(reconcile_accounts, *zip(*accountRanges)) if accountRanges else []
+        transferResults = pool.map(reconcile_transfers, *zip(*transferRanges)) if transferRanges else []
+
+        report = {
+            "startedAt": datetime.now(timezone.utc).isoformat(),
+            "accounts": {"checked": 0, "unverified": 0, "discrepancies": []},
+            "transfers": {"pending": 0, "discrepancies": []},
+        }
+        for result in accountResults:
+            report["accounts"]["checked"] += result["checked"]
+            report["accounts"]["unverified"] += result["unverified"]
+            report["accounts"]["discrepancies"].extend(result["discrepancies"])
+        # The legs of a cross-shard transfer fail the check on each shard, and add up here
+        transfers = {}
+        for result in transferResults:
+            for row in result:
+                add_legs(transfers, row)
+
+    failing = [transferId for transferId, total in transfers.items() if not is_balanced(total)]
+    if len(shardEngines) > 1:
+        report["transfers"]["discrepancies"], report["transfers"]["pending"] = recheck_transfers(failing)
+    else:
+        report["transfers"]["discrepancies"] = [
+            transfer_discrepancy(transferId, transfers[transferId]) for transferId in failing
+        ]
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes in the pool")
+    parser.add_argument("--ranges", type=int, default=64, help="key ranges per check")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = reconcile(args.workers, args.ranges)
+    accountDiscrepancies = report["accounts"]["discrepancies"]
+    transferDiscrepancies = report["transfers"]["discrepancies"]
+
+    for discrepancy in accountDiscrepancies:
+        print(
+            f"account {discrepancy['accountId']}: balance {discrepancy['balance']}, "
+            f"ledger says {discrepancy['expected']} (off by {discrepancy['difference']})"
+        )
+    for discrepancy in transferDiscrepancies:
+        print(
+            f"transfer {discrepancy['transferId']}: {discrepancy['legs']} leg(s), "
+            f"{discrepancy['debits']} debit(s), {discrepancy['credits']} credit(s), net {discrepancy['net']}"
+        )
+    print(
+        f"Checked {report['accounts']['checked']} account(s) "
+        f"({report['accounts']['unverified']} without an opening checkpoint) in {report['seconds']} s: "
+        f"{len(accountDiscrepancies)} account and {len(transferDiscrepancies)} transfer discrepancies"
+    )
+    if report["transfers"]["pending"]:
+        print(
+            f"{report['transfers']['pending']} cross-shard transfer(s) are still to be credited, "
+            "see python -m app.commands.recover_transfers"
+        )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Report written to {args.output}")
+
+    if accountDiscrepancies or transferDiscrepancies:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Complete cross-shard transfers that were debited but not yet credited.
+
+    python -m app.commands.recover_transfers
+    python -m app.commands.recover_transfers --older-than 60
+
+A transfer between accounts on two shards debits the source and records its intent in
+one transaction, then credits the destination in a second one (see `utils/sharding.py`).
+A worker that stops in between leaves the intent prepared; this credits it. Workers also
+run it when they start. It is safe to run at any time: a credit is never written twice.
+"""
+
+import argparse
+from datetime import timedelta
+
+from ..utils.database import init_db
+from ..utils.sharding import SHARD_COUNT, recover_transfers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--older-than", type=float, default=0, help="only transfers prepared at least this many seconds ago"
+    )
+    args = parser.parse_args()
+
+    init_db()
+    recovered = recover_transfers(timedelta(seconds=args.older_than))
+    print(f"Completed {recovered} cross-shard transfer(s) over {SHARD_COUNT} shard(s)")
+
+
+if __name__ == "__main__":
+    main()
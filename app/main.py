@@ -1,9 +1,16 @@
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from .utils.database import init_db
-from .routers import customer, account, transfer, transaction
+from .utils import metrics, sharding
+from .utils.config import settings
+from .utils.database import init_db, async_engine
+from .utils.group_commit import transfer_schedulers
+from .routers import customer, account, transfer, transaction, fx
 
+log = logging.getLogger("app.main")
 
 APP_Version = "1.0.4"
 # Initialize FastAPI application
@@ -59,19 +66,70 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST"],  # rest are outside the scope for this assessment
     allow_headers=["*"],
+    # keyset pagination of account transactions, replayed idempotent transfers, request timings
+    expose_headers=["X-Next-Cursor", "Idempotency-Replayed", "Server-Timing"],
 )
 
+if settings.metrics_enabled:
+    # Outermost, so the timings include the CORS handling and error responses
+    app.add_middleware(metrics.MetricsMiddleware)
+
 
 @app.on_event("startup")
 def startup_event():
     init_db()
     print(" Database initialized")
+    if sharding.SHARD_COUNT > 1:
+        # Cross-shard transfers a stopped process left half done
+        recovered = sharding.recover_transfers()
+        if recovered:
+            log.warning("Completed %s cross-shard transfers a stopped worker left pending", recovered)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for scheduler in transfer_schedulers:
+        scheduler.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+def use_async_handlers(router, asyncRouter) -> None:
+    """Replace every route of `router` that `asyncRouter` also defines, keeping route order."""
+    asyncRoutes = {
+        (route.path, frozenset(route.methods)): route for route in asyncRouter.routes
+    }
+    router.routes[:] = [
+        asyncRoutes.get((route.path, frozenset(route.methods)), route)
+        for route in router.routes
+    ]
+
+
+if settings.async_mode:
+    from .routers import aio
+
+    for syncModule, asyncModule in (
+        (customer, aio.customer),
+        (account, aio.account),
+        (transfer, aio.transfer),
+        (transaction, aio.transaction),
+    ):
+        use_async_handlers(syncModule.router, asyncModule.router)
 
 
 app.include_router(customer.router)
 app.include_router(account.router)
 app.include_router(transfer.router)
 app.include_router(transaction.router)
+app.include_router(fx.router)
+
+
+if settings.metrics_enabled:
+
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def get_metrics():
+        """Prometheus text format, for this worker process."""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/", tags=["root"])
@@ -86,5 +144,6 @@ async def root():
             "accounts": "/api/v1/accounts",
             "transfers": "/api/v2/transfers",
             "transactions": "/api/v2/transactions",
+            "fx-rates": "/api/v1/fx-rates",
         },
     }
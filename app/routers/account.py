@@ -1,21 +1,34 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime, timezone
 from decimal import Decimal
 
-from ..utils.database import get_db
-from ..utils.models import Customer, Account
-from ..utils import schemas
+from ..utils.models import Customer, Account, BalanceCheckpoint
+from ..utils import schemas, ledger, balance_slots
+from ..utils.admission import account_customers, admission_control
+from ..utils.cache import balance_cache
+from ..utils.metrics import query_budget
+from ..utils.rows import RowsResponse, schema_columns
+from ..utils.sharding import Shards, get_shards, get_write_shards, page_across, shard_db
 
 router = APIRouter(prefix="/api/v1/accounts", tags=["accounts"])
 
+# The balance of a split account is added up from its slots, see `utils/balance_slots.py`
+ACCOUNT_COLUMNS = tuple(
+    balance_slots.total(column).label("balance") if column is Account.balance else column
+    for column in schema_columns(schemas.Account, Account)
+)
 
-@router.post("/", response_model=schemas.Account, status_code=status.HTTP_201_CREATED,summary="Create a new Financial Institute Account for existing Customer. -- ASSESSMENT FUNCTIONALITY --")
-def create_account(account: schemas.AccountCreate, db: Session = Depends(get_db)):
+
+@router.post("/", response_model=schemas.Account, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(6)), Depends(admission_control(account_customers))],summary="Create a new Financial Institute Account for existing Customer. -- ASSESSMENT FUNCTIONALITY --")
+def create_account(account: schemas.AccountCreate, shards: Shards = Depends(get_write_shards)):
     """
     Create a new Financial Institute account for a customer
     Types of accounts could be 'savings', 'checking' for now.
+    The account is opened on its customer's shard.
     """
+    db = shards.for_key(account.customerId)
     customer = (
         db.query(Customer).filter(Customer.customerId == account.customerId).first()
     )  # Verify customer exists
@@ -26,16 +39,37 @@ def create_account(account: schemas.AccountCreate, db: Session = Depends(get_db)
             detail=f"Customer with ID {account.customerId} not found",
         )
 
-    dbAccount = Account(**account.model_dump())
+    # The opening balance is the account's first checkpoint
+    now = datetime.now(timezone.utc)
+    dbAccount = Account(
+        **account.model_dump(), createdAt=now, updatedAt=now, checkpointAt=now
+    )
     db.add(dbAccount)
+    db.flush()
+    db.add(
+        BalanceCheckpoint(accountId=dbAccount.accountId, asOf=now, balance=dbAccount.balance)
+    )
     db.commit()
     db.refresh(dbAccount)
 
     return dbAccount
 
 
-@router.get("/{accountId}/balance", response_model=schemas.AccountBalance,summary="Get current balance of an existing Account.-- ASSESSMENT FUNCTIONALITY --")
-def get_account_balance(accountId: str, db: Session = Depends(get_db)):
+@router.get("/{accountId}/balance", response_model=schemas.AccountBalance, dependencies=[Depends(query_budget(4))],summary="Get current balance of an existing Account.-- ASSESSMENT FUNCTIONALITY --")
+def get_account_balance(
+    accountId: str, asOf: Optional[datetime] = None, db: Session = Depends(shard_db("accountId"))
+):
+    """
+    Current balance, or with `asOf` the balance at that point in time, computed from the
+    nearest balance checkpoint instead of replaying the whole history.
+    Current balances are served from the balance cache when possible.
+    """
+    if asOf is None:
+        cached = balance_cache.get(accountId)
+        if cached is not None:
+            return cached
+        cacheToken = balance_cache.token(accountId)  # taken before the database read
+
     account = db.query(Account).filter(Account.accountId == accountId).first()
 
     if not account:
@@ -44,27 +78,70 @@ def get_account_balance(accountId: str, db: Session = Depends(get_db)):
             detail=f"Account with ID {accountId} not found",
         )
 
-    return schemas.AccountBalance(
+    if asOf is None:
+        balance_slots.load_totals(db, [account])
+        balance = account.balance
+    elif ledger.utc_naive(asOf) < ledger.utc_naive(account.createdAt):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Account with ID {accountId} was opened after {asOf}",
+        )
+    else:
+        balance = ledger.balance_as_of(db, accountId, asOf)
+
+    accountBalance = schemas.AccountBalance(
         accountId=account.accountId,
         accountName=account.name,
-        balance=account.balance,
+        balance=balance,
         currency=account.currency,
         lastUpdated=account.updatedAt,
+        asOf=asOf,
     )
+    if asOf is None:
+        balance_cache.set(accountId, accountBalance, cacheToken)
+
+    return accountBalance
 
 
+@router.get("/balance-cache/stats", response_model=dict,summary="Hit and miss counters of the balance cache")
+def get_balance_cache_stats():
+    return balance_cache.stats()
 
-@router.get("/", response_model=List[schemas.Account],summary="List all existing accounts")
+
+
+@router.get("/{accountId}/summary", response_model=schemas.AccountSummary, dependencies=[Depends(query_budget(2))],summary="Get transaction totals of an existing Account")
+def get_account_summary(accountId: str, db: Session = Depends(shard_db("accountId"))):
+    """
+    Served from the aggregates kept on the account row, the transactions table is not read.
+    """
+    account = db.query(Account).filter(Account.accountId == accountId).first()
+
+    if not account:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Account with ID {accountId} not found",
+        )
+    balance_slots.load_totals(db, [account])
+
+    return schemas.AccountSummary(
+        accountId=account.accountId,
+        accountName=account.name,
+        balance=account.balance,
+        totalTransactions=account.totalTransactions,
+        totalCredits=account.totalCredits,
+        totalDebits=account.totalDebits,
+    )
+
+
+@router.get("/", response_model=List[schemas.Account], dependencies=[Depends(query_budget(2))],summary="List all existing accounts")
 def list_accounts(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    shards: Shards = Depends(get_shards),
 ):
     """
     List all Financial institute accounts
-    Helper Service to fetch all accounts
+    Helper Service to fetch all accounts, served by the lean read path (`utils/rows.py`)
     """
-    query = db.query(Account)
-
-    accounts = query.offset(skip).limit(limit).all()
-    return accounts
+    accounts = page_across(shards, lambda db: db.query(*ACCOUNT_COLUMNS), skip, limit)
+    return RowsResponse(accounts)
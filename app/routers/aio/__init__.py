@@ -0,0 +1,9 @@
+"""
+Async versions of the core route handlers, used when `async_mode` is enabled.
+
+Each router mirrors the path and method of its sync counterpart in `app/routers`, so
+`app.main` can swap the handlers in place. Routes without an async version keep being
+served by the sync handler on the threadpool.
+"""
+
+from . import customer, account, transaction, transfer  # noqa: F401
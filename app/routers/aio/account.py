@@ -0,0 +1,119 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime, timezone
+
+from ...utils.database import get_async_db, get_async_write_db
+from ...utils.models import Customer, Account, BalanceCheckpoint
+from ...utils import schemas, ledger, balance_slots
+from ...utils.admission import account_customers, admission_control
+from ...utils.cache import balance_cache
+from ...utils.metrics import query_budget
+from ...utils.rows import RowsResponse, schema_columns
+
+router = APIRouter(prefix="/api/v1/accounts", tags=["accounts"])
+
+# The balance of a split account is added up from its slots, see `utils/balance_slots.py`
+ACCOUNT_COLUMNS = tuple(
+    balance_slots.total(column).label("balance") if column is Account.balance else column
+    for column in schema_columns(schemas.Account, Account)
+)
+
+
+@router.post("/", response_model=schemas.Account, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(6)), Depends(admission_control(account_customers))],summary="Create a new Financial Institute Account for existing Customer. -- ASSESSMENT FUNCTIONALITY --")
+async def create_account(
+    account: schemas.AccountCreate, db: AsyncSession = Depends(get_async_write_db)
+):
+    """
+    Create a new Financial Institute account for a customer
+    Types of accounts could be 'savings', 'checking' for now.
+    """
+    customer = await db.scalar(
+        select(Customer.customerId).where(Customer.customerId == account.customerId)
+    )  # Verify customer exists
+
+    if not customer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Customer with ID {account.customerId} not found",
+        )
+
+    # The opening balance is the account's first checkpoint
+    now = datetime.now(timezone.utc)
+    dbAccount = Account(
+        **account.model_dump(), createdAt=now, updatedAt=now, checkpointAt=now
+    )
+    db.add(dbAccount)
+    await db.flush()
+    db.add(
+        BalanceCheckpoint(accountId=dbAccount.accountId, asOf=now, balance=dbAccount.balance)
+    )
+    await db.commit()
+    await db.refresh(dbAccount)
+
+    return dbAccount
+
+
+@router.get("/{accountId}/balance", response_model=schemas.AccountBalance, dependencies=[Depends(query_budget(4))],summary="Get current balance of an existing Account.-- ASSESSMENT FUNCTIONALITY --")
+async def get_account_balance(
+    accountId: str,
+    asOf: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Current balance, or with `asOf` the balance at that point in time, computed from the
+    nearest balance checkpoint instead of replaying the whole history.
+    Current balances are served from the balance cache when possible.
+    """
+    if asOf is None:
+        cached = balance_cache.get(accountId)
+        if cached is not None:
+            return cached
+        cacheToken = balance_cache.token(accountId)  # taken before the database read
+
+    account = await db.scalar(select(Account).where(Account.accountId == accountId))
+
+    if not account:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Account with ID {accountId} not found",
+        )
+
+    if asOf is None:
+        await db.run_sync(balance_slots.load_totals, [account])
+        balance = account.balance
+    elif ledger.utc_naive(asOf) < ledger.utc_naive(account.createdAt):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Account with ID {accountId} was opened after {asOf}",
+        )
+    else:
+        balance = await db.run_sync(ledger.balance_as_of, accountId, asOf)
+
+    accountBalance = schemas.AccountBalance(
+        accountId=account.accountId,
+        accountName=account.name,
+        balance=balance,
+        currency=account.currency,
+        lastUpdated=account.updatedAt,
+        asOf=asOf,
+    )
+    if asOf is None:
+        balance_cache.set(accountId, accountBalance, cacheToken)
+
+    return accountBalance
+
+
+@router.get("/", response_model=List[schemas.Account], dependencies=[Depends(query_budget(2))],summary="List all existing accounts")
+async def list_accounts(
+    skip: int = 0,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    List all Financial institute accounts
+    Helper Service to fetch all accounts, served by the lean read path (`utils/rows.py`)
+    """
+    accounts = await db.execute(select(*ACCOUNT_COLUMNS).offset(skip).limit(limit))
+    return RowsResponse(accounts.all())
@@ -0,0 +1,104 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Union
+
+from ...utils.database import get_async_db, get_async_write_db
+from ...utils.models import Customer
+from ...utils import schemas, balance_slots
+from ...utils.expand import (
+    CUSTOMER_EXPANSIONS,
+    DEFAULT_TRANSACTIONS_PER_ACCOUNT,
+    MAX_TRANSACTIONS_PER_ACCOUNT,
+    attach_recent_transactions,
+    customer_load_options,
+    parse_expand,
+)
+from ...utils.admission import admission_control
+from ...utils.metrics import query_budget
+from ...utils.rows import RowsResponse, schema_columns
+
+router = APIRouter(prefix="/api/v1/customers", tags=["customers"])
+
+CUSTOMER_COLUMNS = schema_columns(schemas.Customer, Customer)
+
+
+@router.post("/", response_model=schemas.Customer, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(5)), Depends(admission_control())])
+async def create_customer(
+    customer: schemas.CustomerCreate, db: AsyncSession = Depends(get_async_write_db)
+):
+    """
+    Create a new customer
+    Helper Service to create customers for creating Financial Institute accounts
+    """
+    existingCustomer = await db.scalar(
+        select(Customer.customerId).where(Customer.email == customer.email)
+    )  # Check if email already exists
+
+    if existingCustomer:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Customer with email {customer.email} already exists",
+        )
+
+    dbCustomer = Customer(**customer.model_dump())
+    db.add(dbCustomer)
+    await db.commit()
+    await db.refresh(dbCustomer)
+
+    return dbCustomer
+
+
+@router.get(
+    "/{customerId}",
+    response_model=Union[
+        schemas.CustomerWithAccountTransactions, schemas.CustomerWithAccounts, schemas.Customer
+    ],
+    dependencies=[Depends(query_budget(4))],summary="Get Customer Details and exisitng Accounts"
+)
+async def get_customer(
+    customerId: str,
+    expand: str = Query("accounts", description="Comma-separated: accounts, accounts.transactions"),
+    transactionsPerAccount: int = Query(
+        DEFAULT_TRANSACTIONS_PER_ACCOUNT, ge=1, le=MAX_TRANSACTIONS_PER_ACCOUNT
+    ),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    List customer details and accounts by customerId
+    Helper Service to fetch customer details
+    `expand=accounts.transactions` adds the newest transactions of every account.
+    """
+    expansions = parse_expand(expand, CUSTOMER_EXPANSIONS)
+    customer = await db.scalar(
+        select(Customer)
+        .where(Customer.customerId == customerId)
+        .options(*customer_load_options(expansions))  # no lazy loads in async code
+    )
+    if not customer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Customer with ID {customerId} not found",
+        )
+
+    if "accounts" in expansions or "accounts.transactions" in expansions:
+        await db.run_sync(balance_slots.load_totals, customer.accounts)
+    if "accounts.transactions" in expansions:
+        await db.run_sync(
+            attach_recent_transactions, customer.accounts, transactionsPerAccount
+        )
+        return schemas.CustomerWithAccountTransactions.model_validate(customer)
+    if "accounts" in expansions:
+        return schemas.CustomerWithAccounts.model_validate(customer)
+    return schemas.Customer.model_validate(customer)
+
+
+@router.get("/", response_model=List[schemas.Customer], dependencies=[Depends(query_budget(2))])
+async def list_customers(
+    skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)
+):
+    """
+    List all customers
+    Helper Service to fetch all customers, served by the lean read path (`utils/rows.py`)"""
+    customers = await db.execute(select(*CUSTOMER_COLUMNS).offset(skip).limit(limit))
+    return RowsResponse(customers.all())
@@ -0,0 +1,111 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
+
+from ...utils.database import get_async_db
+from ...utils.models import Account, Transaction
+from ...utils.pagination import encode_cursor, decode_cursor
+from ...utils import archive, schemas
+from ...utils.metrics import extend_query_budget, query_budget
+from ...utils.rows import RowsResponse, schema_columns
+
+router = APIRouter(prefix="/api/v2/transactions", tags=["transactions"])
+
+TRANSACTION_COLUMNS = schema_columns(schemas.Transaction, Transaction)
+
+
+@router.get("/account/{accountId}", response_model=List[schemas.Transaction], dependencies=[Depends(query_budget(3))],summary="Get all Transactions linked to an AccountID. -- ASSESSMENT FUNCTIONALITY --")
+async def get_account_transactions(
+    accountId: str,
+    skip: int = 0,
+    limit: int = 100,
+    startDate: Optional[datetime] = None,
+    endDate: Optional[datetime] = None,
+    transfersOnly: bool = False,  # only transactions that belong to a transfer
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Newest transactions first. A full page carries an `X-Next-Cursor` header; pass it back
+    as `cursor` to get the next page at the same cost as the first one (`skip` is then ignored).
+    Served by the lean read path, see `utils/rows.py`. A page that runs past the oldest
+    transaction in the table continues into the archive, see `utils/archive.py`.
+    """
+    account = await db.scalar(
+        select(Account.accountId).where(Account.accountId == accountId)
+    )
+    if not account:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Account with ID {accountId} not found",
+        )
+
+    query = select(*TRANSACTION_COLUMNS).where(Transaction.accountId == accountId)
+
+    if transfersOnly:
+        query = query.where(Transaction.transferId.isnot(None))
+
+    if startDate:
+        query = query.where(Transaction.date >= startDate)
+
+    if endDate:
+        query = query.where(Transaction.date <= endDate)
+
+    matching = query
+    query = query.order_by(Transaction.date.desc(), Transaction.transactionId.desc())
+
+    before = decode_cursor(cursor) if cursor else None
+    if before:
+        query = query.where(tuple_(Transaction.date, Transaction.transactionId) < before)
+    else:
+        query = query.offset(skip)
+
+    transactions = (await db.execute(query.limit(limit))).all()
+
+    if len(transactions) < limit:
+        archiveSkip = 0
+        if not before and skip and not transactions:  # the table rows skipped were fewer than skip
+            extend_query_budget(1)
+            tableRows = await db.scalar(select(func.count()).select_from(matching.subquery()))
+            archiveSkip = max(skip - tableRows, 0)
+        transactions += await db.run_sync(
+            archive.history_page,
+            accountId,
+            startDate,
+            endDate,
+            transfersOnly,
+            before,
+            archiveSkip,
+            limit - len(transactions),
+        )
+
+    headers = {}
+    if transactions and len(transactions) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(
+            transactions[-1].date, transactions[-1].transactionId
+        )
+
+    return RowsResponse(transactions, headers=headers)
+
+
+@router.get("/{transactionId}", response_model=schemas.Transaction,summary="Get account linked Transaction by TransactionID")
+async def get_transaction(transactionId: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Get transaction details by transactionId
+    Helper Service to fetch transaction details, archived transactions included
+    """
+    transaction = await db.scalar(
+        select(Transaction).where(Transaction.transactionId == transactionId)
+    )
+    if not transaction:
+        archived = await db.run_sync(archive.find, transactionId, "transactionId")
+        if not archived:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Transaction with ID {transactionId} not found",
+            )
+        return schemas.Transaction(**archived[0]._asdict())
+
+    return transaction
@@ -0,0 +1,147 @@
+import asyncio
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from datetime import datetime, timezone
+
+from ...utils.config import settings
+from ...utils.database import get_async_db, get_async_write_db
+from ...utils.models import Transaction
+from ...utils import schemas, ledger, idempotency, archive
+from ...utils.admission import admission_control, transfer_customers
+from ...utils.group_commit import transfer_scheduler
+from ...utils.metrics import query_budget
+
+router = APIRouter(prefix="/api/v2/transfers", tags=["transfers"])
+
+
+@router.post(
+    "/", response_model=schemas.TransferResponse, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(9)), Depends(admission_control(transfer_customers))],summary="Perform a Transfer between two Accounts. -- ASSESSMENT FUNCTIONALITY --"
+)
+async def create_transfer(
+    transfer: schemas.TransferCreate,
+    response: Response,
+    idempotencyKey: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=255),
+    db: AsyncSession = Depends(get_async_write_db),
+):
+    """
+    Transfer amounts between any two accounts, including those owned by different customers.
+
+    This endpoint creates TWO transactions:
+    1. A debit transaction on the source account (negative amount)
+    2. A credit transaction on the destination account (positive amount)
+
+    Both transactions are linked by a shared transferId for logging purposes.
+    The ledger engine runs through `run_sync`, on the event loop with the async driver.
+    With group commit enabled the transfer is committed together with concurrent ones,
+    see `utils/group_commit.py`.
+
+    With an `Idempotency-Key` header the transfer is applied at most once per key: a retry
+    gets the original response back, marked with an `Idempotency-Replayed: true` header.
+    Keys are per source account: the same key for a transfer from another account is a new request.
+    """
+
+    fingerprint = idempotency.fingerprint(transfer)
+    startedAt = datetime.now(timezone.utc)
+    if idempotencyKey:
+        idempotencyKey = idempotency.scoped_key(transfer.fromAccountId, idempotencyKey)
+        # Cache hits are answered without starting a database transaction
+        replayed = idempotency.cached(idempotencyKey, fingerprint)
+        if replayed:
+            response.headers[idempotency.REPLAYED_HEADER] = "true"
+            return replayed
+
+    try:
+        if settings.group_commit_enabled:
+            # Committed by the group-commit writer, together with concurrent transfers
+            transferResponse, replayed = await asyncio.wrap_future(
+                transfer_scheduler.submit(
+                    ledger.apply_transfer_once, transfer, idempotencyKey, fingerprint
+                )
+            )
+        else:
+            transferResponse, replayed = await db.run_sync(
+                ledger.apply_transfer_once, transfer, idempotencyKey, fingerprint
+            )
+            await db.commit()
+
+    except HTTPException:
+        await db.rollback()
+        raise
+
+    except IntegrityError as e:
+        await db.rollback()
+        # A concurrent request with the same Idempotency-Key committed first
+        replayed = idempotencyKey and await db.run_sync(
+            idempotency.replay, idempotencyKey, fingerprint, schemas.TransferResponse
+        )
+        if not replayed:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Transfer failed: {str(e)}",
+            )
+        response.headers[idempotency.REPLAYED_HEADER] = "true"
+        return replayed
+
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Transfer failed: {str(e)}",
+        )
+
+    if replayed:
+        response.headers[idempotency.REPLAYED_HEADER] = "true"
+    elif idempotencyKey:
+        idempotency.remember(idempotencyKey, fingerprint, transferResponse, startedAt)
+
+    return transferResponse
+
+
+@router.get("/{transferId}", response_model=dict)
+async def get_transfer(transferId: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Find credit and debit transactions with this transferId
+    """
+    transactions = (
+        await db.scalars(select(Transaction).where(Transaction.transferId == transferId))
+    ).all()
+    if len(transactions) < 2:  # legs of old transfers can be archived, see `utils/archive.py`
+        transactions += await db.run_sync(archive.find, transferId, "transferId")
+
+    if not transactions:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Transfer with ID {transferId} not found",
+        )
+
+    if len(transactions) != 2:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Invalid transfer state: expected 2 transactions, found {len(transactions)}",
+        )
+
+    # Identify debit and credit transactions
+    debitTxn = next((t for t in transactions if t.amount < 0), None)
+    creditTxn = next((t for t in transactions if t.amount > 0), None)
+
+    return {
+        "transferId": transferId,
+        "debitTransaction": {
+            "transactionId": debitTxn.transactionId,
+            "accountId": debitTxn.accountId,
+            "amount": debitTxn.amount,
+            "date": debitTxn.date,
+        },
+        "creditTransaction": {
+            "transactionId": creditTxn.transactionId,
+            "accountId": creditTxn.accountId,
+            "amount": creditTxn.amount,
+            "date": creditTxn.date,
+        },
+        "totalAmount": abs(debitTxn.amount),
+        "status": "completed",
+    }
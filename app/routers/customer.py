@@ -1,21 +1,48 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from typing import List
-from ..utils.database import get_db
-from ..utils.models import Customer
-from ..utils import schemas
+from typing import List, Optional, Union
+from datetime import datetime, timezone
+from decimal import Decimal
+from ..utils.models import Customer, Account
+from ..utils import schemas, ledger, balance_slots, search, fx
+from ..utils.config import settings
+from ..utils.expand import (
+    CUSTOMER_EXPANSIONS,
+    DEFAULT_TRANSACTIONS_PER_ACCOUNT,
+    MAX_TRANSACTIONS_PER_ACCOUNT,
+    attach_recent_transactions,
+    customer_load_options,
+    parse_expand,
+)
+from ..utils.admission import admission_control
+from ..utils.metrics import extend_query_budget, query_budget
+from ..utils.rows import RowsResponse, schema_columns
+from ..utils.sharding import (
+    Shards,
+    exists_on_any_shard,
+    get_shards,
+    get_write_shards,
+    page_across,
+    shard_db,
+    shard_for_email,
+)
 
 router = APIRouter(prefix="/api/v1/customers", tags=["customers"])
 
+CUSTOMER_COLUMNS = schema_columns(schemas.Customer, Customer)
 
-@router.post("/", response_model=schemas.Customer, status_code=status.HTTP_201_CREATED)
-def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(get_db)):
+
+@router.post("/", response_model=schemas.Customer, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(5)), Depends(admission_control())])
+def create_customer(customer: schemas.CustomerCreate, shards: Shards = Depends(get_write_shards)):
     """
     Create a new customer
     Helper Service to create customers for creating Financial Institute accounts
+    The customer is placed on the shard of its email, see `utils/sharding.py`.
     """
-    existingCustomer = (
-        db.query(Customer).filter(Customer.email == customer.email).first()
+    db = shards.session(shard_for_email(customer.email))
+    existingCustomer = exists_on_any_shard(
+        db, select(Customer.customerId).where(Customer.email == customer.email).limit(1)
     )  # Check if email already exists
 
     if existingCustomer:
@@ -32,13 +59,80 @@ def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(get_
     return dbCustomer
 
 
-@router.get("/{customerId}", response_model=schemas.CustomerWithAccounts,summary="Get Customer Details and exisitng Accounts")
-def get_customer(customerId: str, db: Session = Depends(get_db)):
+@router.get("/search", response_model=List[schemas.Customer], dependencies=[Depends(query_budget(2))],summary="Search Customers by name or email")
+def search_customers(
+    q: str,
+    limit: int = Query(20, ge=1, le=search.MAX_RESULTS),
+    shards: Shards = Depends(get_shards),
+):
+    """
+    Customers whose name or email contains every word of `q`, each word matching as a
+    prefix, best matches first. Backed by a full-text index, see `utils/search.py`.
+    """
+    terms = search.search_terms(q)
+    databases = shards.all()
+    extend_query_budget(2 * (len(databases) - 1))  # BEGIN and the search, per other shard
+    results = [search.search_customers(db, CUSTOMER_COLUMNS, terms, limit) for db in databases]
+    return RowsResponse(search.merge(results, lambda row: row.rank, limit))
+
+
+@router.get(
+    "/{customerId}",
+    response_model=Union[
+        schemas.CustomerWithAccountTransactions, schemas.CustomerWithAccounts, schemas.Customer
+    ],
+    dependencies=[Depends(query_budget(4))],summary="Get Customer Details and exisitng Accounts"
+)
+def get_customer(
+    customerId: str,
+    expand: str = Query("accounts", description="Comma-separated: accounts, accounts.transactions"),
+    transactionsPerAccount: int = Query(
+        DEFAULT_TRANSACTIONS_PER_ACCOUNT, ge=1, le=MAX_TRANSACTIONS_PER_ACCOUNT
+    ),
+    db: Session = Depends(shard_db("customerId")),
+):
     """
     List customer details and accounts by customerId
     Helper Service to fetch customer details
+    `expand=accounts.transactions` adds the newest transactions of every account.
+    """
+    expansions = parse_expand(expand, CUSTOMER_EXPANSIONS)
+    customer = (
+        db.query(Customer)
+        .options(*customer_load_options(expansions))
+        .filter(Customer.customerId == customerId)
+        .first()
+    )
+    if not customer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Customer with ID {customerId} not found",
+        )
+
+    if "accounts" in expansions or "accounts.transactions" in expansions:
+        balance_slots.load_totals(db, customer.accounts)
+    if "accounts.transactions" in expansions:
+        attach_recent_transactions(db, customer.accounts, transactionsPerAccount)
+        return schemas.CustomerWithAccountTransactions.model_validate(customer)
+    if "accounts" in expansions:
+        return schemas.CustomerWithAccounts.model_validate(customer)
+    return schemas.Customer.model_validate(customer)
+
+
+@router.get("/{customerId}/summary", response_model=schemas.CustomerSummary, dependencies=[Depends(query_budget(3))],summary="Get account totals of an existing Customer")
+def get_customer_summary(
+    customerId: str,
+    currency: Optional[str] = Query(None, min_length=3, max_length=3, description="Currency of totalBalance"),
+    db: Session = Depends(shard_db("customerId")),
+):
+    """
+    Totals over the customer's accounts, from their aggregates; the transactions table is not read.
+    recentTransactions counts ledger entries in the current calendar month (UTC).
+    totalBalance is in `currency`, by default the accounts' own when they all share one and
+    MEOW_FX_REPORTING_CURRENCY otherwise, converted at current rates (`utils/fx.py`).
+    balances has the unconverted total per currency; currencies without a rate to `currency`
+    are listed in unconvertedCurrencies and left out of totalBalance.
     """
-    
     customer = db.query(Customer).filter(Customer.customerId == customerId).first()
     if not customer:
         raise HTTPException(
@@ -46,13 +140,49 @@ def get_customer(customerId: str, db: Session = Depends(get_db)):
             detail=f"Customer with ID {customerId} not found",
         )
 
-    return customer
+    now = datetime.now(timezone.utc)
+    month = ledger.current_month(now)
+    totals = (
+        db.query(
+            Account.currency,
+            func.count(Account.accountId),
+            func.sum(balance_slots.total(Account.balance)),
+            func.coalesce(func.sum(balance_slots.month_transactions(month)), 0),
+        )
+        .filter(Account.customerId == customerId)
+        .group_by(Account.currency)
+        .all()
+    )
+
+    balances = {accountCurrency: Decimal(balance) for accountCurrency, _, balance, _ in totals}
+    if currency is None:
+        currency = next(iter(balances)) if len(balances) == 1 else settings.fx_reporting_currency
+    currency = currency.upper()
+    unconverted = []
+    if set(balances) - {currency}:
+        totalBalance, unconverted = fx.rates(db).convert_totals(balances, currency, now)
+    else:
+        totalBalance = fx.round_to_currency(balances.get(currency, Decimal(0)), currency)
+
+    return schemas.CustomerSummary(
+        customerId=customer.customerId,
+        fullName=f"{customer.firstName} {customer.lastName}",
+        totalAccounts=sum(count for _, count, _, _ in totals),
+        totalBalance=totalBalance,
+        currency=currency,
+        balances={
+            accountCurrency: fx.round_to_currency(balance, accountCurrency)
+            for accountCurrency, balance in balances.items()
+        },
+        unconvertedCurrencies=unconverted,
+        recentTransactions=sum(recent for _, _, _, recent in totals),
+    )
 
 
-@router.get("/", response_model=List[schemas.Customer])
-def list_customers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/", response_model=List[schemas.Customer], dependencies=[Depends(query_budget(2))])
+def list_customers(skip: int = 0, limit: int = 100, shards: Shards = Depends(get_shards)):
     """
     List all customers
-    Helper Service to fetch all customers"""
-    customers = db.query(Customer).offset(skip).limit(limit).all()
-    return customers
+    Helper Service to fetch all customers, served by the lean read path (`utils/rows.py`)"""
+    customers = page_across(shards, lambda db: db.query(*CUSTOMER_COLUMNS), skip, limit)
+    return RowsResponse(customers)
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import datetime, timezone
+
+from ..utils.database import get_db, get_write_db
+from ..utils.models import FxRate
+from ..utils import schemas, ledger, fx
+from ..utils.admission import admission_control
+from ..utils.metrics import query_budget
+from ..utils.rows import RowsResponse, schema_columns
+
+router = APIRouter(prefix="/api/v1/fx-rates", tags=["fx-rates"])
+
+FX_RATE_COLUMNS = schema_columns(schemas.FxRate, FxRate)
+
+
+@router.post("/", response_model=schemas.FxRate, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(6)), Depends(admission_control())],summary="Set an exchange rate from a date on")
+def set_fx_rate(fxRate: schemas.FxRateCreate, db: Session = Depends(get_write_db)):
+    """
+    Set the rate converting baseCurrency into quoteCurrency from effectiveFrom on, until
+    the pair's next rate; a rate for the same pair and date is replaced.
+    Transfers between accounts in different currencies and customer totals convert with it.
+    The write takes the next version, which other workers pick up within
+    MEOW_FX_RATE_CHECK_SECONDS, see `utils/fx.py`.
+    """
+    now = datetime.now(timezone.utc)
+    effectiveFrom = ledger.utc_naive(fxRate.effectiveFrom)
+    version = db.scalar(select(func.coalesce(func.max(FxRate.version), 0))) + 1
+
+    dbRate = db.get(FxRate, (fxRate.baseCurrency, fxRate.quoteCurrency, effectiveFrom))
+    if dbRate:
+        dbRate.rate = fxRate.rate
+        dbRate.version = version
+        dbRate.createdAt = now
+    else:
+        dbRate = FxRate(
+            **fxRate.model_dump(exclude={"effectiveFrom"}),
+            effectiveFrom=effectiveFrom,
+            version=version,
+            createdAt=now,
+        )
+        db.add(dbRate)
+
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # another writer took the version
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Exchange rates were written concurrently, retry",
+        )
+    fx.fx_rate_cache.invalidate()
+
+    db.refresh(dbRate)
+    return dbRate
+
+
+@router.get("/", response_model=List[schemas.FxRate], dependencies=[Depends(query_budget(2))],summary="List exchange rates")
+def list_fx_rates(
+    baseCurrency: Optional[str] = None,
+    quoteCurrency: Optional[str] = None,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    """
+    Exchange rates, newest effectiveFrom first, optionally of one currency pair only.
+    Served by the lean read path (`utils/rows.py`)"""
+    query = db.query(*FX_RATE_COLUMNS)
+    if baseCurrency:
+        query = query.filter(FxRate.baseCurrency == baseCurrency)
+    if quoteCurrency:
+        query = query.filter(FxRate.quoteCurrency == quoteCurrency)
+    rates = (
+        query.order_by(FxRate.effectiveFrom.desc(), FxRate.baseCurrency, FxRate.quoteCurrency)
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    return RowsResponse(rates)
@@ -1,38 +1,57 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Iterator, List, Literal, Optional
 from datetime import datetime
+from functools import partial
+from itertools import chain, islice
 
-from ..utils.database import get_db
+import csv
+import io
+import json
+
+from ..utils.database import ShardSessionLocal
 from ..utils.models import Account, Transaction
-from ..utils import schemas
+from ..utils.pagination import encode_cursor, decode_cursor
+from ..utils import archive, schemas, search
+from ..utils.metrics import extend_query_budget, query_budget
+from ..utils.rows import RowsResponse, schema_columns
+from ..utils.sharding import Shards, get_shards, shard_db, shard_of
 
 router = APIRouter(prefix="/api/v2/transactions", tags=["transactions"])
 
+TRANSACTION_COLUMNS = schema_columns(schemas.Transaction, Transaction)
+
 
-@router.get("/account/{accountId}", response_model=List[schemas.Transaction],summary="Get all Transactions linked to an AccountID. -- ASSESSMENT FUNCTIONALITY --")
+@router.get("/account/{accountId}", response_model=List[schemas.Transaction], dependencies=[Depends(query_budget(3))],summary="Get all Transactions linked to an AccountID. -- ASSESSMENT FUNCTIONALITY --")
 def get_account_transactions(
     accountId: str,
     skip: int = 0,
     limit: int = 100,
     startDate: Optional[datetime] = None,
     endDate: Optional[datetime] = None,
-    transfersOnly: bool = False,  # non-transfer transactions can be added and excluded here if True
-    db: Session = Depends(get_db),
+    transfersOnly: bool = False,  # only transactions that belong to a transfer
+    cursor: Optional[str] = None,
+    db: Session = Depends(shard_db("accountId")),
 ):
-    account = db.query(Account).filter(Account.accountId == accountId).first()
+    """
+    Newest transactions first. A full page carries an `X-Next-Cursor` header; pass it back
+    as `cursor` to get the next page at the same cost as the first one (`skip` is then ignored).
+    Served by the lean read path, see `utils/rows.py`. A page that runs past the oldest
+    transaction in the table continues into the archive, see `utils/archive.py`.
+    """
+    account = db.query(Account.accountId).filter(Account.accountId == accountId).first()
     if not account:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Account with ID {accountId} not found",
         )
 
-    query = db.query(Transaction).filter(Transaction.accountId == accountId)
+    query = db.query(*TRANSACTION_COLUMNS).filter(Transaction.accountId == accountId)
 
-    """
-       Transfer only filter can be added here, currently outside the scope of assessment
-
-    """
+    if transfersOnly:
+        query = query.filter(Transaction.transferId.isnot(None))
 
     if startDate:
         query = query.filter(Transaction.date >= startDate)
@@ -40,27 +59,218 @@ def get_account_transactions(
     if endDate:
         query = query.filter(Transaction.date <= endDate)
 
-    transactions = (
-        query.order_by(Transaction.date.desc()).offset(skip).limit(limit).all()
+    matching = query
+    query = query.order_by(Transaction.date.desc(), Transaction.transactionId.desc())
+
+    before = decode_cursor(cursor) if cursor else None
+    if before:
+        query = query.filter(tuple_(Transaction.date, Transaction.transactionId) < before)
+    else:
+        query = query.offset(skip)
+
+    transactions = query.limit(limit).all()
+
+    if len(transactions) < limit:
+        archiveSkip = 0
+        if not before and skip and not transactions:  # the table rows skipped were fewer than skip
+            extend_query_budget(1)
+            archiveSkip = max(skip - matching.count(), 0)
+        transactions += archive.history_page(
+            db, accountId, startDate, endDate, transfersOnly, before, archiveSkip, limit - len(transactions)
+        )
+
+    headers = {}
+    if transactions and len(transactions) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(
+            transactions[-1].date, transactions[-1].transactionId
+        )
+
+    return RowsResponse(transactions, headers=headers)
+
+
+# Columns written by the statement export, in output order
+EXPORT_COLUMNS = (
+    Transaction.transactionId,
+    Transaction.accountId,
+    Transaction.transferId,
+    Transaction.amount,
+    Transaction.currency,
+    Transaction.name,
+    Transaction.date,
+    Transaction.createdAt,
+)
+EXPORT_CHUNK_ROWS = 2000  # rows fetched from the cursor and written per chunk
+
+
+@router.get("/account/{accountId}/export", response_class=StreamingResponse,summary="Stream the full Transaction history of an AccountID as NDJSON or CSV")
+def export_account_transactions(
+    accountId: str,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    startDate: Optional[datetime] = None,
+    endDate: Optional[datetime] = None,
+    transfersOnly: bool = False,
+    db: Session = Depends(shard_db("accountId")),
+):
+    """
+    Oldest transactions first, archived ones included. Rows are fetched in chunks through a
+    server-side cursor and written straight to the response, so memory stays flat however
+    long the history is.
+    """
+    account = db.query(Account.accountId).filter(Account.accountId == accountId).first()
+    if not account:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Account with ID {accountId} not found",
+        )
+
+    query = select(*EXPORT_COLUMNS).where(Transaction.accountId == accountId)
+
+    if transfersOnly:
+        query = query.where(Transaction.transferId.isnot(None))
+
+    if startDate:
+        query = query.where(Transaction.date >= startDate)
+
+    if endDate:
+        query = query.where(Transaction.date <= endDate)
+
+    query = query.order_by(Transaction.date, Transaction.transactionId)
+
+    archived = partial(
+        archive.account_history,
+        accountId=accountId,
+        startDate=startDate,
+        endDate=endDate,
+        transfersOnly=transfersOnly,
+        newestFirst=False,
+    )
+    return StreamingResponse(
+        _stream_export(query, format, shard_of(accountId), archived),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="transactions-{accountId}.{format}"'
+        },
     )
 
-    return transactions
+
+def _stream_export(query, format: str, shard: int, archived) -> Iterator[str]:
+    # The request's session is closed before the body is streamed, so the export owns one
+    db = ShardSessionLocal[shard]()
+    try:
+        fieldNames = [column.key for column in EXPORT_COLUMNS]
+        archivedRows = archived(db) or ()
+        result = db.execute(query.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+        # The archive holds the oldest rows: its chunks come first, in the same columns
+        partitions = chain(
+            _partitions(
+                (tuple(getattr(row, name) for name in fieldNames) for row in archivedRows),
+                EXPORT_CHUNK_ROWS,
+            ),
+            result.partitions(),
+        )
+
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fieldNames)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+            for rows in partitions:
+                writer.writerows(
+                    (t, a, tr, str(amt), cur, n, d.isoformat(), c.isoformat())
+                    for t, a, tr, amt, cur, n, d, c in rows
+                )
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        else:
+            for rows in partitions:
+                yield "".join(
+                    json.dumps(
+                        {
+                            "transactionId": t,
+                            "accountId": a,
+                            "transferId": tr,
+                            "amount": str(amt),
+                            "currency": cur,
+                            "name": n,
+                            "date": d.isoformat(),
+                            "createdAt": c.isoformat(),
+                        }
+                    )
+                    + "\n"
+                    for t, a, tr, amt, cur, n, d, c in rows
+                )
+    finally:
+        db.close()
+
+
+def _partitions(rows, size: int) -> Iterator[list]:
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@router.get("/search", response_model=List[schemas.Transaction], dependencies=[Depends(query_budget(2))],summary="Search Transactions by name")
+def search_transactions(
+    q: str,
+    accountId: Optional[str] = None,
+    sort: Literal["relevance", "newest"] = "relevance",
+    limit: int = Query(20, ge=1, le=search.MAX_RESULTS),
+    shards: Shards = Depends(get_shards),
+):
+    """
+    Transactions whose name contains every word of `q`, each word matching as a prefix
+    ("trans ali" finds "Transfer to Alice"). Scoped to one account with `accountId`, else
+    searched on every shard. Backed by a full-text index, see `utils/search.py`; archived
+    transactions are not searched.
+    """
+    terms = search.search_terms(q)
+    newest = sort == "newest"
+
+    if accountId:
+        db = shards.for_key(accountId)
+        extend_query_budget(1)
+        account = db.query(Account.accountId).filter(Account.accountId == accountId).first()
+        if not account:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Account with ID {accountId} not found",
+            )
+        databases = [db]
+    else:
+        databases = shards.all()
+        extend_query_budget(2 * (len(databases) - 1))  # BEGIN and the search, per other shard
+
+    results = [
+        search.search_transactions(db, TRANSACTION_COLUMNS, terms, accountId, newest, limit)
+        for db in databases
+    ]
+    key = (lambda row: (row.date, row.transactionId)) if newest else (lambda row: row.rank)
+    return RowsResponse(search.merge(results, key, limit, reverse=newest))
 
 
 @router.get("/{transactionId}", response_model=schemas.Transaction,summary="Get account linked Transaction by TransactionID")
-def get_transaction(transactionId: str, db: Session = Depends(get_db)):
+def get_transaction(transactionId: str, db: Session = Depends(shard_db("transactionId"))):
     """
     Get transaction details by transactionId
-    Helper Service to fetch transaction details
+    Helper Service to fetch transaction details, archived transactions included
     """
     transaction = (
         db.query(Transaction).filter(Transaction.transactionId == transactionId).first()
     )
     if not transaction:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Transaction with ID {transactionId} not found",
-        )
+        archived = archive.find(db, transactionId, "transactionId")
+        if not archived:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Transaction with ID {transactionId} not found",
+            )
+        return schemas.Transaction(**archived[0]._asdict())
 
     return transaction
 
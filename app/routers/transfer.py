@@ -1,19 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from sqlalchemy import insert, update, bindparam
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-import uuid
+import random
+from collections import defaultdict
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional
 
-from ..utils.database import get_db
-from ..utils.models import Account, Transaction
-from ..utils import schemas
+from ..utils.config import settings
+from ..utils.database import session_shard
+from ..utils.models import Account, Transaction, generate_uuid
+from ..utils import schemas, ledger, idempotency, sharding, balance_slots, archive
+from ..utils.admission import admission_control, transfer_customers
+from ..utils.cache import mark_accounts_changed
+from ..utils.group_commit import transfer_schedulers
+from ..utils.metrics import extend_query_budget, query_budget
+from ..utils.sharding import Shards, get_shards, get_write_shards, shard_of
 
 router = APIRouter(prefix="/api/v2/transfers", tags=["transfers"])
 
 
 @router.post(
-    "/", response_model=schemas.TransferResponse, status_code=status.HTTP_201_CREATED,summary="Perform a Transfer between two Accounts. -- ASSESSMENT FUNCTIONALITY --"
+    "/", response_model=schemas.TransferResponse, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(9)), Depends(admission_control(transfer_customers))],summary="Perform a Transfer between two Accounts. -- ASSESSMENT FUNCTIONALITY --"
 )
-def create_transfer(transfer: schemas.TransferCreate, db: Session = Depends(get_db)):
+def create_transfer(
+    transfer: schemas.TransferCreate,
+    response: Response,
+    idempotencyKey: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=255),
+    shards: Shards = Depends(get_write_shards),
+):
     """
     Transfer amounts between any two accounts, including those owned by different customers.
 
@@ -22,104 +39,327 @@ def create_transfer(transfer: schemas.TransferCreate, db: Session = Depends(get_
     2. A credit transaction on the destination account (positive amount)
 
     Both transactions are linked by a shared transferId for logging purposes.
+    The funds check and the debit are a single guarded UPDATE, see `utils/ledger.py`.
+    With group commit enabled the transfer is committed together with concurrent ones,
+    see `utils/group_commit.py`. A transfer between accounts on two shards is committed in
+    two phases, see `utils/sharding.py`.
+
+    With an `Idempotency-Key` header the transfer is applied at most once per key: a retry
+    gets the original response back, marked with an `Idempotency-Replayed: true` header.
+    Keys are per source account: the same key for a transfer from another account is a new request.
     """
 
-    if (
-        transfer.fromAccountId == transfer.toAccountId
-    ):  # Validate accounts are different
+    fingerprint = idempotency.fingerprint(transfer)
+    startedAt = datetime.now(timezone.utc)
+    if idempotencyKey:
+        idempotencyKey = idempotency.scoped_key(transfer.fromAccountId, idempotencyKey)
+        replayed = idempotency.cached(idempotencyKey, fingerprint)
+        if replayed:
+            response.headers[idempotency.REPLAYED_HEADER] = "true"
+            return replayed
+
+    fromShard = shard_of(transfer.fromAccountId)
+    db = shards.session(fromShard)
+    try:
+        if shard_of(transfer.toAccountId) != fromShard:
+            extend_query_budget(8)  # a transaction on each shard, and the intent completed
+            transferResponse, replayed = sharding.apply_cross_shard_transfer(
+                shards, transfer, idempotencyKey, fingerprint
+            )
+        elif settings.group_commit_enabled:
+            # Committed by the group-commit writer, together with concurrent transfers
+            transferResponse, replayed = transfer_schedulers[fromShard].submit(
+                ledger.apply_transfer_once, transfer, idempotencyKey, fingerprint
+            ).result()
+        else:
+            transferResponse, replayed = ledger.apply_transfer_once(
+                db, transfer, idempotencyKey, fingerprint
+            )
+            db.commit()
+
+    except HTTPException:
+        db.rollback()
+        raise
+
+    except IntegrityError as e:
+        db.rollback()
+        # A concurrent request with the same Idempotency-Key committed first
+        replayed = idempotencyKey and idempotency.replay(
+            db, idempotencyKey, fingerprint, schemas.TransferResponse
+        )
+        if not replayed:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Transfer failed: {str(e)}",
+            )
+        response.headers[idempotency.REPLAYED_HEADER] = "true"
+        return replayed
+
+    except Exception as e:
+        db.rollback()
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Cannot transfer to the same account",
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Transfer failed: {str(e)}",
         )
 
-    fromAccount = (
-        db.query(Account).filter(Account.accountId == transfer.fromAccountId).first()
+    if replayed:
+        response.headers[idempotency.REPLAYED_HEADER] = "true"
+    elif idempotencyKey:
+        idempotency.remember(idempotencyKey, fingerprint, transferResponse, startedAt)
+
+    return transferResponse
+
+
+@router.post(
+    "/batch", response_model=schemas.BatchTransferResponse, status_code=status.HTTP_201_CREATED, dependencies=[Depends(query_budget(6)), Depends(admission_control(transfer_customers))],summary="Perform many Transfers in a single database transaction"
+)
+def create_transfer_batch(batch: schemas.BatchTransferCreate, shards: Shards = Depends(get_write_shards)):
+    """
+    Apply a batch of transfers in the order given, committing once for the whole batch.
+
+    Every referenced account is loaded with a single query. Each transfer is validated
+    against the running balances of the batch and gets its own success or failure result;
+    a failed transfer does not affect the others. All debit/credit transactions are
+    bulk-inserted and the balance changes are applied once per account.
+
+    With sharding the batch commits once per shard. A transfer between accounts on two
+    shards fails and has to be sent to `POST /api/v2/transfers`, and when the commit on one
+    shard fails its transfers fail without affecting the other shards.
+    """
+    groups = defaultdict(list)  # shard -> (index, transfer)
+    results = []
+    for index, transfer in enumerate(batch.transfers):
+        fromShard = shard_of(transfer.fromAccountId)
+        if shard_of(transfer.toAccountId) != fromShard:
+            results.append(
+                schemas.BatchTransferResult(
+                    index=index,
+                    status="failed",
+                    message="Accounts are on different shards, use POST /api/v2/transfers",
+                )
+            )
+            continue
+        groups[fromShard].append((index, transfer))
+
+    for shard, transfers in groups.items():
+        try:
+            results.extend(_apply_batch(shards.session(shard), transfers))
+        except HTTPException as e:
+            if len(groups) == 1 and not results:
+                raise
+            results.extend(
+                schemas.BatchTransferResult(index=index, status="failed", message=e.detail)
+                for index, _ in transfers
+            )
+    results.sort(key=lambda result: result.index)
+
+    succeeded = sum(1 for result in results if result.status == "success")
+    return schemas.BatchTransferResponse(
+        total=len(results),
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+        results=results,
     )
-    toAccount = (
-        db.query(Account).filter(Account.accountId == transfer.toAccountId).first()
+
+
+def _apply_batch(db: Session, transfers: list) -> list:
+    """Apply (index, transfer) pairs of one shard and commit; returns their results."""
+    accountIds = {t.fromAccountId for _, t in transfers} | {t.toAccountId for _, t in transfers}
+    accounts = {
+        account.accountId: account
+        for account in db.query(Account)
+        .filter(Account.accountId.in_(accountIds))
+        .with_for_update()
+        .all()
+    }
+    # A split account's balance is its row's plus its slots', all locked for the batch
+    heldSlots = balance_slots.lock(
+        db, [accountId for accountId, account in accounts.items() if account.balanceSlots > 1]
     )
 
-    if not fromAccount:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Source account {transfer.fromAccountId} not found",
-        )
+    balances = {
+        accountId: account.balance + sum(balance for _, balance in heldSlots.get(accountId, ()))
+        for accountId, account in accounts.items()
+    }
+    balanceDeltas = defaultdict(Decimal)
+    credits = defaultdict(Decimal)
+    debits = defaultdict(Decimal)
+    ledgerEntries = defaultdict(int)
+    ledgerRows = []
+    results = []
+    now = datetime.now(timezone.utc)
+    shard = session_shard(db)
 
-    if not toAccount:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Destination account {transfer.toAccountId} not found",
-        )
+    for index, transfer in transfers:
+        fromAccount = accounts.get(transfer.fromAccountId)
+        toAccount = accounts.get(transfer.toAccountId)
 
-    # Check sufficient funds
-    if fromAccount.balance < transfer.amount:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Insufficient funds in account {transfer.fromAccountId}. "
-            f"Balance: {fromAccount.balance}, Required: {transfer.amount}",
-        )
+        if transfer.fromAccountId == transfer.toAccountId:
+            failure = "Cannot transfer to the same account"
+        elif not fromAccount:
+            failure = f"Source account {transfer.fromAccountId} not found"
+        elif not toAccount:
+            failure = f"Destination account {transfer.toAccountId} not found"
+        else:
+            try:  # rates come from the in-memory snapshot, see `utils/fx.py`
+                creditAmount, rate = ledger.credit_amount(
+                    db, transfer, fromAccount.currency, toAccount.currency, now
+                )
+            except HTTPException as e:
+                failure = e.detail
+            else:
+                if balances[transfer.fromAccountId] < transfer.amount:
+                    failure = (
+                        f"Insufficient funds in account {transfer.fromAccountId}. "
+                        f"Balance: {balances[transfer.fromAccountId]}, Required: {transfer.amount}"
+                    )
+                else:
+                    failure = None
 
-    # Generate unique transferId to link the two transactions
-    transferIdValue = str(uuid.uuid4())
+        if failure:
+            results.append(
+                schemas.BatchTransferResult(index=index, status="failed", message=failure)
+            )
+            continue
 
-    try:
-        # Create debit transaction (from account)
-        debitTransaction = Transaction(
-            accountId=transfer.fromAccountId,
-            amount=-transfer.amount,  # Negative for debit
-            name=transfer.description or f"Transfer to {toAccount.name}",
-            transferId=transferIdValue,
-            currency=fromAccount.currency,
+        balances[transfer.fromAccountId] -= transfer.amount
+        balances[transfer.toAccountId] += creditAmount
+        balanceDeltas[transfer.fromAccountId] -= transfer.amount
+        balanceDeltas[transfer.toAccountId] += creditAmount
+        debits[transfer.fromAccountId] += transfer.amount
+        credits[transfer.toAccountId] += creditAmount
+        ledgerEntries[transfer.fromAccountId] += 1
+        ledgerEntries[transfer.toAccountId] += 1
+
+        # IDs are generated here so the rows can be bulk-inserted without a refresh
+        transferIdValue = generate_uuid(shard)
+        debitTransactionId = generate_uuid(shard)
+        creditTransactionId = generate_uuid(shard)
+
+        ledgerRows.append(
+            {
+                "transactionId": debitTransactionId,
+                "accountId": transfer.fromAccountId,
+                "amount": -transfer.amount,  # Negative for debit
+                "name": transfer.description or f"Transfer to {toAccount.name}",
+                "transferId": transferIdValue,
+                "currency": fromAccount.currency,
+                "date": now,
+                "createdAt": now,
+            }
         )
-        db.add(debitTransaction)
-
-        # Create credit transaction (to account)
-        creditTransaction = Transaction(
-            accountId=transfer.toAccountId,
-            amount=transfer.amount,  # Positive for credit
-            name=transfer.description or f"Transfer from {fromAccount.name}",
-            transferId=transferIdValue,
-            currency=toAccount.currency,
+        ledgerRows.append(
+            {
+                "transactionId": creditTransactionId,
+                "accountId": transfer.toAccountId,
+                "amount": creditAmount,  # Positive for credit, in the destination currency
+                "name": transfer.description or f"Transfer from {fromAccount.name}",
+                "transferId": transferIdValue,
+                "currency": toAccount.currency,
+                "date": now,
+                "createdAt": now,
+            }
         )
-        db.add(creditTransaction)
-
-        # Update account balances
-        fromAccount.balance -= transfer.amount
-        toAccount.balance += transfer.amount
-
-        db.commit()
-
-        # Refresh to get generated IDs
-        db.refresh(debitTransaction)
-        db.refresh(creditTransaction)
-
-        return schemas.TransferResponse(
-            transferId=transferIdValue,
-            fromTransactionId=debitTransaction.transactionId,
-            toTransactionId=creditTransaction.transactionId,
-            fromAccountId=transfer.fromAccountId,
-            toAccountId=transfer.toAccountId,
-            amount=transfer.amount,
-            status="success",
-            message=f"Successfully transferred {transfer.amount} from account {fromAccount.name} to {toAccount.name}",
+        results.append(
+            schemas.BatchTransferResult(
+                index=index,
+                status="success",
+                transferId=transferIdValue,
+                fromTransactionId=debitTransactionId,
+                toTransactionId=creditTransactionId,
+                creditedAmount=creditAmount,
+                exchangeRate=rate,
+                message=ledger.transfer_message(transfer, fromAccount, toAccount, creditAmount),
+            )
         )
 
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Transfer failed: {str(e)}",
+    if ledgerRows:
+        try:
+            mark_accounts_changed(db, *ledgerEntries)
+            db.execute(insert(Transaction), ledgerRows)
+
+            # Balances are moved by their net change, one UPDATE per touched account
+            accountsTable = Account.__table__
+            db.execute(
+                update(accountsTable)
+                .where(accountsTable.c.accountId == bindparam("targetAccountId"))
+                .values(
+                    balance=accountsTable.c.balance + bindparam("delta"),
+                    **ledger.counter_values(
+                        bindparam("entries"),
+                        bindparam("credits"),
+                        bindparam("debits"),
+                        ledger.current_month(now),
+                    ),
+                ),
+                [
+                    {
+                        "targetAccountId": accountId,
+                        "delta": 0 if accountId in heldSlots else balanceDeltas[accountId],
+                        "entries": entries,
+                        "credits": credits[accountId],
+                        "debits": debits[accountId],
+                    }
+                    for accountId, entries in ledgerEntries.items()
+                ],
+            )
+            if heldSlots:
+                extend_query_budget(1 + sum(len(held) for held in heldSlots.values()))
+            for accountId, held in heldSlots.items():
+                apply_slot_delta(db, accountId, held, balanceDeltas[accountId])
+
+            ledger.write_checkpoints(
+                db,
+                [
+                    (accountId, balances[accountId])
+                    for accountId, entries in ledgerEntries.items()
+                    if ledger.checkpoint_due(
+                        accounts[accountId].checkpointCount + entries,
+                        accounts[accountId].checkpointAt,
+                        now,
+                    )
+                ],
+                now,
+            )
+
+            db.commit()
+
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Batch transfer failed: {str(e)}",
+            )
+
+    return results
+
+
+def apply_slot_delta(db: Session, accountId: str, held: list, delta: Decimal) -> None:
+    """Move the locked slots of a split account by a batch's net change."""
+    if delta > 0:
+        slot, _ = random.choice(held)
+        db.execute(
+            update(balance_slots.slots)
+            .where(balance_slots.slots.c.accountId == accountId, balance_slots.slots.c.slot == slot)
+            .values(balance=balance_slots.slots.c.balance + delta)
         )
+    elif delta < 0:
+        balance_slots.draw(db, accountId, held, -delta)
 
 
 @router.get("/{transferId}", response_model=dict)
-def get_transfer(transferId: str, db: Session = Depends(get_db)):
+def get_transfer(transferId: str, shards: Shards = Depends(get_shards)):
     """
     Find credit and debit transactions with this transferId
+    The two legs of a cross-shard transfer are on different shards, so every shard is read.
     """
-    transactions = (
-        db.query(Transaction).filter(Transaction.transferId == transferId).all()
-    )
+    transactions = [
+        transaction
+        for db in shards.all()
+        for transaction in db.query(Transaction).filter(Transaction.transferId == transferId).all()
+    ]
+    if len(transactions) < 2:  # legs of old transfers can be archived, see `utils/archive.py`
+        transactions += [row for db in shards.all() for row in archive.find(db, transferId, "transferId")]
 
     if not transactions:
         raise HTTPException(
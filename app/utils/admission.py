@@ -0,0 +1,242 @@
+"""
+Admission control - bounded concurrency, a bounded wait queue and per-customer rate limits
+for the write routes, so a burst is turned away early instead of timing out in the pool.
+
+Every write route runs behind the `admission_control` dependency, which admits a request
+or rejects it before the handler takes a thread or a connection:
+
+1. Per-customer token buckets (MEOW_ADMISSION_CUSTOMER_RATE): a customer starts at most
+   `rate` write requests per second, in bursts of `burst`; beyond that 429. The customer
+   of a transfer is the owner of its source account, looked up once and cached.
+2. A concurrency gate (MEOW_ADMISSION_MAX_CONCURRENT) shared by all the write routes of a
+   worker, since they all queue for the same write lock. Requests over the limit wait in
+   FIFO order, up to `queue_size` of them and each for at most `queue_timeout_ms`; a
+   request finding the queue full is rejected at once, one past its deadline then, both
+   with 503.
+
+Rejections carry Retry-After: when the customer's next token is due, or the queue
+deadline. The gate and the buckets live on the event loop and are only touched from
+async code there, so they need no locks. The queue depth, in-flight requests, waits and
+rejections are exported at /metrics.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics
+from .cache import LRUCache
+from .config import settings
+from .database import ShardSessionLocal
+from .metrics import extend_query_budget, route_label
+from .models import Account
+
+accounts = Account.__table__
+
+# Buckets kept per worker; the least recently used customer's is dropped beyond this
+MAX_BUCKETS = 100000
+OWNER_CACHE_SIZE = 100000
+
+
+class ConcurrencyGate:
+    """At most `limit` holders; up to `queueSize` more wait, first come first served, for `timeout` seconds."""
+
+    def __init__(self, limit: int, queueSize: int, timeout: float) -> None:
+        self.limit = limit
+        self.queueSize = queueSize
+        self.timeout = timeout
+        self.active = 0
+        self._waiters = deque()
+
+    async def acquire(self) -> Optional[str]:
+        """Take a turn; returns why it was refused ("queue_full", "deadline"), or None."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return None
+        if len(self._waiters) >= self.queueSize:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._publish()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():  # handed the turn as the deadline passed
+                return None
+            self._withdraw(waiter)
+            return "deadline"
+        except asyncio.CancelledError:  # the client went away
+            if waiter.done():
+                self.release()
+            else:
+                self._withdraw(waiter)
+            raise
+        return None
+
+    def release(self) -> None:
+        """End a turn, handing it straight to the longest waiting request."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._publish()
+                return
+        self.active -= 1
+        self._publish()
+
+    def _withdraw(self, waiter) -> None:
+        self._waiters.remove(waiter)
+        waiter.cancel()
+        self._publish()
+
+    def _publish(self) -> None:
+        metrics.admissionInFlight.set(self.active)
+        metrics.admissionQueueDepth.set(len(self._waiters))
+
+
+class TokenBuckets:
+    """A token bucket per key, refilled at `rate` tokens per second up to `burst`."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._buckets = OrderedDict()  # key -> (tokens, updatedAt), least recently used first
+
+    def take(self, keys: Iterable) -> float:
+        """A token from the bucket of every key, or none at all; returns 0, or the seconds until they can be."""
+        now = time.monotonic()
+        levels = {}
+        for key in keys:
+            tokens, updatedAt = self._buckets.get(key, (self.burst, now))
+            levels[key] = min(self.burst, tokens + (now - updatedAt) * self.rate)
+        shortest = min(levels.values(), default=1)
+        if shortest < 1:
+            return (1 - shortest) / self.rate
+        for key, tokens in levels.items():
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+        while len(self._buckets) > MAX_BUCKETS:
+            self._buckets.popitem(last=False)
+        return 0
+
+
+gate = (
+    ConcurrencyGate(
+        settings.admission_max_concurrent,
+        settings.admission_queue_size,
+        settings.admission_queue_timeout_ms / 1000,
+    )
+    if settings.admission_max_concurrent > 0
+    else None
+)
+buckets = (
+    TokenBuckets(settings.admission_customer_rate, settings.admission_customer_burst)
+    if settings.admission_customer_rate > 0
+    else None
+)
+
+# accountId -> customerId; an account never changes owner
+owner_cache = LRUCache(OWNER_CACHE_SIZE, float("inf"))
+
+
+def account_owners(accountIds: List[str]) -> Dict[str, str]:
+    """Owners of the accounts that exist, by accountId; one query per shard for those not cached."""
+    from .sharding import shard_of
+
+    owners = {}
+    missing = {}  # shard -> accountIds
+    for accountId in accountIds:
+        customerId = owner_cache.get(accountId)
+        if customerId is None:
+            missing.setdefault(shard_of(accountId), []).append(accountId)
+        else:
+            owners[accountId] = customerId
+    for shard, shardAccountIds in missing.items():
+        extend_query_budget(2)
+        with ShardSessionLocal[shard]() as db:
+            for accountId, customerId in db.execute(
+                select(accounts.c.accountId, accounts.c.customerId).where(
+                    accounts.c.accountId.in_(shardAccountIds)
+                )
+            ):
+                owner_cache.set(accountId, customerId)
+                owners[accountId] = customerId
+    return owners
+
+
+async def transfer_customers(body: dict) -> List[str]:
+    """Customers a transfer, or a batch of them, is charged to: the owners of the source accounts."""
+    transfers = body.get("transfers", [body])
+    if not isinstance(transfers, list):
+        return []
+    accountIds = {
+        transfer.get("fromAccountId")
+        for transfer in transfers
+        if isinstance(transfer, dict) and isinstance(transfer.get("fromAccountId"), str)
+    }
+    if not accountIds:
+        return []
+    return list(set((await run_in_threadpool(account_owners, list(accountIds))).values()))
+
+
+async def account_customers(body: dict) -> List[str]:
+    """The customer a new account is opened for."""
+    customerId = body.get("customerId")
+    return [customerId] if isinstance(customerId, str) else []
+
+
+def _reject(request: Request, reason: str, statusCode: int, retryAfter: float) -> HTTPException:
+    metrics.record_admission_rejection((request.method, route_label(request.scope)), reason)
+    detail = {
+        "rate_limited": "Too many requests for this customer, retry later",
+        "queue_full": "Server is busy, retry later",
+        "deadline": "Server is busy, timed out waiting for a turn",
+    }[reason]
+    return HTTPException(
+        status_code=statusCode,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retryAfter)))},
+    )
+
+
+def admission_control(customersOf: Optional[Callable] = None):
+    """
+    Route dependency: admit a write request, or reject it with 429 or 503. `customersOf`
+    maps the JSON body to the customers whose token buckets it takes from.
+    """
+
+    async def admit(request: Request):
+        if buckets is not None and customersOf is not None:
+            try:
+                body = await request.json()  # parsed once, FastAPI has read it already
+            except ValueError:
+                body = None
+            customers = await customersOf(body) if isinstance(body, dict) else []
+            retryAfter = buckets.take(customers)
+            if retryAfter:
+                raise _reject(request, "rate_limited", status.HTTP_429_TOO_MANY_REQUESTS, retryAfter)
+
+        if gate is None:
+            yield
+            return
+
+        started = time.perf_counter()
+        refused = await gate.acquire()
+        metrics.record_admission_wait(
+            (request.method, route_label(request.scope)), time.perf_counter() - started
+        )
+        if refused:
+            raise _reject(request, refused, status.HTTP_503_SERVICE_UNAVAILABLE, gate.timeout)
+        try:
+            yield
+        finally:
+            gate.release()
+
+    return admit
@@ -0,0 +1,396 @@
+"""
+Transaction archive - calendar months of old transactions moved out of the transactions table.
+
+The transactions table and its indexes only grow. `archive_month` moves one calendar month
+of transactions, for a batch of accounts at a time, into that month's segment: a SQLite
+file under `settings.archive_dir`, one per month and shard, holding
+
+- chunks: up to ARCHIVE_CHUNK_ROWS transactions of one account, oldest first, as
+  zlib-compressed JSON, with the dates they span;
+- keys: the transactionId and transferId of every archived row, with its chunk.
+
+Rows are written once, to the segment, and deleted from the table in the transaction that
+records the account's month in the `archived_months` catalog, with the month's totals. A
+month is archived whole and once per account, so the transactions of an account still in
+the table are all newer than its archived ones.
+
+Reads fall through to the archive. An account's history continues from the table into its
+archived months, which the catalog lists without a segment being opened, and a
+transactionId or transferId is looked up in the keys of the segments from the month its
+UUIDv7 time points to. A segment row only counts once the catalog has its account's month,
+so the rows of a run that stopped half way are never read; the next run replaces them.
+"""
+
+import glob
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import groupby, islice
+from typing import Iterator, List, Optional, Tuple
+from urllib.request import pathname2url
+
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from . import ids, schemas
+from .config import settings
+from .database import session_shard
+from .ledger import current_month, utc_naive
+from .metrics import extend_query_budget
+from .models import ArchivedMonth, Transaction
+
+log = logging.getLogger("app.archive")
+
+ARCHIVE_CHUNK_ROWS = 500
+ACCOUNTS_PER_BATCH = 1000
+
+archivedMonths = ArchivedMonth.__table__
+transactions = Transaction.__table__
+
+# An archived transaction, with the fields of the API schema, like a lean-read-path row
+ArchivedTransaction = namedtuple("ArchivedTransaction", schemas.Transaction.model_fields)
+
+SEGMENT_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS chunks (chunkId INTEGER PRIMARY KEY, accountId TEXT NOT NULL, "
+    "firstDate TEXT NOT NULL, lastDate TEXT NOT NULL, rows INTEGER NOT NULL, data BLOB NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_chunks_account ON chunks (accountId, lastDate)",
+    "CREATE TABLE IF NOT EXISTS keys (key TEXT NOT NULL, chunkId INTEGER NOT NULL, "
+    "PRIMARY KEY (key, chunkId)) WITHOUT ROWID",
+)
+
+
+def month_range(month: str) -> Tuple[datetime, datetime]:
+    """First instant of `month` and of the month after it, naive UTC."""
+    start = datetime.strptime(month, "%Y-%m")
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def _segment_prefix(shard: int) -> str:
+    return f"shard{shard}-transactions-" if shard else "transactions-"
+
+
+def segment_path(shard: int, month: str) -> str:
+    return os.path.join(settings.archive_dir, f"{_segment_prefix(shard)}{month}.sqlite")
+
+
+def segment_months(shard: int) -> List[str]:
+    """Months the shard has a segment for, oldest first."""
+    prefix = _segment_prefix(shard)
+    paths = glob.glob(os.path.join(glob.escape(settings.archive_dir), f"{prefix}*.sqlite"))
+    return sorted(os.path.basename(path)[len(prefix):-len(".sqlite")] for path in paths)
+
+
+def _open_segment(shard: int, month: str) -> sqlite3.Connection:
+    path = os.path.abspath(segment_path(shard, month))
+    return sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True)
+
+
+def _timestamp(value: datetime) -> str:
+    return utc_naive(value).isoformat(timespec="microseconds")
+
+
+def _encode(rows) -> bytes:
+    return zlib.compress(
+        json.dumps(
+            [
+                [
+                    row.transactionId,
+                    row.transferId,
+                    str(row.amount),
+                    row.currency,
+                    row.name,
+                    utc_naive(row.date).isoformat(),
+                    utc_naive(row.createdAt).isoformat(),
+                ]
+                for row in rows
+            ],
+            separators=(",", ":"),
+        ).encode()
+    )
+
+
+def _decode(accountId: str, data: bytes) -> List[ArchivedTransaction]:
+    return [
+        ArchivedTransaction(
+            transactionId=transactionId,
+            accountId=accountId,
+            transferId=transferId,
+            amount=Decimal(amount),
+            currency=currency,
+            name=name,
+            date=datetime.fromisoformat(date),
+            createdAt=datetime.fromisoformat(createdAt),
+        )
+        for transactionId, transferId, amount, currency, name, date, createdAt in json.loads(
+            zlib.decompress(data)
+        )
+    ]
+
+
+def archive_month(db: Session, month: str, accountIds: list) -> int:
+    """
+    Move the transactions of `accountIds` dated in `month` to the month's segment, and
+    commit. Accounts whose month is already archived keep theirs in the table. Returns the
+    number of rows moved.
+    """
+    start, end = month_range(month)
+    done = set(
+        db.scalars(
+            select(archivedMonths.c.accountId).where(
+                archivedMonths.c.month == month, archivedMonths.c.accountId.in_(accountIds)
+            )
+        )
+    )
+    if done:
+        log.warning("%d account(s) got transactions in %s after it was archived; they stay in the table", len(done), month)
+    accountIds = [accountId for accountId in accountIds if accountId not in done]
+    if not accountIds:
+        db.rollback()
+        return 0
+
+    inMonth = and_(
+        transactions.c.accountId.in_(accountIds),
+        transactions.c.date >= start,
+        transactions.c.date < end,
+    )
+    rows = db.execute(
+        select(transactions)
+        .where(inMonth)
+        .order_by(transactions.c.accountId, transactions.c.date, transactions.c.transactionId)
+    ).all()
+    if not rows:
+        db.rollback()
+        return 0
+    byAccount = [(accountId, list(accountRows)) for accountId, accountRows in groupby(rows, lambda row: row.accountId)]
+
+    _write_segment(segment_path(session_shard(db), month), accountIds, byAccount)
+
+    now = datetime.now(timezone.utc)
+    db.execute(
+        insert(archivedMonths),
+        [
+            {
+                "accountId": accountId,
+                "month": month,
+                "rows": len(accountRows),
+                "credits": sum((row.amount for row in accountRows if row.amount > 0), Decimal(0)),
+                "debits": sum((-row.amount for row in accountRows if row.amount < 0), Decimal(0)),
+                "firstDate": utc_naive(accountRows[0].date),
+                "lastDate": utc_naive(accountRows[-1].date),
+                "archivedAt": now,
+            }
+            for accountId, accountRows in byAccount
+        ],
+    )
+    db.execute(delete(transactions).where(inMonth))
+    db.commit()
+    return len(rows)
+
+
+def _write_segment(path: str, accountIds: list, byAccount: list) -> None:
+    """Write the chunks of a batch to a segment in one transaction, replacing leftovers of the batch's accounts."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with closing(sqlite3.connect(path)) as segment:
+        for statement in SEGMENT_SCHEMA:
+            segment.execute(statement)
+        with segment:
+            placeholders = ",".join("?" * len(accountIds))
+            segment.execute(
+                f"DELETE FROM keys WHERE chunkId IN (SELECT chunkId FROM chunks WHERE accountId IN ({placeholders}))",
+                accountIds,
+            )
+            segment.execute(f"DELETE FROM chunks WHERE accountId IN ({placeholders})", accountIds)
+            for accountId, accountRows in byAccount:
+                for offset in range(0, len(accountRows), ARCHIVE_CHUNK_ROWS):
+                    chunk = accountRows[offset:offset + ARCHIVE_CHUNK_ROWS]
+                    chunkId = segment.execute(
+                        "INSERT INTO chunks (accountId, firstDate, lastDate, rows, data) VALUES (?, ?, ?, ?, ?)",
+                        (accountId, _timestamp(chunk[0].date), _timestamp(chunk[-1].date), len(chunk), _encode(chunk)),
+                    ).lastrowid
+                    segment.executemany(
+                        "INSERT OR IGNORE INTO keys (key, chunkId) VALUES (?, ?)",
+                        [(row.transactionId, chunkId) for row in chunk]
+                        + [(row.transferId, chunkId) for row in chunk if row.transferId],
+                    )
+
+
+def archive_shard(db: Session, horizon: datetime) -> int:
+    """
+    Archive every calendar month of the session's shard that ended before the month of
+    `horizon`, ACCOUNTS_PER_BATCH accounts per transaction. Returns the rows moved.
+    """
+    horizonMonth = current_month(horizon)
+    oldest = db.scalar(select(func.min(transactions.c.date)))
+    db.rollback()
+    moved = 0
+    month = oldest and current_month(oldest)
+    while month and month < horizonMonth:
+        start, end = month_range(month)
+        lastAccountId = None
+        while True:
+            query = (
+                select(transactions.c.accountId)
+                .where(transactions.c.date >= start, transactions.c.date < end)
+                .group_by(transactions.c.accountId)
+                .order_by(transactions.c.accountId)
+                .limit(ACCOUNTS_PER_BATCH)
+            )
+            if lastAccountId is not None:
+                query = query.where(transactions.c.accountId > lastAccountId)
+            accountIds = list(db.scalars(query))
+            if not accountIds:
+                db.rollback()
+                break
+            moved += archive_month(db, month, accountIds)
+            lastAccountId = accountIds[-1]
+        month = current_month(end)
+    return moved
+
+
+def account_history(
+    db: Session,
+    accountId: str,
+    startDate: Optional[datetime] = None,
+    endDate: Optional[datetime] = None,
+    transfersOnly: bool = False,
+    before: Optional[Tuple[datetime, str]] = None,
+    newestFirst: bool = True,
+) -> Optional[Iterator[ArchivedTransaction]]:
+    """
+    Archived transactions of an account, newest first (or oldest first) and filtered like
+    the history routes; `before` is a decoded cursor. None, after one catalog query, when
+    the account has nothing archived in the range. Segments are opened as the rows are read.
+    """
+    extend_query_budget(1)
+    startDate = startDate and utc_naive(startDate)
+    endDate = endDate and utc_naive(endDate)
+    before = before and (utc_naive(before[0]), before[1])
+
+    query = select(archivedMonths.c.month).where(archivedMonths.c.accountId == accountId)
+    if startDate:
+        query = query.where(archivedMonths.c.lastDate >= startDate)
+    if endDate:
+        query = query.where(archivedMonths.c.firstDate <= endDate)
+    if before:
+        query = query.where(archivedMonths.c.firstDate <= before[0])
+    months = list(
+        db.scalars(query.order_by(archivedMonths.c.month.desc() if newestFirst else archivedMonths.c.month))
+    )
+    if not months:
+        return None
+    return _read_history(session_shard(db), accountId, months, startDate, endDate, transfersOnly, before, newestFirst)
+
+
+def history_page(
+    db: Session,
+    accountId: str,
+    startDate: Optional[datetime],
+    endDate: Optional[datetime],
+    transfersOnly: bool,
+    before: Optional[Tuple[datetime, str]],
+    skip: int,
+    limit: int,
+) -> List[ArchivedTransaction]:
+    """Archived rows that continue a history page the table ran out of: `limit` of them after `skip`."""
+    archived = account_history(db, accountId, startDate, endDate, transfersOnly, before)
+    return [] if archived is None else list(islice(archived, skip, skip + limit))
+
+
+def _read_history(shard, accountId, months, startDate, endDate, transfersOnly, before, newestFirst):
+    chunkQuery = "SELECT data FROM chunks WHERE accountId = ?"
+    params = [accountId]
+    if startDate:
+        chunkQuery += " AND lastDate >= ?"
+        params.append(_timestamp(startDate))
+    upTo = min(value for value in (endDate, before and before[0]) if value) if endDate or before else None
+    if upTo:
+        chunkQuery += " AND firstDate <= ?"
+        params.append(_timestamp(upTo))
+    chunkQuery += " ORDER BY lastDate DESC" if newestFirst else " ORDER BY lastDate"
+
+    for month in months:
+        with closing(_open_segment(shard, month)) as segment:
+            for (data,) in segment.execute(chunkQuery, params):
+                rows = _decode(accountId, data)
+                for row in reversed(rows) if newestFirst else rows:
+                    if startDate and row.date < startDate:
+                        continue
+                    if endDate and row.date > endDate:
+                        continue
+                    if transfersOnly and row.transferId is None:
+                        continue
+                    if before and (row.date, row.transactionId) >= before:
+                        continue
+                    yield row
+
+
+def find(db: Session, key: str, field: str) -> List[ArchivedTransaction]:
+    """
+    Archived transactions of the session's shard whose `field` ("transactionId" or
+    "transferId") is `key`. A UUIDv7 key is looked for from its own month on, any other
+    key in every segment; the search stops at the first segment that has it.
+    """
+    shard = session_shard(db)
+    months = segment_months(shard)
+    created = ids.created_at(key)
+    if created is not None:
+        # A row is dated when it is written, at or after its key was made; a day of slack
+        firstMonth = current_month(created - timedelta(days=1))
+        months = [month for month in months if month >= firstMonth]
+    else:
+        months.reverse()
+
+    for month in months:
+        with closing(_open_segment(shard, month)) as segment:
+            chunks = segment.execute(
+                "SELECT chunks.accountId, chunks.data FROM keys JOIN chunks ON chunks.chunkId = keys.chunkId "
+                "WHERE keys.key = ?",
+                (key,),
+            ).fetchall()
+        found = [
+            row for accountId, data in chunks for row in _decode(accountId, data) if getattr(row, field) == key
+        ]
+        if found:
+            extend_query_budget(1)
+            archived = set(
+                db.scalars(
+                    select(archivedMonths.c.accountId).where(
+                        archivedMonths.c.month == month,
+                        archivedMonths.c.accountId.in_({row.accountId for row in found}),
+                    )
+                )
+            )
+            return [row for row in found if row.accountId in archived]
+    return []
+
+
+def movement(db: Session, accountId: str, after: Optional[datetime], upTo: Optional[datetime]) -> Decimal:
+    """
+    Sum of the archived transactions of an account dated after `after` and up to `upTo`
+    (either open when None). Months inside the range are summed from the catalog; only a
+    month the range cuts is read from its segment.
+    """
+    extend_query_budget(1)
+    after = after and utc_naive(after)
+    upTo = upTo and utc_naive(upTo)
+    query = select(archivedMonths).where(archivedMonths.c.accountId == accountId)
+    if after:
+        query = query.where(archivedMonths.c.lastDate > after)
+    if upTo:
+        query = query.where(archivedMonths.c.firstDate <= upTo)
+
+    total = Decimal(0)
+    for month in db.execute(query).all():
+        if (after is None or month.firstDate > after) and (upTo is None or month.lastDate <= upTo):
+            total += month.credits - month.debits
+            continue
+        rows = _read_history(session_shard(db), accountId, [month.month], None, upTo, False, None, False)
+        total += sum((row.amount for row in rows if after is None or row.date > after), Decimal(0))
+    return total
+
@@ -0,0 +1,223 @@
+"""
+Balance slots - the balance of a hot account split over several rows.
+
+Every transfer updates the row of each account it touches, so transfers to and from one
+merchant or treasury account queue on that row's lock. An account split into N slots
+(`python -m app.commands.balance_slots ACCOUNT_ID --slots N`) keeps its balance and
+summary counters in N BalanceSlot rows instead, and transfers stop writing its row:
+
+- a credit goes to a random slot;
+- a debit goes to a random slot that holds the whole amount. When none does, every slot
+  is locked and the amount is drawn from them in turn, so the funds check is made against
+  the whole balance. No slot goes below zero.
+
+The balance and counters of a split account are those of its row plus those of its slots
+(the row keeps its counters from before the split; its balance moves into the slots).
+Readers add them up in SQL with `total`, or on loaded accounts with `load_totals`.
+
+Balance checkpoints of a split account are due by time only
+(`balance_checkpoint_interval_hours`) and are written with every slot locked.
+
+Slots remove waits for row locks, which PostgreSQL takes. SQLite locks the whole database
+for every write transaction, so there they only add statements.
+"""
+
+import random
+from collections import namedtuple
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .metrics import extend_query_budget
+from .models import Account, BalanceSlot
+
+accounts = Account.__table__
+slots = BalanceSlot.__table__
+
+# Random slots tried for a debit before drawing from all of them
+DEBIT_ATTEMPTS = 2
+
+# What a transfer hands back about a split account, in place of the row the account
+# UPDATE returns. Its balance is only known with every slot locked, see `lock`
+SplitAccount = namedtuple("SplitAccount", "name currency balance checkpointCount checkpointAt")
+
+
+def slot_values(entries, credits, debits, month: str) -> dict:
+    """SET clauses that post `entries` ledger entries to a slot, like `ledger.counter_values`."""
+    return {
+        "totalTransactions": slots.c.totalTransactions + entries,
+        "totalCredits": slots.c.totalCredits + credits,
+        "totalDebits": slots.c.totalDebits + debits,
+        "monthTransactions": case(
+            (slots.c.monthKey == month, slots.c.monthTransactions + entries),
+            else_=entries,
+        ),
+        "monthKey": month,
+    }
+
+
+def _split_account(db: Session, accountId: str):
+    account = db.execute(
+        select(
+            accounts.c.name,
+            accounts.c.currency,
+            accounts.c.balanceSlots,
+            accounts.c.checkpointAt,
+        ).where(accounts.c.accountId == accountId)
+    ).first()
+    if account is None or account.balanceSlots <= 1:
+        return None
+    return account
+
+
+def _posted(account) -> SplitAccount:
+    return SplitAccount(account.name, account.currency, None, 0, account.checkpointAt)
+
+
+def debit(db: Session, accountId: str, amount: Decimal, month: str) -> Optional[SplitAccount]:
+    """Debit a split account; None when the account is not split, missing or short of funds."""
+    account = _split_account(db, accountId)
+    if account is None:
+        return None
+    extend_query_budget(2 + DEBIT_ATTEMPTS)
+
+    candidates = list(
+        db.scalars(
+            select(slots.c.slot).where(slots.c.accountId == accountId, slots.c.balance >= amount)
+        )
+    )
+    random.shuffle(candidates)
+    for slot in candidates[:DEBIT_ATTEMPTS]:
+        debited = db.execute(
+            update(slots)
+            .where(
+                slots.c.accountId == accountId,
+                slots.c.slot == slot,
+                slots.c.balance >= amount,  # taken by a concurrent debit meanwhile
+            )
+            .values(balance=slots.c.balance - amount, **slot_values(1, 0, amount, month))
+            .returning(slots.c.slot)
+        ).first()
+        if debited:
+            return _posted(account)
+
+    # No single slot holds the amount: draw it from all of them, holding every slot's lock
+    held = lock(db, [accountId])[accountId]
+    extend_query_budget(1 + len(held))
+    if sum(balance for _, balance in held) < amount:
+        return None
+    draw(db, accountId, held, amount, slot_values(1, 0, amount, month))
+    return _posted(account)
+
+
+def credit(db: Session, accountId: str, amount: Decimal, month: str) -> Optional[SplitAccount]:
+    """Credit a split account; None when the account is not split or missing."""
+    account = _split_account(db, accountId)
+    if account is None:
+        return None
+    extend_query_budget(2)
+
+    db.execute(
+        update(slots)
+        .where(slots.c.accountId == accountId, slots.c.slot == random.randrange(account.balanceSlots))
+        .values(balance=slots.c.balance + amount, **slot_values(1, amount, 0, month))
+    )
+    return _posted(account)
+
+
+def lock(db: Session, accountIds) -> Dict[str, List[Tuple[int, Decimal]]]:
+    """Lock every slot of the split accounts, in key order; accountId -> [(slot, balance)]."""
+    held = {accountId: [] for accountId in accountIds}
+    if not held:
+        return held
+    rows = db.execute(
+        select(slots.c.accountId, slots.c.slot, slots.c.balance)
+        .where(slots.c.accountId.in_(held))
+        .order_by(slots.c.accountId, slots.c.slot)
+        .with_for_update()
+    )
+    for accountId, slot, balance in rows:
+        held[accountId].append((slot, balance))
+    return held
+
+
+def draw(db: Session, accountId: str, held: list, amount: Decimal, counters: Optional[dict] = None) -> None:
+    """Take `amount` from locked slots (`lock`) in turn; `counters` go to the first slot drawn from."""
+    remaining = amount
+    for slot, balance in held:
+        take = min(balance, remaining)
+        if take <= 0:
+            continue
+        values = {"balance": slots.c.balance - take}
+        if counters:
+            values.update(counters)
+            counters = None
+        db.execute(
+            update(slots).where(slots.c.accountId == accountId, slots.c.slot == slot).values(**values)
+        )
+        remaining -= take
+        if not remaining:
+            return
+
+
+def total(column):
+    """An account column in SQL, plus the same column of its slots when it is split."""
+    slotTotal = (
+        select(func.coalesce(func.sum(slots.c[column.key]), 0))
+        .where(slots.c.accountId == accounts.c.accountId)
+        .scalar_subquery()
+    )
+    return case((accounts.c.balanceSlots > 1, column + slotTotal), else_=column)
+
+
+def month_transactions(month: str):
+    """Ledger entries of an account in `month`, in SQL, its slots' included."""
+    own = case((accounts.c.monthKey == month, accounts.c.monthTransactions), else_=0)
+    slotTotal = (
+        select(
+            func.coalesce(
+                func.sum(case((slots.c.monthKey == month, slots.c.monthTransactions), else_=0)), 0
+            )
+        )
+        .where(slots.c.accountId == accounts.c.accountId)
+        .scalar_subquery()
+    )
+    return case((accounts.c.balanceSlots > 1, own + slotTotal), else_=own)
+
+
+def load_totals(db: Session, loadedAccounts) -> None:
+    """
+    Give loaded split accounts their full balance and counters. Only the loaded values
+    change, nothing is written; accounts that are not split cost nothing.
+    """
+    split = {account.accountId: account for account in loadedAccounts if account.balanceSlots > 1}
+    if not split:
+        return
+    extend_query_budget(1)
+
+    month = datetime.now(timezone.utc).strftime("%Y-%m")
+    rows = db.execute(
+        select(
+            slots.c.accountId,
+            func.sum(slots.c.balance).label("balance"),
+            func.sum(slots.c.totalTransactions).label("totalTransactions"),
+            func.sum(slots.c.totalCredits).label("totalCredits"),
+            func.sum(slots.c.totalDebits).label("totalDebits"),
+            func.sum(case((slots.c.monthKey == month, slots.c.monthTransactions), else_=0)).label(
+                "monthTransactions"
+            ),
+        )
+        .where(slots.c.accountId.in_(split))
+        .group_by(slots.c.accountId)
+    )
+    for row in rows:
+        account = split[row.accountId]
+        for name in ("balance", "totalTransactions", "totalCredits", "totalDebits"):
+            set_committed_value(account, name, getattr(account, name) + getattr(row, name))
+        ownMonth = account.monthTransactions if account.monthKey == month else 0
+        set_committed_value(account, "monthTransactions", ownMonth + row.monthTransactions)
+        set_committed_value(account, "monthKey", month)
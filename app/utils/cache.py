@@ -0,0 +1,161 @@
+"""
+In-process caches and the account balance cache.
+
+`LRUCache` is bounded by size and per-entry TTL and counts hits and misses. `NullCache`
+has the same interface and never stores anything, for running with caching disabled.
+
+A reader that misses takes a `token` before it reads the database and hands it back to
+`set`; if the key was invalidated in between, the value it read may predate a commit and
+is dropped instead of cached. Invalidations are counted per stripe of keys, so the
+bookkeeping stays bounded however many keys are invalidated.
+
+Balance entries are invalidated from Session events: writers mark the accounts they
+change with `mark_accounts_changed` (ORM flushes of Account rows are picked up
+automatically), and the marked entries are dropped before and after the commit.
+Other worker processes never hear of the commit, and would serve their entries until
+the TTL expires; the balance cache is therefore off unless MEOW_BALANCE_CACHE_ENABLED is
+set, which is only safe with a single worker.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import settings
+
+
+class NullCache:
+    """Cache interface that stores nothing."""
+
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        self.misses += 1
+        return None
+
+    def token(self, key: Hashable) -> int:
+        return 0
+
+    def set(self, key: Hashable, value: Any, token: Optional[int] = None, ttl: Optional[float] = None) -> None:
+        pass
+
+    def invalidate(self, key: Hashable) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"enabled": False, "size": 0, "hits": self.hits, "misses": self.misses}
+
+
+class LRUCache(NullCache):
+    """Thread-safe LRU cache with a bounded size and a TTL per entry."""
+
+    STRIPES = 1024
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expiresAt, value)
+        self._epochs = [0] * self.STRIPES
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def token(self, key: Hashable) -> int:
+        return self._epochs[hash(key) % self.STRIPES]
+
+    def set(self, key: Hashable, value: Any, token: Optional[int] = None, ttl: Optional[float] = None) -> None:
+        """Store `value` for the cache's TTL, or for `ttl` seconds when that is shorter."""
+        with self._lock:
+            if token is not None and token != self._epochs[hash(key) % self.STRIPES]:
+                return  # invalidated while the value was being read
+            lifetime = self.ttl if ttl is None else min(self.ttl, ttl)
+            self._entries[key] = (time.monotonic() + lifetime, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._epochs[hash(key) % self.STRIPES] += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epochs = [epoch + 1 for epoch in self._epochs]
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def make_cache(enabled: bool, maxsize: int, ttl: float) -> NullCache:
+    return LRUCache(maxsize, ttl) if enabled else NullCache()
+
+
+# accountId -> schemas.AccountBalance
+balance_cache = make_cache(
+    settings.balance_cache_enabled, settings.balance_cache_size, settings.balance_cache_ttl
+)
+
+
+def mark_accounts_changed(db: Session, *accountIds: str) -> None:
+    """Drop the cached balances of these accounts when `db` commits."""
+    db.info.setdefault("changedAccounts", set()).update(accountIds)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed_accounts(session, flush_context):
+    from .models import Account
+
+    changed = [
+        instance.accountId
+        for instance in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(instance, Account)
+    ]
+    if changed:
+        mark_accounts_changed(session, *changed)
+
+
+@event.listens_for(Session, "before_commit")
+def _invalidate_before_commit(session):
+    # Readers between here and after_commit miss, and cannot cache what they read
+    for accountId in session.info.get("changedAccounts", ()):
+        balance_cache.invalidate(accountId)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _invalidate_after_commit(session):
+    # A rollback may follow released savepoints, so it invalidates rather than forgets
+    for accountId in session.info.pop("changedAccounts", ()):
+        balance_cache.invalidate(accountId)
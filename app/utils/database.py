@@ -1,23 +1,203 @@
-from sqlalchemy import create_engine
+import os
+import time
+from sqlalchemy import create_engine, event, insert, inspect, literal, select
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import DatabaseError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.schema import CreateColumn
+from typing import AsyncGenerator, Generator, List
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./meow_financial_institute.db"
+from .config import settings
+from .ids import MAX_SHARDS
+from . import metrics
 
-# connect_args={"check_same_thread": False} is needed only for SQLite to allow multiple threads to access the same connection
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    echo=False,
-)
+SQLALCHEMY_DATABASE_URL = settings.database_url
+
+
+# Async drivers used in async mode for each backend
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def async_database_url(url: str) -> str:
+    """Same database as `url`, addressed through its async driver."""
+    url = make_url(url)
+    return url.set(
+        drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    ).render_as_string(hide_password=False)
+
+
+def is_sqlite_memory(url: str) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(url: str, asynchronous: bool = False) -> dict:
+    """create_engine() keyword arguments for `url`, taken from settings."""
+    options = {"echo": False, "pool_pre_ping": settings.pool_pre_ping}
+
+    if make_url(url).get_backend_name() == "sqlite":
+        # needed only for SQLite to allow multiple threads to access the same connection
+        options["connect_args"] = {"check_same_thread": False}
+        if is_sqlite_memory(url):
+            return options  # single shared connection, pool settings do not apply
+        if asynchronous:
+            options["poolclass"] = AsyncAdaptedQueuePool  # aiosqlite defaults to NullPool
+
+    options.update(
+        pool_size=settings.pool_size,
+        max_overflow=settings.pool_max_overflow,
+        pool_timeout=settings.pool_timeout,
+        pool_recycle=settings.pool_recycle,
+    )
+    return options
+
+
+def configure_sqlite(engine: Engine) -> None:
+    """
+    Apply the SQLite pragmas from settings to every new connection and take over BEGIN.
+
+    The driver's own transaction handling is switched off so that SQLAlchemy emits BEGIN
+    itself; this makes SAVEPOINTs reliable and lets write sessions use BEGIN IMMEDIATE.
+    """
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.sqlite_busy_timeout)}")
+        if not is_sqlite_memory(str(engine.url)):
+            cursor.execute(f"PRAGMA journal_mode = {settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA cache_size = {int(settings.sqlite_cache_size)}")
+        cursor.execute(f"PRAGMA mmap_size = {int(settings.sqlite_mmap_size)}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _on_begin(connection):
+        beginMode = connection.get_execution_options().get("sqlite_begin", "DEFERRED")
+        connection.exec_driver_sql(f"BEGIN {beginMode}")
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Report the duration of every statement to `utils/metrics.py`, failed ones included."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("statementStarts", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        started = connection.info["statementStarts"].pop()
+        metrics.record_statement(statement, time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exceptionContext):
+        starts = exceptionContext.connection is not None and exceptionContext.connection.info.get(
+            "statementStarts"
+        )
+        if starts:
+            metrics.record_statement(
+                exceptionContext.statement or "", time.perf_counter() - starts.pop()
+            )
+
+
+def build_engine(url: str) -> Engine:
+    """Engine for `url` with pool and SQLite settings applied."""
+    engine = create_engine(url, **engine_options(url))
+    if engine.dialect.name == "sqlite":
+        configure_sqlite(engine)
+    if settings.metrics_enabled:
+        instrument_engine(engine)
+    return engine
+
+
+def build_async_engine(url: str):
+    """AsyncEngine for `url`, through the backend's async driver."""
+    asyncUrl = async_database_url(url)
+    engine = create_async_engine(asyncUrl, **engine_options(asyncUrl, asynchronous=True))
+    if engine.dialect.name == "sqlite":
+        configure_sqlite(engine.sync_engine)
+    if settings.metrics_enabled:
+        instrument_engine(engine.sync_engine)
+    return engine
+
+
+engine = build_engine(SQLALCHEMY_DATABASE_URL)
 
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Write routes read before they write (duplicate email check, account lookup). On SQLite a
+# deferred transaction cannot upgrade to a write lock once another writer committed, and
+# fails with "database is locked" without waiting, so these take the write lock at BEGIN.
+# The option is ignored by other backends.
+writeEngine = engine.execution_options(sqlite_begin="IMMEDIATE")
+WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=writeEngine)
+
 Base = declarative_base()
 
 
+# Shards, see `utils/sharding.py`: the main database is shard 0 and every URL of
+# settings.shard_urls adds one. Engines of the added shards carry their number as an
+# execution option, so keys generated for their rows encode it (`models.shard_key`).
+if len(settings.shard_urls) >= MAX_SHARDS:
+    raise RuntimeError(
+        f"MEOW_SHARD_URLS lists {len(settings.shard_urls)} shards, at most {MAX_SHARDS - 1} are supported"
+    )
+if settings.shard_urls and settings.async_mode:
+    raise RuntimeError("MEOW_SHARD_URLS is not supported with MEOW_ASYNC_MODE")
+
+shardEngines: List[Engine] = [engine, *(build_engine(url) for url in settings.shard_urls)]
+ShardSessionLocal = [SessionLocal] + [
+    sessionmaker(autocommit=False, autoflush=False, bind=shardEngine.execution_options(shard=number))
+    for number, shardEngine in enumerate(shardEngines[1:], 1)
+]
+ShardWriteSessionLocal = [WriteSessionLocal] + [
+    sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        bind=shardEngine.execution_options(shard=number, sqlite_begin="IMMEDIATE"),
+    )
+    for number, shardEngine in enumerate(shardEngines[1:], 1)
+]
+
+
+def session_shard(db: Session) -> int:
+    """Number of the shard a session is bound to."""
+    return db.get_bind().get_execution_options().get("shard", 0)
+
+
+# Only built in async mode, so the async drivers are not needed otherwise
+async_engine = (
+    build_async_engine(SQLALCHEMY_DATABASE_URL) if settings.async_mode else None
+)
+
+# expire_on_commit=False: attributes must stay loaded after commit, lazy loads are not allowed in async code
+AsyncSessionLocal = (
+    async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    if async_engine is not None
+    else None
+)
+AsyncWriteSessionLocal = (
+    async_sessionmaker(
+        async_engine.execution_options(sqlite_begin="IMMEDIATE"),
+        autoflush=False,
+        expire_on_commit=False,
+    )
+    if async_engine is not None
+    else None
+)
+
+
+# A forked worker (e.g. gunicorn --preload) must not reuse the parent's pooled connections
+os.register_at_fork(
+    after_in_child=lambda: [shardEngine.dispose(close=False) for shardEngine in shardEngines]
+)
+
+
 def get_db() -> Generator[Session, None, None]:
     db = SessionLocal()
     try:
@@ -26,7 +206,121 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+def get_write_db() -> Generator[Session, None, None]:
+    db = WriteSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_write_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncWriteSessionLocal() as db:
+        yield db
+
+
+def add_missing_columns(bind) -> None:
+    """
+    ALTER TABLE ... ADD COLUMN for model columns an existing table does not have yet.
+
+    There is no migration tool, so columns added to the models must be nullable or carry
+    a server_default to be added to databases created by an earlier version.
+    """
+    with bind.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    columnDdl = CreateColumn(column).compile(dialect=connection.dialect)
+                    connection.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {columnDdl}"
+                    )
+
+
+# Settings that decide how stored data is laid out: the layout a database recorded before
+# the setting existed, and the command that converts between layouts
+STORAGE_SETTINGS = {
+    "money_storage": ("numeric", "migrate_money"),
+    "id_storage": ("text", "migrate_ids"),
+}
+
+
+def check_storage_settings(bind) -> None:
+    """
+    Refuse to start against a database whose money columns or keys are stored another way.
+
+    The storage is recorded when the database is created. Databases from before a setting
+    existed, with accounts in them, hold the layout the app used back then.
+    """
+    from .models import Account, StorageSetting
+
+    with bind.begin() as connection:
+        recorded = dict(connection.execute(select(StorageSetting.name, StorageSetting.value)).all())
+        missing = [name for name in STORAGE_SETTINGS if name not in recorded]
+        if missing:
+            hasAccounts = (
+                connection.scalar(select(literal(1)).select_from(Account.__table__).limit(1))
+                is not None
+            )
+            for name in missing:
+                recorded[name] = STORAGE_SETTINGS[name][0] if hasAccounts else getattr(settings, name)
+                connection.execute(insert(StorageSetting).values(name=name, value=recorded[name]))
+
+    for name, (_, command) in STORAGE_SETTINGS.items():
+        configured = getattr(settings, name)
+        if recorded[name] != configured:
+            raise RuntimeError(
+                f"The database has {name} {recorded[name]} but MEOW_{name.upper()} is "
+                f"{configured}; run `python -m app.commands.{command} --to {configured}` first"
+            )
+
+
+# Indexes earlier versions created that duplicate a primary key
+REDUNDANT_INDEXES = ("ix_customers_customerId", "ix_accounts_accountId", "ix_transactions_transactionId")
+
+
+def drop_redundant_indexes(bind) -> None:
+    with bind.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            for index in inspector.get_indexes(table.name):
+                if index["name"] in REDUNDANT_INDEXES:
+                    connection.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+
+
 def init_db() -> None:
-    from . import models
+    """Create or upgrade the schema of every shard."""
+    for shardEngine in shardEngines:
+        init_database(shardEngine.execution_options(sqlite_begin="IMMEDIATE"))
+
+
+def init_database(bind) -> None:
+    from . import models, search
 
-    Base.metadata.create_all(bind=engine)
+    # Several uvicorn workers can start at once; the losers of a CREATE TABLE race retry.
+    # On SQLite the write engine makes them wait for the schema lock instead of failing.
+    for attempt in range(3):
+        try:
+            Base.metadata.create_all(bind=bind)
+            # create_all skips tables that already exist, including their new columns and indexes
+            add_missing_columns(bind)
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=bind, checkfirst=True)
+            drop_redundant_indexes(bind)
+            check_storage_settings(bind)
+            search.create_search_indexes(bind)
+            return
+        except DatabaseError:
+            if attempt == 2:
+                raise
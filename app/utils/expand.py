@@ -0,0 +1,83 @@
+"""
+`expand` query parameter - which relationships an endpoint loads and returns.
+
+Expanded relationships are loaded eagerly with a fixed number of queries, however many
+rows they hold: accounts with one selectinload query, the latest transactions of every
+account with one window-function query. Relationships that were not expanded are set to
+raise instead of lazy loading, so a serializer touching them fails loudly instead of
+issuing a query per row.
+"""
+
+from typing import Iterable, Set
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, aliased, raiseload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .models import Customer, Transaction
+
+CUSTOMER_EXPANSIONS = ("accounts", "accounts.transactions")
+
+# Transactions returned per account with expand=accounts.transactions
+DEFAULT_TRANSACTIONS_PER_ACCOUNT = 10
+MAX_TRANSACTIONS_PER_ACCOUNT = 100
+
+
+def parse_expand(expand: str, allowed: Iterable[str]) -> Set[str]:
+    """Expansions requested in a comma-separated `expand`; a nested one implies its parent."""
+    allowed = tuple(allowed)
+    expansions = {part.strip() for part in expand.split(",") if part.strip()}
+    unknown = expansions.difference(allowed)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cannot expand {', '.join(sorted(unknown))}; allowed: {', '.join(allowed)}",
+        )
+    for expansion in list(expansions):
+        while "." in expansion:
+            expansion = expansion.rsplit(".", 1)[0]
+            expansions.add(expansion)
+    return expansions
+
+
+def customer_load_options(expansions: Set[str]) -> list:
+    if "accounts" not in expansions:
+        return [raiseload("*")]
+    return [raiseload("*"), selectinload(Customer.accounts).raiseload("*")]
+
+
+def attach_recent_transactions(db: Session, accounts: list, limit: int) -> None:
+    """
+    Load the `limit` newest transactions of every account in one query and set them as
+    `account.transactions`, newest first, without marking the accounts as changed.
+    """
+    if not accounts:
+        return
+
+    rowNumber = (
+        func.row_number()
+        .over(
+            partition_by=Transaction.accountId,
+            order_by=(Transaction.date.desc(), Transaction.transactionId.desc()),
+        )
+        .label("rowNumber")
+    )
+    ranked = (
+        select(Transaction, rowNumber)
+        .where(Transaction.accountId.in_([account.accountId for account in accounts]))
+        .subquery()
+    )
+    rankedTransaction = aliased(Transaction, ranked)
+    transactions = db.scalars(
+        select(rankedTransaction)
+        .where(ranked.c.rowNumber <= limit)
+        .order_by(ranked.c.accountId, ranked.c.date.desc(), ranked.c.transactionId.desc())
+    ).all()
+
+    byAccount = {account.accountId: [] for account in accounts}
+    for transaction in transactions:
+        byAccount[transaction.accountId].append(transaction)
+    for account in accounts:
+        set_committed_value(account, "transactions", byAccount[account.accountId])
+
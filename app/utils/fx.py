@@ -0,0 +1,204 @@
+"""
+Exchange rates - the fx_rates table, and the in-memory copy conversions read.
+
+A rate converts an amount of its base currency into its quote currency from its
+effectiveFrom until the pair's next rate. A pair with rates in the other direction only
+converts with their inverse, rounded to RATE_SCALE places. There is no conversion
+through a third currency.
+
+Every worker keeps all the rates in memory as one immutable `FxRates` snapshot, so
+converting any number of amounts costs no query. Every write to fx_rates takes the next
+version, and the snapshot holds the highest one it has read: at most every
+`settings.fx_rate_check_seconds`, one `SELECT max(version)` on the main database tells
+whether any worker has written a rate since, and only then are the rates read again. A
+write through this worker invalidates the snapshot at once.
+
+Conversions are Decimal throughout: amounts are multiplied at full precision, summed, and
+rounded once, half to even, to the minor unit of the currency converted to.
+
+Account currencies never change, so the currencies a transfer needs before its UPDATEs
+are cached too, see `account_currencies`.
+"""
+
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_EVEN, Context, Decimal, localcontext
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .cache import LRUCache
+from .config import settings
+from .database import ShardSessionLocal, session_shard
+from .metrics import extend_query_budget
+from .models import Account, FxRate
+from .money import RATE_SCALE, currency_exponent
+
+accounts = Account.__table__
+fxRates = FxRate.__table__
+
+# Enough digits that products and sums of amounts and rates are exact before the rounding
+FX_CONTEXT = Context(prec=50)
+ONE = Decimal(1)
+# Inverse rates are rounded to the places stored rates have
+RATE_UNIT = ONE.scaleb(-RATE_SCALE)
+
+
+def _utc_naive(value: datetime) -> datetime:
+    return value if value.tzinfo is None else value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def round_to_currency(amount: Decimal, currency: str) -> Decimal:
+    return amount.quantize(ONE.scaleb(-currency_exponent(currency)), rounding=ROUND_HALF_EVEN)
+
+
+class FxRates:
+    """Every rate at one version; immutable, so requests share it without locking."""
+
+    def __init__(self, version: int, rows: Iterable) -> None:
+        self.version = version
+        self._pairs = {}  # (base, quote) -> ([effectiveFrom, ...], [rate, ...]), oldest first
+        for row in sorted(rows, key=lambda row: row.effectiveFrom):
+            dates, rates = self._pairs.setdefault((row.baseCurrency, row.quoteCurrency), ([], []))
+            dates.append(_utc_naive(row.effectiveFrom))
+            rates.append(Decimal(row.rate))
+
+    def _find(self, base: str, quote: str, at: datetime) -> Optional[Decimal]:
+        entry = self._pairs.get((base, quote))
+        if entry is None:
+            return None
+        dates, rates = entry
+        position = bisect_right(dates, at)
+        return rates[position - 1] if position else None
+
+    def rate(self, base: str, quote: str, at: datetime) -> Optional[Decimal]:
+        """Units of `quote` per unit of `base` at `at`, or None."""
+        if base == quote:
+            return ONE
+        at = _utc_naive(at)
+        rate = self._find(base, quote, at)
+        if rate is not None:
+            return rate
+        inverse = self._find(quote, base, at)
+        if inverse is None:
+            return None
+        return FX_CONTEXT.divide(ONE, inverse).quantize(RATE_UNIT, rounding=ROUND_HALF_EVEN)
+
+    def require_rate(self, base: str, quote: str, at: datetime) -> Decimal:
+        rate = self.rate(base, quote, at)
+        if rate is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"No exchange rate from {base} to {quote}",
+            )
+        return rate
+
+    def convert(self, amount: Decimal, base: str, quote: str, at: datetime) -> Decimal:
+        """`amount` of `base` in `quote`, rounded to its minor unit; 400 without a rate."""
+        return round_to_currency(FX_CONTEXT.multiply(amount, self.require_rate(base, quote, at)), quote)
+
+    def convert_totals(
+        self, totals: Dict[str, Decimal], quote: str, at: datetime
+    ) -> Tuple[Decimal, List[str]]:
+        """
+        The sum of currency -> amount `totals` in `quote`, rounded once, over the currencies
+        with a rate; and the currencies without one, left out of the sum.
+        """
+        total = Decimal(0)
+        missing = []
+        with localcontext(FX_CONTEXT):
+            for currency, amount in totals.items():
+                rate = self.rate(currency, quote, at)
+                if rate is None:
+                    missing.append(currency)
+                else:
+                    total += amount * rate
+        return round_to_currency(total, quote), sorted(missing)
+
+
+class FxRateCache:
+    """
+    The current `FxRates`, checked against max(version) at most every `checkSeconds`.
+
+    No lock is held while the database is read: in async mode the read suspends on the
+    event loop, where a waiting thread lock would block every other request. Two requests
+    can then both reload, and the later result wins.
+    """
+
+    def __init__(self, checkSeconds: float) -> None:
+        self.checkSeconds = checkSeconds
+        self._rates: Optional[FxRates] = None
+        self._checkedAt = float("-inf")
+        self._epoch = 0
+
+    def get(self, db: Session) -> FxRates:
+        rates = self._rates
+        if rates is not None and time.monotonic() - self._checkedAt < self.checkSeconds:
+            return rates
+
+        epoch = self._epoch
+        checkedAt = time.monotonic()
+        if session_shard(db) == 0:
+            rates = self._load(db, rates)
+        else:  # rates are kept on the main database
+            with ShardSessionLocal[0]() as main:
+                rates = self._load(main, rates)
+        self._rates = rates
+        if epoch == self._epoch:  # else invalidated while reading, check again next time
+            self._checkedAt = checkedAt
+        return rates
+
+    def _load(self, db: Session, rates: Optional[FxRates]) -> FxRates:
+        extend_query_budget(2)  # BEGIN, when it is the first statement, and the version
+        version = db.scalar(select(func.coalesce(func.max(fxRates.c.version), 0)))
+        if rates is not None and rates.version == version:
+            return rates
+        extend_query_budget(1)
+        rows = db.execute(
+            select(
+                fxRates.c.baseCurrency,
+                fxRates.c.quoteCurrency,
+                fxRates.c.effectiveFrom,
+                fxRates.c.rate,
+                fxRates.c.version,
+            )
+        ).all()
+        # Without a snapshot (READ COMMITTED) the rows may be newer than the version read
+        return FxRates(max((row.version for row in rows), default=0), rows)
+
+    def invalidate(self) -> None:
+        self._epoch += 1
+        self._checkedAt = float("-inf")
+
+
+fx_rate_cache = FxRateCache(settings.fx_rate_check_seconds)
+
+# accountId -> currency; never stale, an account's currency does not change
+currency_cache = LRUCache(settings.account_currency_cache_size, float("inf"))
+
+
+def rates(db: Session) -> FxRates:
+    return fx_rate_cache.get(db)
+
+
+def account_currencies(db: Session, accountIds: Iterable[str]) -> Dict[str, str]:
+    """Currencies of the accounts that exist, by accountId; one query for those not cached."""
+    currencies = {}
+    missing = []
+    for accountId in accountIds:
+        currency = currency_cache.get(accountId)
+        if currency is None:
+            missing.append(accountId)
+        else:
+            currencies[accountId] = currency
+    if missing:
+        extend_query_budget(1)
+        for accountId, currency in db.execute(
+            select(accounts.c.accountId, accounts.c.currency).where(accounts.c.accountId.in_(missing))
+        ):
+            currency_cache.set(accountId, currency)
+            currencies[accountId] = currency
+    return currencies
@@ -0,0 +1,134 @@
+"""
+Group commit - concurrent write requests share database transactions.
+
+With `settings.group_commit_enabled`, transfers are not committed by the request that
+made them. They are queued for a single writer thread, which takes whatever arrived
+within `group_commit_max_wait_ms` of the first item (at most `group_commit_max_batch`
+items), applies each one in its own SAVEPOINT and commits the batch once. Every caller
+waits on a Future that resolves with its own result or exception only after the commit,
+so a response is never sent for a transfer that could still be rolled back.
+
+An item that fails rolls back to its savepoint and does not affect the rest of its
+batch. A failed commit fails every item of the batch.
+
+Each item runs in the context of the request that submitted it, so its statements are
+still attributed to that request in `/metrics`. Every shard has its own writer thread.
+"""
+
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import ShardWriteSessionLocal
+
+_STOP = object()
+
+
+class GroupCommitScheduler:
+    """Single writer thread applying queued work in shared transactions."""
+
+    def __init__(self, sessionFactory: Callable[[], Session], maxBatch: int, maxWaitSeconds: float) -> None:
+        self.sessionFactory = sessionFactory
+        self.maxBatch = maxBatch
+        self.maxWaitSeconds = maxWaitSeconds
+        self.batches = 0
+        self.items = 0
+        self.largestBatch = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._startLock = threading.Lock()
+
+    def submit(self, work: Callable, *args) -> Future:
+        """Queue `work(db, *args)`; the Future resolves once its batch has committed."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((contextvars.copy_context(), work, args, future))
+        return future
+
+    def stop(self) -> None:
+        """Apply what is queued, then stop the writer thread."""
+        with self._startLock:
+            if self._thread is None:
+                return
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "averageBatch": round(self.items / self.batches, 2) if self.batches else 0,
+            "largestBatch": self.largestBatch,
+        }
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._startLock:
+                if self._thread is None:
+                    # Started on first use, so a forked worker gets its own thread
+                    self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.maxWaitSeconds
+            while len(batch) < self.maxBatch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._apply(batch)
+
+    def _apply(self, batch: list) -> None:
+        outcomes = []  # (future, result, exception)
+        db = self.sessionFactory()
+        try:
+            for context, work, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with db.begin_nested():
+                        outcomes.append((future, context.run(work, db, *args), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            outcomes = [(future, None, e) for future, _, _ in outcomes]
+        finally:
+            db.close()
+
+        self.batches += 1
+        self.items += len(batch)
+        self.largestBatch = max(self.largestBatch, len(batch))
+        for future, result, exception in outcomes:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+
+# One per shard, indexed by shard number
+transfer_schedulers = [
+    GroupCommitScheduler(
+        sessionFactory, settings.group_commit_max_batch, settings.group_commit_max_wait_ms / 1000
+    )
+    for sessionFactory in ShardWriteSessionLocal
+]
+transfer_scheduler = transfer_schedulers[0]
@@ -0,0 +1,145 @@
+"""
+Idempotency keys - a retried request gets the response of the original instead of
+being applied twice.
+
+The outcome of a request sent with an `Idempotency-Key` header is stored in the
+idempotency_keys table by the same database transaction that applies the request, so
+the key and its effect commit or roll back together. A fingerprint of the request body
+is stored with it; reusing a key for a different request is rejected with 422.
+
+Keys are scoped to the source account of the transfer: its shard holds the key, in the
+transaction of the debit, so the same key sent for transfers from two accounts names two
+requests (on one shard or several alike). See `scoped_key`.
+
+Recently committed keys are also kept in an in-process LRU cache, so most retries are
+answered without a database round trip. An entry lives no longer than its stored key.
+The table is authoritative: other workers, and this one after an eviction, fall back to it. Expired keys are ignored and removed with
+`python -m app.commands.purge_idempotency_keys`.
+"""
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Type, TypeVar
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+
+from .cache import make_cache
+from .config import settings
+from .models import IdempotencyKey
+
+ResponseModel = TypeVar("ResponseModel", bound=BaseModel)
+
+REPLAYED_HEADER = "Idempotency-Replayed"
+
+idempotencyKeys = IdempotencyKey.__table__
+
+# key -> (fingerprint, response model)
+idempotency_cache = make_cache(
+    True, settings.idempotency_cache_size, settings.idempotency_key_ttl_hours * 3600
+)
+
+
+def fingerprint(request: BaseModel) -> str:
+    return hashlib.sha256(request.model_dump_json().encode()).hexdigest()
+
+
+def scoped_key(accountId: str, key: str) -> str:
+    """The stored key of a client's `key` for requests from `accountId`; fits the 255 characters of the column."""
+    return f"{accountId}/{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def _check_fingerprint(expected: str, actual: str) -> None:
+    if expected != actual:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used for a different request from this account",
+        )
+
+
+def _seconds_until(expiresAt: datetime) -> float:
+    if expiresAt.tzinfo is None:  # stored as naive UTC
+        expiresAt = expiresAt.replace(tzinfo=timezone.utc)
+    return (expiresAt - datetime.now(timezone.utc)).total_seconds()
+
+
+def cached(key: str, requestFingerprint: str) -> Optional[BaseModel]:
+    """Response stored for `key` in this worker's cache, without touching the database."""
+    entry = idempotency_cache.get(key)
+    if entry is None:
+        return None
+    _check_fingerprint(entry[0], requestFingerprint)
+    return entry[1]
+
+
+def replay(
+    db: Session, key: str, requestFingerprint: str, responseModel: Type[ResponseModel]
+) -> Optional[ResponseModel]:
+    """Response of the original request sent with `key`, or None if there was none."""
+    response = cached(key, requestFingerprint)
+    if response is not None:
+        return response
+
+    stored = db.execute(
+        select(
+            idempotencyKeys.c.fingerprint, idempotencyKeys.c.response, idempotencyKeys.c.expiresAt
+        ).where(
+            idempotencyKeys.c.key == key,
+            idempotencyKeys.c.expiresAt > datetime.now(timezone.utc),
+        )
+    ).first()
+    if stored is None:
+        return None
+
+    _check_fingerprint(stored.fingerprint, requestFingerprint)
+    response = responseModel.model_validate_json(stored.response)
+    idempotency_cache.set(key, (stored.fingerprint, response), ttl=_seconds_until(stored.expiresAt))
+    return response
+
+
+def record(db: Session, key: str, requestFingerprint: str, response: BaseModel) -> None:
+    """
+    Store the response of the request sent with `key`, inside the current transaction.
+
+    A concurrent request that committed the same key first makes this, or the commit,
+    fail with IntegrityError; roll back and `replay` the key.
+    """
+    now = datetime.now(timezone.utc)
+    # An expired key still holds the primary key until it is purged
+    db.execute(
+        delete(idempotencyKeys).where(
+            idempotencyKeys.c.key == key, idempotencyKeys.c.expiresAt <= now
+        )
+    )
+    db.execute(
+        insert(idempotencyKeys).values(
+            key=key,
+            fingerprint=requestFingerprint,
+            response=response.model_dump_json(),
+            createdAt=now,
+            expiresAt=now + timedelta(hours=settings.idempotency_key_ttl_hours),
+        )
+    )
+
+
+def remember(key: str, requestFingerprint: str, response: BaseModel, startedAt: datetime) -> None:
+    """
+    Cache a key once the transaction that recorded it has committed. `startedAt` is from
+    before `record`, so the entry expires no later than the stored key.
+    """
+    idempotency_cache.set(
+        key,
+        (requestFingerprint, response),
+        ttl=_seconds_until(startedAt + timedelta(hours=settings.idempotency_key_ttl_hours)),
+    )
+
+
+def purge_expired(db: Session, now: Optional[datetime] = None) -> int:
+    """Delete keys that expired before `now`; returns the number of keys deleted."""
+    return db.execute(
+        delete(idempotencyKeys).where(
+            idempotencyKeys.c.expiresAt <= (now or datetime.now(timezone.utc))
+        )
+    ).rowcount
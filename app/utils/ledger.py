@@ -0,0 +1,437 @@
+"""
+Transfer engine - applies a transfer with guarded, relative UPDATEs.
+
+The debit is a single `UPDATE ... WHERE balance >= :amount RETURNING ...`, so the funds
+check and the balance change happen atomically in the database instead of in Python.
+Ledger rows get client-generated IDs, so nothing has to be refreshed afterwards.
+
+Accounts are always updated in accountId order, which keeps two opposite transfers
+from deadlocking on row locks (PostgreSQL).
+
+The same UPDATEs keep the account's summary aggregates and its count of ledger entries
+since the last balance checkpoint; a due checkpoint is written in the same transaction.
+
+Between accounts in different currencies the credit is the amount converted at the rate
+in effect, from the rates and account currencies cached in memory (`utils/fx.py`).
+
+Hot accounts split into balance slots are posted to through `utils/balance_slots.py`
+instead; their row does not match the UPDATEs.
+"""
+
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Iterable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import balance_slots, fx, idempotency
+from .cache import mark_accounts_changed
+from .config import settings
+from .database import session_shard
+from .money import MAX_AMOUNT, currency_exponent, decimal_places
+from .models import Account, BalanceCheckpoint, Transaction, generate_uuid
+from . import schemas
+
+accounts = Account.__table__
+transactions = Transaction.__table__
+checkpoints = BalanceCheckpoint.__table__
+
+
+# What the transfer UPDATEs hand back about each account
+ACCOUNT_RETURNING = (
+    accounts.c.name,
+    accounts.c.currency,
+    accounts.c.balance,
+    accounts.c.checkpointCount,
+    accounts.c.checkpointAt,
+)
+
+
+def current_month(now: datetime) -> str:
+    return utc_naive(now).strftime("%Y-%m")
+
+
+def counter_values(entries, credits, debits, month: str) -> dict:
+    """
+    SET clauses that keep an account's counters current when `entries` ledger entries
+    totalling `credits` and `debits` are posted to it. Arguments may be bindparams.
+    """
+    return {
+        "checkpointCount": accounts.c.checkpointCount + entries,
+        "totalTransactions": accounts.c.totalTransactions + entries,
+        "totalCredits": accounts.c.totalCredits + credits,
+        "totalDebits": accounts.c.totalDebits + debits,
+        "monthTransactions": case(
+            (accounts.c.monthKey == month, accounts.c.monthTransactions + entries),
+            else_=entries,
+        ),
+        "monthKey": month,
+    }
+
+
+def debit_statement(accountId: str, amount: Decimal, month: str):
+    """Guarded debit: matches no row when the account is missing or short of funds."""
+    return (
+        update(accounts)
+        .where(
+            accounts.c.accountId == accountId,
+            accounts.c.balance >= amount,  # funds check and debit in one statement
+            accounts.c.balanceSlots <= 1,
+        )
+        .values(balance=accounts.c.balance - amount, **counter_values(1, 0, amount, month))
+        .returning(*ACCOUNT_RETURNING)
+    )
+
+
+def credit_statement(accountId: str, amount: Decimal, month: str):
+    return (
+        update(accounts)
+        .where(accounts.c.accountId == accountId, accounts.c.balanceSlots <= 1)
+        .values(balance=accounts.c.balance + amount, **counter_values(1, amount, 0, month))
+        .returning(*ACCOUNT_RETURNING)
+    )
+
+
+def post_debit(db: Session, accountId: str, amount: Decimal, month: str):
+    """
+    Debit an account, split or not. Returns what the UPDATE hands back about the account
+    (ACCOUNT_RETURNING, or a SplitAccount), None when it is missing or short of funds.
+    """
+    return db.execute(debit_statement(accountId, amount, month)).first() or balance_slots.debit(
+        db, accountId, amount, month
+    )
+
+
+def post_credit(db: Session, accountId: str, amount: Decimal, month: str):
+    """Credit an account, split or not; see `post_debit`."""
+    return db.execute(credit_statement(accountId, amount, month)).first() or balance_slots.credit(
+        db, accountId, amount, month
+    )
+
+
+def apply_transfer(db: Session, transfer: schemas.TransferCreate) -> schemas.TransferResponse:
+    """
+    Apply a transfer inside the current database transaction.
+
+    Issues two UPDATE ... RETURNING statements and one INSERT for both ledger rows,
+    plus two more statements on the transfers that are due a balance checkpoint.
+    Raises HTTPException when the transfer is rejected; the caller owns commit/rollback.
+    """
+    if transfer.fromAccountId == transfer.toAccountId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot transfer to the same account",
+        )
+
+    now = datetime.now(timezone.utc)
+    month = current_month(now)
+    # Known before either UPDATE, the credit may come first; missing accounts are not
+    # converted and fail in their UPDATE
+    currencies = fx.account_currencies(db, (transfer.fromAccountId, transfer.toAccountId))
+    creditAmount, rate = credit_amount(
+        db,
+        transfer,
+        currencies.get(transfer.fromAccountId),
+        currencies.get(transfer.toAccountId),
+        now,
+    )
+
+    if transfer.fromAccountId < transfer.toAccountId:
+        fromAccount = post_debit(db, transfer.fromAccountId, transfer.amount, month)
+        toAccount = fromAccount and post_credit(db, transfer.toAccountId, creditAmount, month)
+    else:
+        toAccount = post_credit(db, transfer.toAccountId, creditAmount, month)
+        fromAccount = toAccount and post_debit(db, transfer.fromAccountId, transfer.amount, month)
+
+    if not fromAccount or not toAccount:
+        _raise_rejection(db, transfer)
+
+    mark_accounts_changed(db, transfer.fromAccountId, transfer.toAccountId)
+
+    # Taken after the row locks are held, so ledger dates follow the order balances changed
+    now = datetime.now(timezone.utc)
+    shard = session_shard(db)
+    transferIdValue = generate_uuid(shard)
+    debitTransactionId = generate_uuid(shard)
+    creditTransactionId = generate_uuid(shard)
+
+    db.execute(
+        insert(transactions),
+        [
+            {
+                "transactionId": debitTransactionId,
+                "accountId": transfer.fromAccountId,
+                "amount": -transfer.amount,  # Negative for debit
+                "name": transfer.description or f"Transfer to {toAccount.name}",
+                "transferId": transferIdValue,
+                "currency": fromAccount.currency,
+                "date": now,
+                "createdAt": now,
+            },
+            {
+                "transactionId": creditTransactionId,
+                "accountId": transfer.toAccountId,
+                "amount": creditAmount,  # Positive for credit, in the destination currency
+                "name": transfer.description or f"Transfer from {fromAccount.name}",
+                "transferId": transferIdValue,
+                "currency": toAccount.currency,
+                "date": now,
+                "createdAt": now,
+            },
+        ],
+    )
+
+    write_due_checkpoints(
+        db, [(transfer.fromAccountId, fromAccount), (transfer.toAccountId, toAccount)], now
+    )
+
+    return schemas.TransferResponse(
+        transferId=transferIdValue,
+        fromTransactionId=debitTransactionId,
+        toTransactionId=creditTransactionId,
+        fromAccountId=transfer.fromAccountId,
+        toAccountId=transfer.toAccountId,
+        amount=transfer.amount,
+        creditedAmount=creditAmount,
+        exchangeRate=rate,
+        status="success",
+        message=transfer_message(transfer, fromAccount, toAccount, creditAmount),
+    )
+
+
+def credit_amount(
+    db: Session,
+    transfer: schemas.TransferCreate,
+    fromCurrency: Optional[str],
+    toCurrency: Optional[str],
+    at: datetime,
+) -> Tuple[Decimal, Optional[Decimal]]:
+    """
+    What a transfer credits to its destination account, and the exchange rate when the
+    currencies differ (`utils/fx.py`). Raises 400 when the amount cannot be moved.
+    """
+    if fromCurrency is None or toCurrency is None:
+        return transfer.amount, None
+    # Only the source currency limits the amount, the credit is rounded to the destination's
+    precisionError = amount_precision_error(transfer.amount, fromCurrency)
+    if precisionError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=precisionError)
+    if fromCurrency == toCurrency:
+        return transfer.amount, None
+
+    rates = fx.rates(db)
+    creditAmount = rates.convert(transfer.amount, fromCurrency, toCurrency, at)
+    if creditAmount <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Amount is worth less than the smallest unit of {toCurrency}",
+        )
+    if creditAmount >= MAX_AMOUNT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Amount converted to {toCurrency} is too large",
+        )
+    return creditAmount, rates.rate(fromCurrency, toCurrency, at)
+
+
+def transfer_message(transfer: schemas.TransferCreate, fromAccount, toAccount, creditAmount: Decimal) -> str:
+    message = f"Successfully transferred {transfer.amount} from account {fromAccount.name} to {toAccount.name}"
+    if fromAccount.currency != toAccount.currency:
+        message += f" ({transfer.amount} {fromAccount.currency} credited as {creditAmount} {toAccount.currency})"
+    return message
+
+
+def amount_precision_error(amount: Decimal, *currencies: str) -> Optional[str]:
+    """Why `amount` cannot be moved between accounts in `currencies`, or None."""
+    for currency in currencies:
+        if decimal_places(amount) > currency_exponent(currency):
+            return f"Amount must have at most {currency_exponent(currency)} decimal places for {currency}"
+    return None
+
+
+def apply_transfer_once(
+    db: Session,
+    transfer: schemas.TransferCreate,
+    idempotencyKey: Optional[str],
+    fingerprint: str,
+) -> Tuple[schemas.TransferResponse, bool]:
+    """
+    `apply_transfer` behind an optional Idempotency-Key, in the current transaction.
+    Returns the response and whether it was replayed from an earlier request.
+    """
+    if idempotencyKey:
+        replayed = idempotency.replay(db, idempotencyKey, fingerprint, schemas.TransferResponse)
+        if replayed:
+            return replayed, True
+
+    response = apply_transfer(db, transfer)
+    if idempotencyKey:
+        idempotency.record(db, idempotencyKey, fingerprint, response)
+    return response, False
+
+
+def _raise_rejection(db: Session, transfer: schemas.TransferCreate) -> None:
+    """Work out why a guarded UPDATE matched no row. Only runs on the failure path."""
+    found = dict(
+        db.execute(
+            select(accounts.c.accountId, balance_slots.total(accounts.c.balance)).where(
+                accounts.c.accountId.in_([transfer.fromAccountId, transfer.toAccountId])
+            )
+        ).all()
+    )
+
+    if transfer.fromAccountId not in found:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Source account {transfer.fromAccountId} not found",
+        )
+
+    if transfer.toAccountId not in found:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Destination account {transfer.toAccountId} not found",
+        )
+
+    raise insufficient_funds(transfer, found[transfer.fromAccountId])
+
+
+def insufficient_funds(transfer: schemas.TransferCreate, balance: Decimal) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Insufficient funds in account {transfer.fromAccountId}. "
+        f"Balance: {balance}, Required: {transfer.amount}",
+    )
+
+
+def utc_naive(value: datetime) -> datetime:
+    """Timestamps are stored as naive UTC; bring an aware datetime onto that scale."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def checkpoint_due(checkpointCount: int, checkpointAt: Optional[datetime], now: datetime) -> bool:
+    return (
+        checkpointAt is None
+        or checkpointCount >= settings.balance_checkpoint_every
+        or utc_naive(now) - utc_naive(checkpointAt)
+        >= timedelta(hours=settings.balance_checkpoint_interval_hours)
+    )
+
+
+def write_due_checkpoints(db: Session, postedAccounts, now: datetime) -> None:
+    """
+    Checkpoint the (accountId, what post_debit/post_credit returned) pairs that are due.
+    A split account's balance is summed with every slot locked, and dated after the locks.
+    """
+    due = [
+        (accountId, account)
+        for accountId, account in postedAccounts
+        if checkpoint_due(account.checkpointCount, account.checkpointAt, now)
+    ]
+    write_checkpoints(
+        db,
+        [
+            (accountId, account.balance)
+            for accountId, account in due
+            if not isinstance(account, balance_slots.SplitAccount)
+        ],
+        now,
+    )
+    split = [accountId for accountId, account in due if isinstance(account, balance_slots.SplitAccount)]
+    if split:
+        held = balance_slots.lock(db, split)
+        rowBalances = dict(
+            db.execute(
+                select(accounts.c.accountId, accounts.c.balance).where(accounts.c.accountId.in_(split))
+            ).all()
+        )
+        write_checkpoints(
+            db,
+            [
+                (accountId, rowBalances[accountId] + sum(balance for _, balance in held[accountId]))
+                for accountId in split
+            ],
+            datetime.now(timezone.utc),
+        )
+
+
+def write_checkpoints(
+    db: Session, balances: Iterable[Tuple[str, Decimal]], now: datetime
+) -> None:
+    """
+    Record (accountId, balance) pairs as the balances at `now` and restart their counters.
+
+    Must run in the transaction that changed the balances, while it holds their row locks,
+    and `now` must be taken after the locks were acquired: every ledger entry dated at or
+    before `now` is then included in the checkpoint, and every later one is not.
+    """
+    balances = list(balances)
+    if not balances:
+        return
+
+    db.execute(
+        insert(checkpoints),
+        [
+            {
+                "checkpointId": generate_uuid(session_shard(db)),
+                "accountId": accountId,
+                "asOf": now,
+                "balance": balance,
+                "createdAt": now,
+            }
+            for accountId, balance in balances
+        ],
+    )
+    db.execute(
+        update(accounts)
+        .where(accounts.c.accountId.in_([accountId for accountId, _ in balances]))
+        .values(checkpointCount=0, checkpointAt=now)
+    )
+
+
+def balance_as_of(db: Session, accountId: str, asOf: datetime) -> Decimal:
+    """
+    Balance of an account at `asOf`: the nearest checkpoint at or before it plus the
+    transactions dated after the checkpoint, up to `asOf`, archived ones included.
+    """
+    from . import archive
+
+    asOf = utc_naive(asOf)
+    checkpoint = db.execute(
+        select(checkpoints.c.asOf, checkpoints.c.balance)
+        .where(checkpoints.c.accountId == accountId, checkpoints.c.asOf <= asOf)
+        .order_by(checkpoints.c.asOf.desc())
+        .limit(1)
+    ).first()
+
+    if checkpoint:
+        movement = db.scalar(
+            select(func.coalesce(func.sum(transactions.c.amount), 0)).where(
+                transactions.c.accountId == accountId,
+                transactions.c.date > checkpoint.asOf,
+                transactions.c.date <= asOf,
+            )
+        )
+        return (
+            checkpoint.balance
+            + Decimal(movement)
+            + archive.movement(db, accountId, checkpoint.asOf, asOf)
+        )
+
+    # Accounts opened before checkpoints existed: walk back from the current balance,
+    # in one statement so both sides come from the same snapshot
+    laterMovement = (
+        select(func.coalesce(func.sum(transactions.c.amount), 0))
+        .where(transactions.c.accountId == accountId, transactions.c.date > asOf)
+        .scalar_subquery()
+    )
+    return Decimal(
+        db.scalar(
+            select(balance_slots.total(accounts.c.balance) - laterMovement).where(
+                accounts.c.accountId == accountId
+            )
+        )
+    ) - archive.movement(db, accountId, asOf, None)
@@ -0,0 +1,281 @@
+"""
+Request and SQL metrics, served in the Prometheus text format at `/metrics`.
+
+`MetricsMiddleware` times every request and labels it with its route template
+(`/api/v1/accounts/{accountId}/balance`, not the raw path), so the number of series stays
+bounded. The SQL listeners in `database.py` add each statement's duration to the request
+that ran it, through a context variable; a BEGIN IMMEDIATE is counted as lock wait, which
+separates time spent queueing for the SQLite write lock from time spent in queries.
+
+Admission control (`utils/admission.py`) reports its queue depth, in-flight write
+requests, queue waits and rejections here too.
+
+Each response carries a `Server-Timing` header with the request's app, db and lock time.
+Metrics are kept per worker process.
+
+Routes can declare a statement budget with the `query_budget` dependency. A request over
+its budget is counted and logged, and with MEOW_QUERY_BUDGET_ENFORCE (meant for tests)
+it raises QueryBudgetExceeded.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from .config import settings
+
+slowQueryLog = logging.getLogger("app.sql.slow")
+queryBudgetLog = logging.getLogger("app.sql.budget")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def route_label(scope) -> str:
+    """Route template of a request; known once the router matched it."""
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+class RequestStats:
+    """SQL work done on behalf of one request."""
+
+    __slots__ = ("scope", "statements", "dbSeconds", "lockWaitSeconds", "budget")
+
+    def __init__(self, scope) -> None:
+        self.scope = scope
+        self.statements = 0
+        self.dbSeconds = 0.0
+        self.lockWaitSeconds = 0.0
+        self.budget = None  # set by the query_budget dependency
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more SQL statements than its route allows."""
+
+
+_requestStats: ContextVar[Optional[RequestStats]] = ContextVar("requestStats", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series: Dict[tuple, list] = {}  # labels -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, labelNames: Tuple[str, ...]) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            labelText = _labels(labelNames, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labelText},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labelText}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labelText}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.series: Dict[tuple, float] = {}
+
+    def inc(self, labels: tuple, value: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self, labelNames: Tuple[str, ...]) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{_labels(labelNames, labels)}}} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+def _labels(names: Tuple[str, ...], values: tuple) -> str:
+    return ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+
+
+ROUTE_LABELS = ("method", "route")
+
+requestsTotal = Counter("http_requests_total", "HTTP requests by route and status code.")
+requestDuration = Histogram(
+    "http_request_duration_seconds", "Time to the end of the response body.", LATENCY_BUCKETS
+)
+requestDbSeconds = Histogram(
+    "http_request_db_seconds", "Time spent executing SQL statements per request.", LATENCY_BUCKETS
+)
+requestStatements = Histogram(
+    "http_request_sql_statements", "SQL statements executed per request.", STATEMENT_BUCKETS
+)
+lockWaitTotal = Counter(
+    "http_request_lock_wait_seconds_total", "Time spent waiting in BEGIN IMMEDIATE for the SQLite write lock."
+)
+slowQueriesTotal = Counter("db_slow_queries_total", "SQL statements slower than MEOW_SLOW_QUERY_MS.")
+budgetExceededTotal = Counter(
+    "http_request_query_budget_exceeded_total", "Requests that ran more SQL statements than their route's budget."
+)
+
+# Admission control of the write routes, see `utils/admission.py`
+admissionInFlight = Gauge("admission_in_flight", "Write requests admitted and running.")
+admissionQueueDepth = Gauge("admission_queue_depth", "Write requests waiting for admission.")
+admissionWait = Histogram(
+    "admission_queue_wait_seconds", "Time write requests waited for admission.", LATENCY_BUCKETS
+)
+admissionRejectedTotal = Counter(
+    "admission_rejected_total", "Write requests turned away, by reason (queue_full, deadline, rate_limited)."
+)
+
+_lock = threading.Lock()
+
+
+def record_statement(statement: str, seconds: float) -> None:
+    """Called by the engine listeners after every statement."""
+    stats = _requestStats.get()
+    route = route_label(stats.scope) if stats else "background"
+    if stats is not None:
+        stats.statements += 1
+        stats.dbSeconds += seconds
+        if statement.startswith("BEGIN IMMEDIATE"):
+            stats.lockWaitSeconds += seconds
+
+    if seconds * 1000 >= settings.slow_query_ms:
+        with _lock:
+            slowQueriesTotal.inc((route,))
+        slowQueryLog.warning(
+            "slow query %.1f ms on %s: %s", seconds * 1000, route, " ".join(statement.split())[:500]
+        )
+
+
+def record_admission_wait(labels: tuple, seconds: float) -> None:
+    with _lock:
+        admissionWait.observe(labels, seconds)
+
+
+def record_admission_rejection(labels: tuple, reason: str) -> None:
+    with _lock:
+        admissionRejectedTotal.inc((*labels, reason))
+
+
+def query_budget(statements: int):
+    """
+    Route dependency: the endpoint may run at most `statements` SQL statements per request,
+    BEGIN included. Only checked while metrics are enabled.
+    """
+
+    async def declare_budget() -> None:
+        stats = _requestStats.get()
+        if stats is not None:
+            stats.budget = statements
+
+    return declare_budget
+
+
+def extend_query_budget(statements: int) -> None:
+    """Allow the current request `statements` more, for a route path that needs them."""
+    stats = _requestStats.get()
+    if stats is not None and stats.budget is not None:
+        stats.budget += statements
+
+
+def render() -> str:
+    with _lock:
+        lines = [
+            *requestsTotal.render(("method", "route", "status")),
+            *requestDuration.render(ROUTE_LABELS),
+            *requestDbSeconds.render(ROUTE_LABELS),
+            *requestStatements.render(ROUTE_LABELS),
+            *lockWaitTotal.render(ROUTE_LABELS),
+            *slowQueriesTotal.render(("route",)),
+            *budgetExceededTotal.render(ROUTE_LABELS),
+            *admissionInFlight.render(),
+            *admissionQueueDepth.render(),
+            *admissionWait.render(ROUTE_LABELS),
+            *admissionRejectedTotal.render((*ROUTE_LABELS, "reason")),
+        ]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to their last chunk."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _requestStats.set(stats)
+        started = time.perf_counter()
+        statusCode = 500  # when the app fails before sending a response
+
+        async def sendWithTiming(message):
+            nonlocal statusCode
+            if message["type"] == "http.response.start":
+                statusCode = message["status"]
+                elapsedMs = (time.perf_counter() - started) * 1000
+                serverTiming = (
+                    f"app;dur={elapsedMs - stats.dbSeconds * 1000:.1f}, "
+                    f"db;dur={stats.dbSeconds * 1000:.1f}, "
+                    f"lock;dur={stats.lockWaitSeconds * 1000:.1f}"
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", serverTiming.encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, sendWithTiming)
+        finally:
+            _requestStats.reset(token)
+            elapsed = time.perf_counter() - started
+            labels = (scope["method"], route_label(scope))
+            with _lock:
+                requestsTotal.inc((*labels, statusCode))
+                requestDuration.observe(labels, elapsed)
+                requestDbSeconds.observe(labels, stats.dbSeconds)
+                requestStatements.observe(labels, stats.statements)
+                if stats.lockWaitSeconds:
+                    lockWaitTotal.inc(labels, stats.lockWaitSeconds)
+
+        if stats.budget is not None and stats.statements > stats.budget:
+            with _lock:
+                budgetExceededTotal.inc(labels)
+            message = (
+                f"{labels[0]} {labels[1]} ran {stats.statements} SQL statements, "
+                f"its budget is {stats.budget}"
+            )
+            if settings.query_budget_enforce:
+                raise QueryBudgetExceeded(message)
+            queryBudgetLog.warning(message)
@@ -1,17 +1,87 @@
 """
-- UUID strings work as primary keys (not integers) for better security and scalability
-- Numeric type for all money fields to avoid floating-point precision errors
+- UUID strings work as primary keys (not integers) for better security and scalability;
+  new keys are time-ordered UUIDv7, stored as text or 16 bytes (see `utils/ids.py`)
+- Money type for all money fields to avoid floating-point precision errors
 """
 
-import uuid
 from datetime import datetime, timezone
-from sqlalchemy import Column, ForeignKey, String, Numeric, DateTime
+from sqlalchemy import BigInteger, Column, ForeignKey, Index, Integer, LargeBinary, String, Numeric, DateTime, Text, Uuid
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
+from .config import settings
 from .database import Base
+from .ids import from_bytes, parse_uuid, to_bytes, uuid7
+from .money import MONEY_SCALE, RATE_SCALE, from_minor_units, to_minor_units
 
 
-def generate_uuid() -> str:
-    return str(uuid.uuid4())
+def generate_uuid(shard: int = 0) -> str:
+    return uuid7(shard)
+
+
+def shard_key(context) -> str:
+    """Column default: a new key of the shard the row is inserted into, see `utils/sharding.py`."""
+    return uuid7(context.execution_options.get("shard", 0))
+
+
+class UUIDKey(TypeDecorator):
+    """
+    UUID key, the canonical string in Python, stored as text or as 16 bytes per
+    `settings.id_storage`. See `utils/ids.py`.
+    """
+
+    impl = String
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if settings.id_storage == "binary":
+            if dialect.name == "postgresql":
+                return dialect.type_descriptor(Uuid(as_uuid=False))
+            return dialect.type_descriptor(LargeBinary(16))
+        return dialect.type_descriptor(String())
+
+    def bind_processor(self, dialect):
+        if settings.id_storage != "binary":
+            return super().bind_processor(dialect)
+        if dialect.name == "postgresql":
+            implProcessor = self.load_dialect_impl(dialect).bind_processor(dialect) or str
+            return lambda value: None if value is None else implProcessor(str(parse_uuid(value)))
+        return lambda value: None if value is None else to_bytes(value)
+
+    def result_processor(self, dialect, coltype):
+        if settings.id_storage != "binary":
+            return super().result_processor(dialect, coltype)
+        if dialect.name == "postgresql":
+            return self.load_dialect_impl(dialect).result_processor(dialect, coltype)
+        return lambda value: None if value is None else from_bytes(value)
+
+
+class Money(TypeDecorator):
+    """
+    Decimal amount, stored as NUMERIC or as integer minor units per `settings.money_storage`.
+
+    The only place amounts are converted for storage, see `utils/money.py`.
+    """
+
+    impl = Numeric(18, MONEY_SCALE)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if settings.money_storage == "minor_units":
+            return dialect.type_descriptor(BigInteger())
+        return dialect.type_descriptor(Numeric(18, MONEY_SCALE))
+
+    # Plain processors rather than process_bind_param/process_result_value, so loading a
+    # row costs one function call per amount
+
+    def bind_processor(self, dialect):
+        if settings.money_storage == "minor_units":
+            return lambda value: None if value is None else to_minor_units(value)
+        return super().bind_processor(dialect)
+
+    def result_processor(self, dialect, coltype):
+        if settings.money_storage == "minor_units":
+            return lambda value: None if value is None else from_minor_units(value)
+        return super().result_processor(dialect, coltype)
 
 
 class Customer(Base):
@@ -32,7 +102,7 @@ class Customer(Base):
 
     __tablename__ = "customers"
 
-    customerId = Column(String, primary_key=True, default=generate_uuid, index=True)
+    customerId = Column(UUIDKey, primary_key=True, default=shard_key)
     email = Column(String, unique=True, nullable=False, index=True)
     firstName = Column(String, nullable=False)
     lastName = Column(String, nullable=False)
@@ -67,15 +137,24 @@ class Account(Base):
         currency: Currency code ("USD", "EUR")
         createdAt: Timestamp when the account was created
         updatedAt: Timestamp when the account was last updated
+        checkpointCount: Ledger entries posted since the last balance checkpoint
+        checkpointAt: Timestamp of the last balance checkpoint
+        totalTransactions: Number of ledger entries on the account
+        totalCredits: Sum of all credits
+        totalDebits: Sum of all debits (positive)
+        monthKey: Calendar month ("2024-05", UTC) that monthTransactions counts
+        monthTransactions: Number of ledger entries in monthKey
+        balanceSlots: Number of BalanceSlot rows the balance is split over, 1 when not split
         owner: Relationship to Customer model
         transactions: Relationship to Transaction model
+        checkpoints: Relationship to BalanceCheckpoint model
     """
 
     __tablename__ = "accounts"
 
-    accountId = Column(String, primary_key=True, default=generate_uuid, index=True)
+    accountId = Column(UUIDKey, primary_key=True, default=shard_key)
     customerId = Column(
-        String,
+        UUIDKey,
         ForeignKey("customers.customerId", ondelete="CASCADE"),
         nullable=False,
         index=True,
@@ -83,7 +162,7 @@ class Account(Base):
     name = Column(String, nullable=False)
 
     accountType = Column(String, nullable=False)  # checking or savings for now
-    balance = Column(Numeric(10, 2), nullable=False)
+    balance = Column(Money, nullable=False)
     currency = Column(String, nullable=False, default="USD")
     createdAt = Column(
         DateTime, default=lambda: datetime.now(timezone.utc), nullable=False
@@ -94,11 +173,26 @@ class Account(Base):
         onupdate=lambda: datetime.now(timezone.utc),
         nullable=False,
     )
+    checkpointCount = Column(Integer, nullable=False, default=0, server_default="0")
+    checkpointAt = Column(DateTime, nullable=True)
+
+    # Summary aggregates, maintained by the transfer UPDATEs, rebuilt by app.commands.rebuild_aggregates
+    totalTransactions = Column(Integer, nullable=False, default=0, server_default="0")
+    totalCredits = Column(Money, nullable=False, default=0, server_default="0")
+    totalDebits = Column(Money, nullable=False, default=0, server_default="0")
+    monthKey = Column(String(7), nullable=True)
+    monthTransactions = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # Hot accounts only, see utils/balance_slots.py
+    balanceSlots = Column(Integer, nullable=False, default=1, server_default="1")
 
     owner = relationship("Customer", back_populates="accounts")
     transactions = relationship(
         "Transaction", back_populates="account", cascade="all, delete-orphan"
     )
+    checkpoints = relationship(
+        "BalanceCheckpoint", back_populates="account", cascade="all, delete-orphan"
+    )
 
 
 class Transaction(Base):
@@ -111,7 +205,7 @@ class Transaction(Base):
     Attributes:
         transactionId: Primary key - Unique UUID identifier for the transaction
         accountId: Foreign key to the account this transaction belongs to
-        amount: Transaction amount (Numeric for precision, negative for debits)
+        amount: Transaction amount (Money for precision, negative for debits)
         date: Transaction date and time
         name: Transaction description/name
 
@@ -124,14 +218,13 @@ class Transaction(Base):
 
     __tablename__ = "transactions"
 
-    transactionId = Column(String, primary_key=True, default=generate_uuid, index=True)
+    transactionId = Column(UUIDKey, primary_key=True, default=shard_key)
     accountId = Column(
-        String,
+        UUIDKey,
         ForeignKey("accounts.accountId", ondelete="CASCADE"),
         nullable=False,
-        index=True,
-    )
-    amount = Column(Numeric(10, 2), nullable=False)
+    )  # indexed by ix_transactions_account_history below
+    amount = Column(Money, nullable=False)
 
     date = Column(
         DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), index=True
@@ -140,7 +233,7 @@ class Transaction(Base):
     name = Column(String, nullable=False)
 
     transferId = Column(
-        String, nullable=True, index=True
+        UUIDKey, nullable=True, index=True
     )  # will be null for non-transfer transactions like deposits or purchases if support added.
     currency = Column(String, nullable=False, default="USD")
     createdAt = Column(
@@ -148,3 +241,224 @@ class Transaction(Base):
     )
 
     account = relationship("Account", back_populates="transactions")
+
+    __table_args__ = (
+        # Account history in page order: an account's newest transactions first, with
+        # transactionId breaking ties, so a keyset page is a single index range scan
+        Index(
+            "ix_transactions_account_history",
+            accountId,
+            date.desc(),
+            transactionId.desc(),
+        ),
+    )
+
+
+class BalanceCheckpoint(Base):
+    """
+    BalanceCheckpoint model - the balance of an account at a point in time.
+
+    Written when an account is opened and then every N ledger entries or every day,
+    so a historical balance only sums the transactions after the nearest checkpoint.
+
+    Attributes:
+        checkpointId: Primary key - Unique UUID identifier
+        accountId: Foreign key to the account
+        asOf: Balance includes every transaction of the account dated at or before this
+        balance: Account balance at `asOf`
+        createdAt: Timestamp when the checkpoint was written
+        account: Relationship to Account model
+    """
+
+    __tablename__ = "balance_checkpoints"
+
+    checkpointId = Column(UUIDKey, primary_key=True, default=shard_key)
+    accountId = Column(
+        UUIDKey,
+        ForeignKey("accounts.accountId", ondelete="CASCADE"),
+        nullable=False,
+    )
+    asOf = Column(DateTime, nullable=False)
+    balance = Column(Money, nullable=False)
+    createdAt = Column(
+        DateTime, default=lambda: datetime.now(timezone.utc), nullable=False
+    )
+
+    account = relationship("Account", back_populates="checkpoints")
+
+    __table_args__ = (
+        Index("ix_balance_checkpoints_account_asof", accountId, asOf.desc()),
+    )
+
+
+class ArchivedMonth(Base):
+    """
+    ArchivedMonth model - one calendar month of an account's transactions, moved to the archive.
+
+    The rows themselves are in the month's segment file, see `utils/archive.py`; this is
+    the catalog reads consult before opening one, with the month's totals.
+
+    Attributes:
+        accountId: Primary key, with month - the account
+        month: Calendar month ("2024-05", UTC) of the archived transactions
+        rows: Number of archived transactions
+        credits: Sum of the archived credits
+        debits: Sum of the archived debits (positive)
+        firstDate: Date of the oldest archived transaction
+        lastDate: Date of the newest archived transaction
+        archivedAt: Timestamp when the month was archived
+    """
+
+    __tablename__ = "archived_months"
+
+    accountId = Column(
+        UUIDKey, ForeignKey("accounts.accountId", ondelete="CASCADE"), primary_key=True
+    )
+    month = Column(String(7), primary_key=True)
+    rows = Column(Integer, nullable=False)
+    credits = Column(Money, nullable=False)
+    debits = Column(Money, nullable=False)
+    firstDate = Column(DateTime, nullable=False)
+    lastDate = Column(DateTime, nullable=False)
+    archivedAt = Column(
+        DateTime, default=lambda: datetime.now(timezone.utc), nullable=False
+    )
+
+
+class BalanceSlot(Base):
+    """
+    BalanceSlot model - one share of the balance and counters of a split account.
+
+    The balance of an account split into N slots is its own balance plus the balances of
+    its N slots, and the same holds for its summary counters. See `utils/balance_slots.py`.
+
+    Attributes:
+        accountId: Primary key, with slot - the split account
+        slot: Slot number, 0 to N - 1
+        balance: Share of the balance, never below zero
+        totalTransactions: Ledger entries posted to this slot
+        totalCredits: Sum of the credits posted to this slot
+        totalDebits: Sum of the debits posted to this slot (positive)
+        monthKey: Calendar month ("2024-05", UTC) that monthTransactions counts
+        monthTransactions: Ledger entries posted to this slot in monthKey
+    """
+
+    __tablename__ = "balance_slots"
+
+    accountId = Column(
+        UUIDKey, ForeignKey("accounts.accountId", ondelete="CASCADE"), primary_key=True
+    )
+    slot = Column(Integer, primary_key=True)
+    balance = Column(Money, nullable=False)
+    totalTransactions = Column(Integer, nullable=False, default=0)
+    totalCredits = Column(Money, nullable=False, default=0)
+    totalDebits = Column(Money, nullable=False, default=0)
+    monthKey = Column(String(7), nullable=True)
+    monthTransactions = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """
+    IdempotencyKey model - the outcome of a request sent with an `Idempotency-Key` header.
+
+    Written in the same database transaction as the transfer it records, so a key exists
+    exactly when its transfer was committed.
+
+    Attributes:
+        key: Primary key - the client supplied Idempotency-Key, scoped to the source account (`idempotency.scoped_key`)
+        fingerprint: SHA-256 of the request body, to detect a key reused for another request
+        response: The response returned to the original request (JSON)
+        createdAt: Timestamp when the key was stored
+        expiresAt: After this the key is ignored and may be purged
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    response = Column(Text, nullable=False)
+    createdAt = Column(
+        DateTime, default=lambda: datetime.now(timezone.utc), nullable=False
+    )
+    expiresAt = Column(DateTime, nullable=False, index=True)
+
+
+class StorageSetting(Base):
+    """
+    StorageSetting model - how this database stores data whose layout is configurable.
+
+    Attributes:
+        name: Primary key - setting name ("money_storage", "id_storage")
+        value: Setting value the stored data was written with
+    """
+
+    __tablename__ = "storage_settings"
+
+    name = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+
+class ShardTransfer(Base):
+    """
+    ShardTransfer model - the intent of a transfer between accounts on two shards.
+
+    Written on the source shard in the transaction that debits the source account, so the
+    debit exists exactly when the intent does. It holds everything needed to apply the
+    credit on the destination shard, which is then only ever rolled forward. See
+    `utils/sharding.py`.
+
+    Attributes:
+        transferId: Primary key - transferId of both ledger entries
+        fromAccountId: Source account, on this shard
+        toAccountId: Destination account
+        toShard: Shard of the destination account
+        amount: Amount credited to the destination account
+        currency: Currency of the destination account
+        name: Name of the credit ledger entry
+        creditTransactionId: transactionId the credit is written with, so it is written once
+        status: "prepared" until the credit has committed, then "completed"
+        createdAt: Timestamp when the source account was debited
+        completedAt: Timestamp when the transfer was marked completed
+    """
+
+    __tablename__ = "shard_transfers"
+
+    transferId = Column(UUIDKey, primary_key=True)
+    fromAccountId = Column(UUIDKey, nullable=False)
+    toAccountId = Column(UUIDKey, nullable=False)
+    toShard = Column(Integer, nullable=False)
+    amount = Column(Money, nullable=False)
+    currency = Column(String, nullable=False)
+    name = Column(String, nullable=False)
+    creditTransactionId = Column(UUIDKey, nullable=False)
+    status = Column(String, nullable=False, index=True)
+    createdAt = Column(DateTime, nullable=False)
+    completedAt = Column(DateTime, nullable=True)
+
+
+class FxRate(Base):
+    """
+    FxRate model - an exchange rate, in effect from its date until the pair's next one.
+
+    Kept on the main database only. Every write takes the next version, so the cached
+    rates of every worker can tell they are stale from max(version) alone, see `utils/fx.py`.
+
+    Attributes:
+        baseCurrency: Primary key, with quoteCurrency and effectiveFrom - currency converted from
+        quoteCurrency: Currency converted to
+        effectiveFrom: Timestamp the rate applies from
+        rate: Units of quoteCurrency per unit of baseCurrency
+        version: Unique, increasing with every write
+        createdAt: Timestamp when the rate was last written
+    """
+
+    __tablename__ = "fx_rates"
+
+    baseCurrency = Column(String(3), primary_key=True)
+    quoteCurrency = Column(String(3), primary_key=True)
+    effectiveFrom = Column(DateTime, primary_key=True)
+    rate = Column(Numeric(24, RATE_SCALE), nullable=False)
+    version = Column(Integer, nullable=False, unique=True)
+    createdAt = Column(
+        DateTime, default=lambda: datetime.now(timezone.utc), nullable=False
+    )
@@ -0,0 +1,89 @@
+"""
+Money amounts - currency metadata and the conversion to and from stored minor units.
+
+Amounts are `Decimal` everywhere in Python. How they are stored is chosen by
+`settings.money_storage`:
+
+- "numeric": NUMERIC(18, 2) columns. SQLite has no decimal type and keeps them as floats.
+- "minor_units": BIGINT counts of 1/100s, exact on every backend and cheap to sum.
+
+Every money column uses the same scale, whatever the currency of the row, so SQL
+arithmetic across columns (balance + amount, SUM(amount)) needs no conversion.
+A currency's own exponent is enforced at the API boundary instead; currencies with
+more decimal places than the storage scale cannot be held and are rejected.
+
+Amounts are limited to the digits their storage holds exactly: 18 in NUMERIC(18, 2) and
+BIGINT minor units, but only 15 when SQLite keeps numeric columns as doubles, where
+1234567890123456.78 would silently come back as 1234567890123456.75.
+"""
+
+from decimal import Decimal
+from typing import Union
+
+from .config import settings
+
+# Decimal places stored for every amount
+MONEY_SCALE = 2
+MINOR_UNIT = Decimal(1).scaleb(-MONEY_SCALE)
+MINOR_UNITS_PER_UNIT = 10**MONEY_SCALE
+# Significant digits of an amount, and the amounts below MAX_AMOUNT that have them
+MAX_DIGITS = (
+    15
+    if settings.money_storage == "numeric"
+    and any(url.startswith("sqlite") for url in (settings.database_url, *settings.shard_urls))
+    else 16 + MONEY_SCALE
+)
+MAX_AMOUNT = Decimal(10) ** (MAX_DIGITS - MONEY_SCALE)
+# Decimal places stored for exchange rates, see `utils/fx.py`
+RATE_SCALE = 12
+
+# Decimal places of each currency's minor unit (ISO 4217); unlisted currencies have 2
+CURRENCY_EXPONENTS = {
+    "BIF": 0,
+    "CLP": 0,
+    "DJF": 0,
+    "GNF": 0,
+    "ISK": 0,
+    "JPY": 0,
+    "KMF": 0,
+    "KRW": 0,
+    "PYG": 0,
+    "RWF": 0,
+    "UGX": 0,
+    "VND": 0,
+    "VUV": 0,
+    "XAF": 0,
+    "XOF": 0,
+    "XPF": 0,
+    "BHD": 3,
+    "IQD": 3,
+    "JOD": 3,
+    "KWD": 3,
+    "LYD": 3,
+    "OMR": 3,
+    "TND": 3,
+}
+
+
+def currency_exponent(currency: str) -> int:
+    return CURRENCY_EXPONENTS.get(currency, 2)
+
+
+def decimal_places(amount: Decimal) -> int:
+    """Places after the point that are not trailing zeros: 10.00 has none, 10.50 one."""
+    if amount == 0:
+        return 0
+    return max(-amount.normalize().as_tuple().exponent, 0)
+
+
+def to_minor_units(amount: Union[Decimal, int]) -> int:
+    """Stored integer for `amount`; refuses amounts finer than the storage scale."""
+    scaled = amount * MINOR_UNITS_PER_UNIT
+    minorUnits = int(scaled)
+    if minorUnits != scaled:
+        raise ValueError(f"{amount} has more than {MONEY_SCALE} decimal places")
+    return minorUnits
+
+
+def from_minor_units(minorUnits: int) -> Decimal:
+    return Decimal(minorUnits) * MINOR_UNIT  # exact, a BIGINT fits the decimal context
@@ -0,0 +1,30 @@
+"""
+Opaque cursors for keyset pagination.
+
+A cursor encodes the sort key of the last row of a page; the next page starts strictly
+after it, so its cost does not depend on how deep into the history it is.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+from fastapi import HTTPException, status
+
+
+def encode_cursor(date: datetime, transactionId: str) -> str:
+    payload = json.dumps([date.isoformat(), transactionId], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date, transactionId = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(date), str(transactionId)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor",
+        )
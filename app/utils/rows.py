@@ -0,0 +1,50 @@
+"""
+Lean read path - list endpoints that select plain rows and encode them straight to JSON.
+
+Loading ORM objects, validating them into the `response_model` and encoding the result
+costs more than the query itself on large pages. These endpoints instead select only the
+columns of their response schema, as Core rows, and return a `RowsResponse`: FastAPI
+skips response_model validation for a returned Response, and the rows are encoded with
+orjson when it is installed. The output is the same JSON the response_model produces
+(amounts as strings, ISO 8601 datetimes), and the response_model still documents the
+endpoint.
+"""
+
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library json is used without it
+    orjson = None
+
+
+def schema_columns(schema, model) -> tuple:
+    """Columns of `model` named like the fields of `schema`, in field order."""
+    return tuple(getattr(model, name) for name in schema.model_fields)
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat().replace("+00:00", "Z")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class RowsResponse(Response):
+    """JSON response of a list of rows; takes the result rows of a schema_columns select."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps([row._asdict() for row in content])
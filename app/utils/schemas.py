@@ -1,8 +1,10 @@
-from pydantic import BaseModel, EmailStr, Field, field_validator, ConfigDict
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator, ConfigDict
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Dict, List, Optional
 from decimal import Decimal
 
+from .money import MAX_AMOUNT, MAX_DIGITS, MONEY_SCALE, RATE_SCALE, currency_exponent, decimal_places
+
 
 #  Customer Schemas
 
@@ -59,7 +61,23 @@ class AccountBase(BaseModel):
 
 class AccountCreate(AccountBase):
     customerId: str = Field(...)
-    balance: Decimal = Field(..., gt=0)
+    balance: Decimal = Field(..., gt=0, lt=MAX_AMOUNT, max_digits=MAX_DIGITS)
+
+    # New accounts only; accounts opened earlier in such a currency still read back
+    @field_validator("currency")
+    @classmethod
+    def validate_currency_exponent(cls, v: str) -> str:
+        if currency_exponent(v) > MONEY_SCALE:
+            raise ValueError(f"Currencies with more than {MONEY_SCALE} decimal places are not supported")
+        return v
+
+    @model_validator(mode="after")
+    def validate_balance_places(self) -> "AccountCreate":
+        if decimal_places(self.balance) > currency_exponent(self.currency):
+            raise ValueError(
+                f"Balance must have at most {currency_exponent(self.currency)} decimal places for {self.currency}"
+            )
+        return self
 
 
 class Account(AccountBase):
@@ -78,6 +96,14 @@ class AccountWithTransactions(Account):
     model_config = ConfigDict(from_attributes=True)
 
 
+class CustomerWithAccountTransactions(Customer):
+    """Customer with its accounts and their most recent transactions (`expand=accounts.transactions`)."""
+
+    accounts: List[AccountWithTransactions] = []
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 # Transaction
 
 
@@ -120,14 +146,15 @@ class TransferCreate(BaseModel):
 
     fromAccountId: str = Field(...)
     toAccountId: str = Field(...)
-    amount: Decimal = Field(..., gt=0)
+    amount: Decimal = Field(..., gt=0, lt=MAX_AMOUNT, max_digits=MAX_DIGITS)
     description: Optional[str] = Field(None, max_length=200)
 
     @field_validator("amount")
     @classmethod
     def validate_amount(cls, v: Decimal) -> Decimal:
-        if v.as_tuple().exponent < -2:
-            raise ValueError("Amount must have at most 2 decimal places")
+        # The source account's currency may allow fewer, checked by the ledger
+        if decimal_places(v) > MONEY_SCALE:
+            raise ValueError(f"Amount must have at most {MONEY_SCALE} decimal places")
         return v
 
 
@@ -138,10 +165,36 @@ class TransferResponse(BaseModel):
     fromAccountId: str
     toAccountId: str
     amount: Decimal
+    creditedAmount: Optional[Decimal] = None  # in the destination currency
+    exchangeRate: Optional[Decimal] = None  # when the accounts' currencies differ
     status: str = Field(...)
     message: str = Field(...)
 
 
+class BatchTransferCreate(BaseModel):
+    """Many transfers applied in a single database transaction, in the order given."""
+
+    transfers: List[TransferCreate] = Field(..., min_length=1, max_length=5000)
+
+
+class BatchTransferResult(BaseModel):
+    index: int  # position of the transfer in the submitted batch
+    status: str = Field(...)  # "success" or "failed"
+    transferId: Optional[str] = Field(None)
+    fromTransactionId: Optional[str] = Field(None)
+    toTransactionId: Optional[str] = Field(None)
+    creditedAmount: Optional[Decimal] = Field(None)
+    exchangeRate: Optional[Decimal] = Field(None)
+    message: str = Field(...)
+
+
+class BatchTransferResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BatchTransferResult]
+
+
 # Summary
 
 
@@ -159,6 +212,9 @@ class CustomerSummary(BaseModel):
     fullName: str
     totalAccounts: int
     totalBalance: Decimal
+    currency: str  # of totalBalance
+    balances: Dict[str, Decimal] = {}  # currency -> unconverted total of the accounts in it
+    unconvertedCurrencies: List[str] = []  # without an exchange rate, left out of totalBalance
     recentTransactions: int
 
 
@@ -171,8 +227,42 @@ class AccountBalance(BaseModel):
     balance: Decimal
     currency: str
     lastUpdated: datetime
+    asOf: Optional[datetime] = None  # set when the balance is a point-in-time balance
 
 
 # Enable forward references for nested models
 CustomerWithAccounts.model_rebuild()
 AccountWithTransactions.model_rebuild()
+CustomerWithAccountTransactions.model_rebuild()
+
+
+# Exchange rates
+
+
+class FxRateCreate(BaseModel):
+    """Rate from `effectiveFrom` on; a rate with the same pair and date is replaced."""
+
+    baseCurrency: str = Field(..., min_length=3, max_length=3)
+    quoteCurrency: str = Field(..., min_length=3, max_length=3)
+    rate: Decimal = Field(..., gt=0, max_digits=24, decimal_places=RATE_SCALE)
+    effectiveFrom: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @field_validator("baseCurrency", "quoteCurrency")
+    @classmethod
+    def validate_currency(cls, v: str) -> str:
+        if not v.isupper() or not v.isalpha():
+            raise ValueError("Currency must be a 3-letter uppercase code (USD, EUR)")
+        return v
+
+    @model_validator(mode="after")
+    def validate_pair(self) -> "FxRateCreate":
+        if self.baseCurrency == self.quoteCurrency:
+            raise ValueError("Base and quote currency must differ")
+        return self
+
+
+class FxRate(FxRateCreate):
+    version: int
+    createdAt: datetime
+
+    model_config = ConfigDict(from_attributes=True)
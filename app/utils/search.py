@@ -0,0 +1,272 @@
+"""
+Full-text search - transaction descriptions, and customer names and emails.
+
+A query is split into words and every word matches as a prefix ("trans ali" finds
+"Transfer to Alice"); all words must match. Results are listed newest first, or by
+relevance: of the newest RANK_WINDOW matches, the shortest texts first, newest first among
+equals. Every match holds every word, so that is close to the order of bm25 or ts_rank,
+without their cost: bm25 counts every match of each word, millions for a common one, and
+ts_rank parses every matching document again.
+
+SQLite: contentless FTS5 tables, keyed by the rowid of the searched table, so the index
+holds the tokens only. Triggers keep them in step with every INSERT, UPDATE and DELETE,
+in the writing transaction. `transactions_fts` also indexes the accountId as one token, so
+a search scoped to an account intersects two posting lists instead of filtering every
+match. Prefixes of 2 to 8 characters have posting lists of their own: FTS5 reads those as
+they are, newest first, and stops at the LIMIT, where a longer prefix merges the lists of
+every word it matches first. Positions are not kept (detail=column), no query needs them.
+The tables are filled from the existing rows when they are first created.
+VACUUM renumbers the rowids of tables without an INTEGER PRIMARY KEY: drop the *_fts
+tables and their triggers before one, and the next start rebuilds them.
+
+PostgreSQL: GIN indexes on to_tsvector('simple', ...) of the same columns, kept up to date
+by PostgreSQL itself, and queried with the same expressions and prefix tsqueries.
+
+Other databases, and SQLite builds without FTS5, fall back to LIKE, which scans.
+
+Transactions moved to the archive (`utils/archive.py`) leave the index with them.
+"""
+
+import logging
+import re
+from collections import namedtuple
+from itertools import chain
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, column, func, inspect, literal_column, or_, select, table
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .models import Customer, Transaction
+
+log = logging.getLogger("app.search")
+
+MAX_TERMS = 8
+MAX_RESULTS = 100
+# Relevance orders the newest matches only, as many as this, so a word found in millions
+# of rows costs no more than a rare one
+RANK_WINDOW = 1000
+
+WORD = re.compile(r"\w+")
+HEX = re.compile(r"[0-9a-f]{32}")
+
+transactionsFts = table("transactions_fts", column("rowid"))
+customersFts = table("customers_fts", column("rowid"))
+
+# A key column as one lowercase hex token, whichever way keys are stored (`utils/ids.py`)
+KEY_TOKEN = "CASE WHEN typeof({0}) = 'blob' THEN lower(hex({0})) ELSE lower(replace({0}, '-', '')) END"
+
+SQLITE_DDL = {
+    "transactions_fts": (
+        "CREATE VIRTUAL TABLE transactions_fts USING fts5("
+        "name, account, content='', detail=column, prefix='2 3 4 5 6 7 8', tokenize='unicode61 remove_diacritics 2')",
+        f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN
+            INSERT INTO transactions_fts (rowid, name, account)
+            VALUES (new.rowid, new.name, {KEY_TOKEN.format("new.accountId")});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, name, account)
+            VALUES ('delete', old.rowid, old.name, {KEY_TOKEN.format("old.accountId")});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF name, accountId ON transactions BEGIN
+            INSERT INTO transactions_fts (transactions_fts, rowid, name, account)
+            VALUES ('delete', old.rowid, old.name, {KEY_TOKEN.format("old.accountId")});
+            INSERT INTO transactions_fts (rowid, name, account)
+            VALUES (new.rowid, new.name, {KEY_TOKEN.format("new.accountId")});
+        END""",
+        f"""INSERT INTO transactions_fts (rowid, name, account)
+            SELECT rowid, name, {KEY_TOKEN.format("accountId")} FROM transactions""",
+    ),
+    "customers_fts": (
+        "CREATE VIRTUAL TABLE customers_fts USING fts5("
+        "name, email, content='', detail=column, prefix='2 3 4 5 6 7 8', tokenize='unicode61 remove_diacritics 2')",
+        """CREATE TRIGGER IF NOT EXISTS customers_fts_insert AFTER INSERT ON customers BEGIN
+            INSERT INTO customers_fts (rowid, name, email)
+            VALUES (new.rowid, new.firstName || ' ' || new.lastName, new.email);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS customers_fts_delete AFTER DELETE ON customers BEGIN
+            INSERT INTO customers_fts (customers_fts, rowid, name, email)
+            VALUES ('delete', old.rowid, old.firstName || ' ' || old.lastName, old.email);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS customers_fts_update AFTER UPDATE OF firstName, lastName, email ON customers BEGIN
+            INSERT INTO customers_fts (customers_fts, rowid, name, email)
+            VALUES ('delete', old.rowid, old.firstName || ' ' || old.lastName, old.email);
+            INSERT INTO customers_fts (rowid, name, email)
+            VALUES (new.rowid, new.firstName || ' ' || new.lastName, new.email);
+        END""",
+        """INSERT INTO customers_fts (rowid, name, email)
+            SELECT rowid, firstName || ' ' || lastName, email FROM customers""",
+    ),
+}
+
+# The documents PostgreSQL indexes; queries must use the very same expressions. Constants
+# are literal SQL, bound parameters would not match the index expression
+SIMPLE = literal_column("'simple'")
+transactionDocument = func.to_tsvector(SIMPLE, Transaction.name)
+customerDocument = func.to_tsvector(
+    SIMPLE,
+    Customer.firstName.op("||")(literal_column("' '"))
+    .op("||")(Customer.lastName)
+    .op("||")(literal_column("' '"))
+    .op("||")(Customer.email),
+)
+
+POSTGRESQL_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_transactions_search ON transactions "
+    "USING gin (to_tsvector('simple', name))",
+    "CREATE INDEX IF NOT EXISTS ix_customers_search ON customers "
+    """USING gin (to_tsvector('simple', "firstName" || ' ' || "lastName" || ' ' || email))""",
+)
+
+# Engines whose database has the FTS5 tables, by URL
+_ftsAvailable = {}
+
+
+def create_search_indexes(bind) -> None:
+    """Create the search tables, triggers or indexes the database is missing."""
+    dialect = bind.dialect.name
+    if dialect == "postgresql":
+        with bind.begin() as connection:
+            for statement in POSTGRESQL_DDL:
+                connection.exec_driver_sql(statement)
+    elif dialect == "sqlite":
+        try:
+            with bind.begin() as connection:
+                existing = set(inspect(connection).get_table_names())
+                for name, statements in SQLITE_DDL.items():
+                    if name not in existing:
+                        for statement in statements:
+                            connection.exec_driver_sql(statement)
+            _ftsAvailable[str(bind.url)] = True
+        except OperationalError as e:
+            if "fts5" not in str(e.orig):
+                raise
+            log.warning("SQLite has no FTS5, search falls back to LIKE scans")
+            _ftsAvailable[str(bind.url)] = False
+
+
+def _has_fts(db: Session) -> bool:
+    bind = db.get_bind()
+    if bind.dialect.name != "sqlite":
+        return False
+    key = str(bind.url)
+    if key not in _ftsAvailable:
+        _ftsAvailable[key] = inspect(bind).has_table("transactions_fts")
+    return _ftsAvailable[key]
+
+
+def search_terms(query: str) -> List[str]:
+    """The words of a search query, lowercased; 400 when it has none."""
+    terms = WORD.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Search query must contain at least one letter or digit",
+        )
+    return terms
+
+
+def account_token(accountId: str) -> str:
+    """The token `transactions_fts` indexes for an accountId; 400 when it is not a key."""
+    token = accountId.replace("-", "").lower()
+    if not HEX.fullmatch(token):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid account ID {accountId}",
+        )
+    return token
+
+
+def _fts_match(terms: List[str], column: Optional[str] = None) -> str:
+    prefix = f"{column} : " if column else ""
+    return " AND ".join(f'{prefix}"{term}"*' for term in terms)
+
+
+def _tsquery(terms: List[str]) -> str:
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def _like(columns, terms: List[str]):
+    return and_(*(or_(*(column.ilike(f"%{term}%") for column in columns)) for term in terms))
+
+
+def _fts_recent(ftsTable, match: str, window: int):
+    """The rowids of the newest `window` matches, newest first; FTS5 stops reading there."""
+    return (
+        select(ftsTable.c.rowid)
+        .where(literal_column(ftsTable.name).op("MATCH")(match))
+        .order_by(ftsTable.c.rowid.desc())
+        .limit(window)
+        .subquery()
+    )
+
+
+def search_transactions(db: Session, columns, terms: List[str], accountId: Optional[str], newest: bool, limit: int) -> list:
+    """
+    Transactions whose name matches every term, best or newest first, as rows of `columns`
+    and their `rank`.
+    """
+    window = limit if newest else RANK_WINDOW
+
+    if _has_fts(db):
+        match = _fts_match(terms, "name")
+        if accountId:
+            match = f'account : "{account_token(accountId)}" AND {match}'
+        recent = _fts_recent(transactionsFts, match, window)
+        onRecent = recent.c.rowid == literal_column("transactions.rowid")
+        newestFirst = (recent.c.rowid.desc(),)
+    else:
+        if db.get_bind().dialect.name == "postgresql":
+            condition = transactionDocument.op("@@")(func.to_tsquery(SIMPLE, _tsquery(terms)))
+        else:
+            condition = _like([Transaction.name], terms)
+        query = select(Transaction.transactionId).where(condition)
+        if accountId:
+            query = query.where(Transaction.accountId == accountId)
+        newestFirst = (Transaction.date.desc(), Transaction.transactionId.desc())
+        recent = query.order_by(*newestFirst).limit(window).subquery()
+        onRecent = recent.c.transactionId == Transaction.transactionId
+
+    rank = func.length(Transaction.name)
+    query = select(*columns, rank.label("rank")).join_from(recent, Transaction, onRecent)
+    order = newestFirst if newest else (rank, *newestFirst)
+    return db.execute(query.order_by(*order).limit(limit)).all()
+
+
+def search_customers(db: Session, columns, terms: List[str], limit: int) -> list:
+    """Customers whose name or email matches every term, best first, as rows of `columns` and their `rank`."""
+    if _has_fts(db):
+        recent = _fts_recent(customersFts, _fts_match(terms), RANK_WINDOW)
+        onRecent = recent.c.rowid == literal_column("customers.rowid")
+        newestFirst = (recent.c.rowid.desc(),)
+    else:
+        if db.get_bind().dialect.name == "postgresql":
+            condition = customerDocument.op("@@")(func.to_tsquery(SIMPLE, _tsquery(terms)))
+        else:
+            condition = _like([Customer.firstName, Customer.lastName, Customer.email], terms)
+        newestFirst = (Customer.createdAt.desc(), Customer.customerId.desc())
+        recent = (
+            select(Customer.customerId)
+            .where(condition)
+            .order_by(*newestFirst)
+            .limit(RANK_WINDOW)
+            .subquery()
+        )
+        onRecent = recent.c.customerId == Customer.customerId
+
+    rank = func.length(Customer.firstName) + func.length(Customer.lastName) + func.length(Customer.email)
+    query = select(*columns, rank.label("rank")).join_from(recent, Customer, onRecent)
+    return db.execute(query.order_by(rank, *newestFirst).limit(limit)).all()
+
+
+def merge(results: List[list], key, limit: int, reverse: bool = False) -> list:
+    """
+    The first `limit` rows by `key` of the results of several shards, without their rank;
+    rows keep `_asdict` for `RowsResponse`.
+    """
+    rows = sorted(chain.from_iterable(results), key=key, reverse=reverse)[:limit]
+    if not rows:
+        return rows
+    Result = namedtuple("Result", [name for name in rows[0]._fields if name != "rank"])
+    return [Result(*row[:-1]) for row in rows]
@@ -0,0 +1,352 @@
+"""
+Horizontal sharding - customers, with their accounts and ledger, spread over several databases.
+
+The main database (`settings.database_url`) is shard 0 and `settings.shard_urls` add shards
+1..N, each with the full schema. A new customer is placed by a hash of its email, and its
+accounts, their transactions and checkpoints live on the customer's shard, so every
+single-customer read and every transfer between accounts on one shard stays a transaction
+on one database.
+
+Keys carry their shard: rows of shard 1 and above get UUIDv8 keys with the shard number
+in them, and any other key, including every key from before sharding, is on shard 0 (see
+`utils/ids.py`). A route finds the database of a customerId, accountId or transactionId
+from the key alone, without a directory lookup.
+
+A transfer between accounts on two shards cannot commit in one transaction. It commits in
+two phases through a durable intent, see `apply_cross_shard_transfer`.
+
+With no shard_urls there is one shard and every helper here reduces to the main database.
+"""
+
+import logging
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Generator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import balance_slots, idempotency, ids, ledger, schemas
+from .cache import mark_accounts_changed
+from .database import ShardSessionLocal, ShardWriteSessionLocal, session_shard
+from .metrics import extend_query_budget
+from .models import Account, ShardTransfer, Transaction, generate_uuid
+
+log = logging.getLogger("app.sharding")
+
+SHARD_COUNT = len(ShardSessionLocal)
+
+accounts = Account.__table__
+transactions = Transaction.__table__
+shardTransfers = ShardTransfer.__table__
+
+
+def shard_of(key: str) -> int:
+    """Shard holding the row of a key; keys of unknown shards are looked up, and not found, on shard 0."""
+    shard = ids.shard_of(key)
+    return shard if shard < SHARD_COUNT else 0
+
+
+def shard_for_email(email: str) -> int:
+    """Shard a new customer is placed on."""
+    return zlib.crc32(email.encode()) % SHARD_COUNT
+
+
+class Shards:
+    """Sessions of one request, one per shard, opened on first use and closed with the request."""
+
+    def __init__(self, sessionFactories: list) -> None:
+        self.sessionFactories = sessionFactories
+        self.sessions = {}
+
+    def session(self, shard: int) -> Session:
+        db = self.sessions.get(shard)
+        if db is None:
+            db = self.sessions[shard] = self.sessionFactories[shard]()
+        return db
+
+    def for_key(self, key: str) -> Session:
+        return self.session(shard_of(key))
+
+    def all(self) -> List[Session]:
+        return [self.session(shard) for shard in range(SHARD_COUNT)]
+
+    def close(self) -> None:
+        for db in self.sessions.values():
+            db.close()
+
+
+def get_shards() -> Generator[Shards, None, None]:
+    shards = Shards(ShardSessionLocal)
+    try:
+        yield shards
+    finally:
+        shards.close()
+
+
+def get_write_shards() -> Generator[Shards, None, None]:
+    shards = Shards(ShardWriteSessionLocal)
+    try:
+        yield shards
+    finally:
+        shards.close()
+
+
+def shard_db(keyParam: str) -> Callable:
+    """Route dependency: a session on the shard of the key in path parameter `keyParam`."""
+
+    def get_shard_db(request: Request) -> Generator[Session, None, None]:
+        db = ShardSessionLocal[shard_of(request.path_params[keyParam])]()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    return get_shard_db
+
+
+def exists_on_any_shard(db: Session, statement) -> bool:
+    """
+    Whether `statement` returns a row on the shard of `db` or on any other. The other shards
+    are read with sessions of their own, so a write session keeps the only write lock, on
+    its own shard. Rows placed before shards were added can be on any shard.
+    """
+    if db.execute(statement).first() is not None:
+        return True
+    home = session_shard(db)
+    extend_query_budget(2 * (SHARD_COUNT - 1))  # BEGIN and the statement, per other shard
+    for shard in range(SHARD_COUNT):
+        if shard != home:
+            with ShardSessionLocal[shard]() as other:
+                if other.execute(statement).first() is not None:
+                    return True
+    return False
+
+
+def page_across(shards: Shards, build: Callable, skip: int, limit: int) -> list:
+    """
+    One page of the rows of `build(db)` over all shards, in shard order. A shard whose rows
+    are all skipped costs one more COUNT; on a single shard this is the plain query.
+    """
+    rows = []
+    for shard, db in enumerate(shards.all()):
+        if len(rows) >= limit:
+            break
+        if shard:
+            extend_query_budget(2)
+        query = build(db)
+        found = query.offset(skip).limit(limit - len(rows)).all()
+        if found:
+            skip = 0
+        elif skip:
+            extend_query_budget(1)
+            skip = max(skip - query.count(), 0)
+        rows.extend(found)
+    return rows
+
+
+def apply_cross_shard_transfer(
+    shards: Shards,
+    transfer: schemas.TransferCreate,
+    idempotencyKey: Optional[str],
+    fingerprint: str,
+) -> Tuple[schemas.TransferResponse, bool]:
+    """
+    Apply a transfer between accounts on two shards and commit it, in two phases:
+
+    1. Prepare, on the source shard: the guarded debit, its ledger entry and a ShardTransfer
+       intent holding everything the credit needs (and the Idempotency-Key), in one
+       transaction. Until it commits nothing has changed.
+    2. Commit, on the destination shard: the credit and its ledger entry, then the intent
+       is marked completed. The credit's transactionId is fixed by the intent, so writing
+       it a second time fails on the primary key instead of crediting twice.
+
+    Once phase 1 has committed the transfer is only ever rolled forward: if phase 2 fails
+    or the process stops, `recover_transfers` completes it, and the response says
+    "pending". Returns the response and whether it was replayed for the Idempotency-Key.
+    """
+    if transfer.fromAccountId == transfer.toAccountId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot transfer to the same account",
+        )
+
+    fromDb = shards.for_key(transfer.fromAccountId)
+    toDb = shards.for_key(transfer.toAccountId)
+
+    if idempotencyKey:  # keys are kept on the source shard
+        replayed = idempotency.replay(fromDb, idempotencyKey, fingerprint, schemas.TransferResponse)
+        if replayed:
+            return replayed, True
+
+    # The credit must not be able to fail once the debit has committed
+    toAccount = toDb.execute(
+        select(accounts.c.name, accounts.c.currency).where(accounts.c.accountId == transfer.toAccountId)
+    ).first()
+    toDb.rollback()
+    if not toAccount:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Destination account {transfer.toAccountId} not found",
+        )
+
+    month = ledger.current_month(datetime.now(timezone.utc))
+    fromAccount = ledger.post_debit(fromDb, transfer.fromAccountId, transfer.amount, month)
+    if not fromAccount:
+        balance = fromDb.scalar(
+            select(balance_slots.total(accounts.c.balance)).where(
+                accounts.c.accountId == transfer.fromAccountId
+            )
+        )
+        if balance is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Source account {transfer.fromAccountId} not found",
+            )
+        raise ledger.insufficient_funds(transfer, balance)
+
+    now = datetime.now(timezone.utc)
+    creditAmount, rate = ledger.credit_amount(
+        fromDb, transfer, fromAccount.currency, toAccount.currency, now
+    )
+
+    mark_accounts_changed(fromDb, transfer.fromAccountId)
+
+    fromShard, toShard = shard_of(transfer.fromAccountId), shard_of(transfer.toAccountId)
+    intent = {
+        "transferId": generate_uuid(fromShard),
+        "fromAccountId": transfer.fromAccountId,
+        "toAccountId": transfer.toAccountId,
+        "toShard": toShard,
+        "amount": creditAmount,
+        "currency": toAccount.currency,
+        "name": transfer.description or f"Transfer from {fromAccount.name}",
+        "creditTransactionId": generate_uuid(toShard),
+        "status": "prepared",
+        "createdAt": now,
+    }
+    debitTransactionId = generate_uuid(fromShard)
+    fromDb.execute(
+        insert(transactions).values(
+            transactionId=debitTransactionId,
+            accountId=transfer.fromAccountId,
+            amount=-transfer.amount,  # Negative for debit
+            name=transfer.description or f"Transfer to {toAccount.name}",
+            transferId=intent["transferId"],
+            currency=fromAccount.currency,
+            date=now,
+            createdAt=now,
+        )
+    )
+    ledger.write_due_checkpoints(fromDb, [(transfer.fromAccountId, fromAccount)], now)
+    fromDb.execute(insert(shardTransfers).values(**intent))
+
+    response = schemas.TransferResponse(
+        transferId=intent["transferId"],
+        fromTransactionId=debitTransactionId,
+        toTransactionId=intent["creditTransactionId"],
+        fromAccountId=transfer.fromAccountId,
+        toAccountId=transfer.toAccountId,
+        amount=transfer.amount,
+        creditedAmount=creditAmount,
+        exchangeRate=rate,
+        status="success",
+        message=ledger.transfer_message(transfer, fromAccount, toAccount, creditAmount),
+    )
+    if idempotencyKey:
+        idempotency.record(fromDb, idempotencyKey, fingerprint, response)
+    fromDb.commit()
+
+    try:
+        complete_transfer(fromDb, toDb, intent)
+    except Exception:
+        fromDb.rollback()
+        toDb.rollback()
+        log.exception("Transfer %s is debited, its credit is left to recovery", intent["transferId"])
+        return response.model_copy(
+            update={
+                "status": "pending",
+                "message": f"Transferred {transfer.amount} from account {fromAccount.name}, "
+                f"the credit to {toAccount.name} is pending",
+            }
+        ), False
+
+    return response, False
+
+
+def complete_transfer(fromDb: Session, toDb: Session, intent) -> bool:
+    """
+    Phase 2 of a cross-shard transfer: credit the destination and mark the intent completed;
+    commits both. Returns False when the credit had already been written.
+    """
+    month = ledger.current_month(datetime.now(timezone.utc))
+    toAccount = ledger.post_credit(toDb, intent["toAccountId"], intent["amount"], month)
+    if not toAccount:
+        raise RuntimeError(f"Destination account {intent['toAccountId']} of transfer {intent['transferId']} is gone")
+
+    # Taken after the row lock is held, like the dates of a single-shard transfer
+    now = datetime.now(timezone.utc)
+    credited = True
+    try:
+        toDb.execute(
+            insert(transactions).values(
+                transactionId=intent["creditTransactionId"],
+                accountId=intent["toAccountId"],
+                amount=intent["amount"],  # Positive for credit
+                name=intent["name"],
+                transferId=intent["transferId"],
+                currency=intent["currency"],
+                date=now,
+                createdAt=now,
+            )
+        )
+        ledger.write_due_checkpoints(toDb, [(intent["toAccountId"], toAccount)], now)
+        mark_accounts_changed(toDb, intent["toAccountId"])
+        toDb.commit()
+    except IntegrityError:
+        toDb.rollback()  # credited by an earlier attempt, the balance change is undone with it
+        credited = False
+
+    fromDb.execute(
+        update(shardTransfers)
+        .where(shardTransfers.c.transferId == intent["transferId"], shardTransfers.c.status == "prepared")
+        .values(status="completed", completedAt=now)
+    )
+    fromDb.commit()
+    return credited
+
+
+def recover_transfers(olderThan: timedelta = timedelta(0)) -> int:
+    """
+    Complete the cross-shard transfers still prepared after `olderThan`, on every shard.
+    Safe to run while transfers are applied. A transfer that cannot be credited, say its
+    destination account is gone, is logged and left prepared. Returns how many credits it wrote.
+    """
+    cutoff = datetime.now(timezone.utc) - olderThan
+    shards = Shards(ShardWriteSessionLocal)
+    recovered = 0
+    try:
+        for fromShard in range(SHARD_COUNT):
+            fromDb = shards.session(fromShard)
+            intents = fromDb.execute(
+                select(shardTransfers).where(
+                    shardTransfers.c.status == "prepared", shardTransfers.c.createdAt <= cutoff
+                )
+            ).mappings().all()
+            fromDb.rollback()
+            for intent in intents:
+                if intent["toShard"] >= SHARD_COUNT:
+                    log.error("Transfer %s credits shard %s, which is not configured", intent["transferId"], intent["toShard"])
+                    continue
+                toDb = shards.session(intent["toShard"])
+                try:
+                    recovered += complete_transfer(fromDb, toDb, intent)
+                except Exception:  # the others are still completed, this one is retried next time
+                    fromDb.rollback()
+                    toDb.rollback()
+                    log.exception("Transfer %s could not be credited, it stays prepared", intent["transferId"])
+    finally:
+        shards.close()
+    return recovered
@@ -0,0 +1,124 @@
+"""
+Admission control under bursts: the same bursts of concurrent transfers with
+MEOW_ADMISSION_MAX_CONCURRENT off and on, reported as the latency of the transfers that
+went through and how many were turned away or timed out at the client.
+
+    python -m benchmarks.admission
+    python -m benchmarks.admission --burst 1000 --max-concurrent 8 --queue-size 64
+
+Requests go through the ASGI app in-process, `--bursts` times `--burst` of them at once,
+every `--interval` seconds. A response slower than `--client-timeout` seconds counts as a
+client timeout: a real client would have given up on it, though it was still applied (the
+requests are not cancelled, a cancelled in-process request leaves its thread running).
+Latencies are of all the applied transfers. Without admission control every request of a
+burst waits for a thread and then for the SQLite write lock, so the whole burst gets
+slow; with it the requests beyond the queue are rejected at once with 503 and the
+admitted ones stay fast.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import warnings
+from collections import Counter
+
+
+async def run_bursts(client, accountIds: list, args) -> tuple:
+    latencies = []
+    outcomes = Counter()
+
+    async def transfer(i: int) -> None:
+        started = time.perf_counter()
+        response = await client.post(
+            "/api/v2/transfers/",
+            json={
+                "fromAccountId": accountIds[i % len(accountIds)],
+                "toAccountId": accountIds[(i + 1) % len(accountIds)],
+                "amount": "0.01",
+            },
+        )
+        elapsed = time.perf_counter() - started
+        if elapsed > args.client_timeout:  # applied, but the client had given up on it
+            outcomes["client timeout"] += 1
+        else:
+            outcomes[response.status_code] += 1
+        if response.status_code == 201:
+            latencies.append(elapsed)
+
+    for burst in range(args.bursts):
+        started = time.perf_counter()
+        await asyncio.gather(*(transfer(burst * args.burst + i) for i in range(args.burst)))
+        await asyncio.sleep(max(0.0, args.interval - (time.perf_counter() - started)))
+    return latencies, outcomes
+
+
+def report(name: str, latencies: list, outcomes: Counter) -> None:
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+    median = statistics.median(latencies) if latencies else 0
+    print(
+        f"{name:<24} in time {outcomes[201]:>6}  median {median * 1000:>8.1f} ms  p99 {p99 * 1000:>8.1f} ms  "
+        f"503 {outcomes[503]:>6}  client timeouts {outcomes['client timeout']:>6}"
+    )
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    from app.main import app
+    from app.utils import admission
+    from app.utils.database import init_db
+
+    warnings.simplefilter("ignore")  # the SQLite Decimal warning, once per statement
+    init_db()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        accountIds = []
+        for i in range(args.accounts):
+            customer = await client.post(
+                "/api/v1/customers/",
+                json={"firstName": "Bench", "lastName": str(i), "email": f"admission{i}@bench.example.com"},
+            )
+            account = await client.post(
+                "/api/v1/accounts/",
+                json={
+                    "customerId": customer.json()["customerId"],
+                    "name": f"bench{i}",
+                    "accountType": "checking",
+                    "balance": "1000000.00",
+                },
+            )
+            accountIds.append(account.json()["accountId"])
+
+        for name, gate in (
+            ("admission control off", None),
+            (
+                "admission control on",
+                admission.ConcurrencyGate(args.max_concurrent, args.queue_size, args.queue_timeout_ms / 1000),
+            ),
+        ):
+            admission.gate = gate
+            report(name, *await run_bursts(client, accountIds, args))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=500, help="concurrent transfers per burst")
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between burst starts")
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--client-timeout", type=float, default=2.0)
+    parser.add_argument("--max-concurrent", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--queue-timeout-ms", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    os.environ["MEOW_DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.setdefault("MEOW_METRICS_ENABLED", "0")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
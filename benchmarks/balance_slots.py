@@ -0,0 +1,73 @@
+"""
+Balance slots benchmark: the hot_transfers scenario of the load-testing suite with the hot
+account in one balance slot and split into --slots slots, reported as the throughput gain
+and the latency change.
+
+    python -m benchmarks.balance_slots
+    python -m benchmarks.balance_slots --slots 16 --concurrency 64 --uvicorn --workers 4
+    python -m benchmarks.balance_slots --database-url postgresql://bench@localhost/bench
+
+Every run is a separate `benchmarks.suite` process. The gain comes from transfers waiting
+on one of N slot row locks instead of on the account's single row lock, so it shows on a
+database with row locks (PostgreSQL). SQLite takes one lock for every write transaction,
+so there a split account only adds statements and the comparison shows their cost.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SCENARIO = "hot_transfers"
+
+
+def run_suite(slots: int, args) -> dict:
+    output = Path(tempfile.mkdtemp()) / "results.json"
+    command = [
+        sys.executable, "-m", "benchmarks.suite",
+        "--scenario", SCENARIO,
+        "--requests", str(args.requests),
+        "--concurrency", str(args.concurrency),
+        "--accounts", str(args.accounts),
+        "--hot-slots", str(slots),
+        "--output", str(output),
+        "--baseline", str(output.with_name("none.json")),
+    ]
+    if args.uvicorn:
+        command += ["--uvicorn", "--workers", str(args.workers)]
+    if args.database_url:  # each run adds its own accounts, the hot one is always new
+        command += ["--database-url", args.database_url]
+
+    print(f"-- {slots} balance slot(s)", flush=True)
+    subprocess.run(command, check=True)
+    return json.loads(output.read_text())["scenarios"][SCENARIO]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slots", type=int, default=8, help="balance slots of the split run")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--database-url", help="default: a throwaway SQLite database per run")
+    parser.add_argument("--uvicorn", action="store_true", help="run against uvicorn instead of in-process")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    before = run_suite(1, args)
+    after = run_suite(args.slots, args)
+
+    gain = after["throughput"] / before["throughput"] if before["throughput"] else 0.0
+    print(f"\n{SCENARIO}, concurrency {args.concurrency}")
+    print(
+        f"1 -> {args.slots} slots  {before['throughput']:>8.1f} -> {after['throughput']:>8.1f} req/s ({gain:.2f}x)  "
+        f"p50 {before['p50Ms']:.2f} -> {after['p50Ms']:.2f} ms  "
+        f"p99 {before['p99Ms']:.2f} -> {after['p99Ms']:.2f} ms  "
+        f"errors {before['errors']} -> {after['errors']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
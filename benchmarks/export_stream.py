@@ -0,0 +1,147 @@
+"""
+Throughput and peak RSS of the statement export against loading the same history
+through the paged list endpoint in one request (ORM objects + Pydantic list).
+
+    python -m benchmarks.export_stream --rows 500000
+
+Each mode runs in its own process against the same throwaway SQLite file, so the
+peak RSS figures do not leak into each other.
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+
+def seed(rows: int) -> str:
+    from sqlalchemy import insert
+
+    from app.utils.database import SessionLocal, init_db
+    from app.utils.models import Account, Customer, Transaction, generate_uuid
+
+    init_db()
+    with SessionLocal() as db:
+        customer = Customer(firstName="Bench", lastName="Mark", email="export@example.com")
+        db.add(customer)
+        db.flush()
+        account = Account(
+            customerId=customer.customerId, name="export", accountType="checking", balance=Decimal("1.00")
+        )
+        db.add(account)
+        db.flush()
+
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for offset in range(0, rows, 50000):
+            db.execute(
+                insert(Transaction),
+                [
+                    {
+                        "transactionId": generate_uuid(),
+                        "accountId": account.accountId,
+                        "amount": Decimal("-1.25") if i % 2 else Decimal("1.25"),
+                        "name": f"Transfer {i}",
+                        "transferId": generate_uuid(),
+                        "currency": "USD",
+                        "date": start + timedelta(seconds=i),
+                        "createdAt": start + timedelta(seconds=i),
+                    }
+                    for i in range(offset, min(offset + 50000, rows))
+                ],
+            )
+        db.commit()
+        return account.accountId
+
+
+async def asgi_get(app, path: str, query: str, onChunk) -> None:
+    """Drive the ASGI app directly; TestClient would buffer the whole body."""
+
+    requested = []
+
+    async def receive():
+        if not requested:
+            requested.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            onChunk(message.get("body", b""))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    await app(scope, receive, send)
+
+
+def measure(mode: str, accountId: str, rows: int) -> None:
+    import json
+
+    from app.main import app
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if mode == "export":
+        lines = [0]  # chunks are counted and dropped as they arrive
+        asyncio.run(
+            asgi_get(
+                app,
+                f"/api/v2/transactions/account/{accountId}/export",
+                "",
+                lambda chunk: lines.__setitem__(0, lines[0] + chunk.count(b"\n")),
+            )
+        )
+        received = lines[0]
+    else:
+        body = []
+        asyncio.run(
+            asgi_get(app, f"/api/v2/transactions/account/{accountId}", f"limit={rows}", body.append)
+        )
+        received = len(json.loads(b"".join(body)))
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(
+        f"{mode:<7} {received:>9} rows  {received / elapsed:>10.0f} rows/sec  "
+        f"peak RSS {peak / 1024:>7.1f} MiB (+{(peak - baseline) / 1024:.1f} MiB during the request)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--mode", choices=["export", "list"], help=argparse.SUPPRESS)
+    parser.add_argument("--account", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        measure(args.mode, args.account, args.rows)
+        return
+
+    os.environ["MEOW_DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    accountId = seed(args.rows)
+    for mode in ("list", "export"):
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.export_stream", "--rows", str(args.rows), "--mode", mode, "--account", accountId],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
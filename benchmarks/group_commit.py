@@ -0,0 +1,79 @@
+"""
+Group commit benchmark: the transfer scenarios of the load-testing suite, with
+MEOW_GROUP_COMMIT_ENABLED off and on, reported as the throughput gain and the latency cost.
+
+    python -m benchmarks.group_commit
+    python -m benchmarks.group_commit --synchronous FULL --concurrency 64
+    python -m benchmarks.group_commit --uvicorn --workers 4
+
+Every run is a separate `benchmarks.suite` process on its own throwaway database. The gain
+comes from sharing one commit (one fsync with synchronous=FULL) and one write-lock
+acquisition across a batch, so it grows with concurrency and with the cost of a commit.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SCENARIOS = ["transfers", "hot_transfers"]
+
+
+def run_suite(groupCommit: bool, args) -> dict:
+    output = Path(tempfile.mkdtemp()) / "results.json"
+    command = [
+        sys.executable, "-m", "benchmarks.suite",
+        "--requests", str(args.requests),
+        "--concurrency", str(args.concurrency),
+        "--accounts", str(args.accounts),
+        "--output", str(output),
+        "--baseline", str(output.with_name("none.json")),
+    ]
+    for scenario in SCENARIOS:
+        command += ["--scenario", scenario]
+    if args.uvicorn:
+        command += ["--uvicorn", "--workers", str(args.workers)]
+
+    env = dict(
+        os.environ,
+        MEOW_GROUP_COMMIT_ENABLED="1" if groupCommit else "0",
+        MEOW_GROUP_COMMIT_MAX_BATCH=str(args.max_batch),
+        MEOW_GROUP_COMMIT_MAX_WAIT_MS=str(args.max_wait_ms),
+        MEOW_SQLITE_SYNCHRONOUS=args.synchronous,
+    )
+    print(f"-- group commit {'on' if groupCommit else 'off'}", flush=True)
+    subprocess.run(command, env=env, check=True)
+    return json.loads(output.read_text())["scenarios"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--synchronous", default="NORMAL", help="SQLite synchronous pragma, NORMAL or FULL")
+    parser.add_argument("--uvicorn", action="store_true", help="run against uvicorn instead of in-process")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    off = run_suite(False, args)
+    on = run_suite(True, args)
+
+    print(f"\nsynchronous={args.synchronous}, concurrency {args.concurrency}")
+    for name in SCENARIOS:
+        before, after = off[name], on[name]
+        gain = after["throughput"] / before["throughput"] if before["throughput"] else 0.0
+        print(
+            f"{name:<14} {before['throughput']:>8.1f} -> {after['throughput']:>8.1f} req/s ({gain:.2f}x)  "
+            f"p50 {before['p50Ms']:.2f} -> {after['p50Ms']:.2f} ms  "
+            f"p99 {before['p99Ms']:.2f} -> {after['p99Ms']:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
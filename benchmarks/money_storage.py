@@ -0,0 +1,136 @@
+"""
+Row hydration and aggregation cost of the two money storages, NUMERIC against integer
+minor units (`MEOW_MONEY_STORAGE`).
+
+    python -m benchmarks.money_storage --rows 200000
+
+Each storage runs in its own process against its own throwaway SQLite file, with the
+same pseudo-random amounts. Besides the timings it reports whether SUM(amount) came back
+exact: NUMERIC columns are floats on SQLite.
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timezone
+from decimal import Decimal
+
+
+def amounts(rows: int):
+    generator = random.Random(42)
+    return [Decimal(generator.randint(-500000, 500000)).scaleb(-2) for _ in range(rows)]
+
+
+def best_of(repeat: int, run) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def measure(storage: str, rows: int, accounts: int) -> None:
+    from sqlalchemy import func, insert, select
+
+    from app.utils.database import SessionLocal, init_db
+    from app.utils.models import Account, Customer, Transaction, generate_uuid
+
+    warnings.simplefilter("ignore")  # the SQLite Decimal warning, once per statement
+    init_db()
+    values = amounts(rows)
+    now = datetime.now(timezone.utc)
+
+    with SessionLocal() as db:
+        customer = Customer(firstName="Bench", lastName="Mark", email="money@example.com")
+        db.add(customer)
+        db.flush()
+        accountIds = [generate_uuid() for _ in range(accounts)]
+        db.execute(
+            insert(Account),
+            [
+                {
+                    "accountId": accountId,
+                    "customerId": customer.customerId,
+                    "name": "money",
+                    "accountType": "checking",
+                    "balance": Decimal("1.00"),
+                    "createdAt": now,
+                    "updatedAt": now,
+                }
+                for accountId in accountIds
+            ],
+        )
+        started = time.perf_counter()
+        db.execute(
+            insert(Transaction),
+            [
+                {
+                    "transactionId": generate_uuid(),
+                    "accountId": accountIds[i % accounts],
+                    "amount": amount,
+                    "name": "money",
+                    "currency": "USD",
+                    "date": now,
+                    "createdAt": now,
+                }
+                for i, amount in enumerate(values)
+            ],
+        )
+        db.commit()
+        insertSeconds = time.perf_counter() - started
+
+    amountColumn = Transaction.__table__.c.amount
+    with SessionLocal() as db:
+        coreSeconds = best_of(3, lambda: db.execute(select(amountColumn)).scalars().all())
+        ormSeconds = best_of(
+            3, lambda: (db.expunge_all(), db.execute(select(Transaction)).scalars().all())
+        )
+        groupedSum = (
+            select(Transaction.__table__.c.accountId, func.sum(amountColumn))
+            .group_by(Transaction.__table__.c.accountId)
+        )
+        sumSeconds = best_of(5, lambda: db.execute(groupedSum).all())
+        total = db.scalar(select(func.sum(amountColumn)))
+
+    exact = Decimal(total) == sum(values)
+    print(
+        f"{storage:<12} insert {rows / insertSeconds:>9.0f} rows/s  "
+        f"load amounts {rows / coreSeconds:>9.0f} rows/s  "
+        f"load ORM rows {rows / ormSeconds:>8.0f} rows/s  "
+        f"SUM per account {sumSeconds * 1000:>7.1f} ms  "
+        f"total {'exact' if exact else f'OFF: {total}'}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--storage", choices=["numeric", "minor_units"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.storage:
+        measure(args.storage, args.rows, args.accounts)
+        return
+
+    for storage in ("numeric", "minor_units"):
+        environment = dict(
+            os.environ,
+            MEOW_MONEY_STORAGE=storage,
+            MEOW_DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}",
+        )
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.money_storage", "--rows", str(args.rows), "--accounts", str(args.accounts), "--storage", storage],
+            check=True,
+            env=environment,
+        )
+
+
+if __name__ == "__main__":
+    main()
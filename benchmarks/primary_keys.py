@@ -0,0 +1,146 @@
+"""
+Insert rate and index size of the transactions table for the primary key layouts:
+random UUID4 text keys (before), UUIDv7 text keys and UUIDv7 16-byte keys (`MEOW_ID_STORAGE`).
+
+    python -m benchmarks.primary_keys                    # 10M rows per layout
+    python -m benchmarks.primary_keys --rows 1000000
+
+Each layout runs in its own process against its own throwaway SQLite file. Rows are
+inserted in committed chunks; the insert rate is reported overall and over the last tenth
+of the rows, where random keys pay for a primary key index that no longer fits the page
+cache. Sizes come from the dbstat virtual table.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import warnings
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+LAYOUTS = {
+    "uuid4-text": ("uuid4", "text"),
+    "uuid7-text": ("uuid7", "text"),
+    "uuid7-binary": ("uuid7", "binary"),
+}
+
+
+def megabytes(size: int) -> str:
+    return f"{size / 1048576:>8.1f} MB"
+
+
+def measure(layout: str, rows: int, accounts: int, chunk: int) -> None:
+    from sqlalchemy import insert
+
+    from app.utils.database import SessionLocal, engine, init_db
+    from app.utils.ids import uuid7
+    from app.utils.models import Account, Customer, Transaction
+
+    generate = uuid7 if LAYOUTS[layout][0] == "uuid7" else lambda: str(uuid.uuid4())
+    warnings.simplefilter("ignore")  # the SQLite Decimal warning, once per statement
+    init_db()
+    now = datetime.now(timezone.utc)
+
+    with SessionLocal() as db:
+        customer = Customer(customerId=generate(), firstName="Bench", lastName="Mark", email="keys@example.com")
+        db.add(customer)
+        db.flush()
+        accountIds = [generate() for _ in range(accounts)]
+        db.execute(
+            insert(Account),
+            [
+                {
+                    "accountId": accountId,
+                    "customerId": customer.customerId,
+                    "name": "keys",
+                    "accountType": "checking",
+                    "balance": Decimal("1.00"),
+                    "createdAt": now,
+                    "updatedAt": now,
+                }
+                for accountId in accountIds
+            ],
+        )
+        db.commit()
+
+    amount = Decimal("1.00")
+    tailStart = rows - max(rows // 10, chunk)
+    tailRows, tailSeconds = 0, 0.0
+    started = time.perf_counter()
+    for offset in range(0, rows, chunk):
+        chunkStarted = time.perf_counter()
+        values = []
+        for i in range(offset, min(offset + chunk, rows), 2):
+            transferId = generate()
+            date = now + timedelta(microseconds=i)
+            for accountId, signed in ((accountIds[i % accounts], -amount), (accountIds[(i + 1) % accounts], amount)):
+                values.append(
+                    {
+                        "transactionId": generate(),
+                        "accountId": accountId,
+                        "amount": signed,
+                        "name": "keys",
+                        "transferId": transferId,
+                        "currency": "USD",
+                        "date": date,
+                        "createdAt": date,
+                    }
+                )
+        with SessionLocal() as db:
+            db.execute(insert(Transaction), values)
+            db.commit()
+        if offset >= tailStart:
+            tailRows += len(values)
+            tailSeconds += time.perf_counter() - chunkStarted
+    insertSeconds = time.perf_counter() - started
+
+    with engine.connect() as connection:
+        sizes = dict(
+            connection.exec_driver_sql(
+                "SELECT dbstat.name, SUM(pgsize) FROM dbstat JOIN sqlite_master USING (name) "
+                "WHERE sqlite_master.tbl_name = 'transactions' GROUP BY dbstat.name"
+            ).all()
+        )
+    fileSize = os.path.getsize(engine.url.database)
+
+    print(
+        f"{layout:<13} insert {rows / insertSeconds:>8.0f} rows/s overall, "
+        f"{tailRows / tailSeconds:>8.0f} rows/s last tenth   file {megabytes(fileSize)}"
+    )
+    for name, size in sorted(sizes.items()):
+        print(f"    {name:<40} {megabytes(size)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--chunk", type=int, default=50000, help="rows per committed insert")
+    parser.add_argument("--layout", choices=list(LAYOUTS), action="append", dest="layouts")
+    parser.add_argument("--run", choices=list(LAYOUTS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        measure(args.run, args.rows, args.accounts, args.chunk)
+        return
+
+    for layout in args.layouts or LAYOUTS:
+        environment = dict(
+            os.environ,
+            MEOW_ID_STORAGE=LAYOUTS[layout][1],
+            MEOW_METRICS_ENABLED="0",
+            MEOW_DATABASE_URL=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}",
+        )
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.primary_keys", "--rows", str(args.rows), "--accounts", str(args.accounts), "--chunk", str(args.chunk), "--run", layout],
+            check=True,
+            env=environment,
+        )
+
+
+if __name__ == "__main__":
+    main()
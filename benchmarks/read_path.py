@@ -0,0 +1,122 @@
+"""
+Latency of the list endpoints - transaction history, accounts and customers - at
+limit=100 and limit=1000.
+
+    python -m benchmarks.read_path
+    python -m benchmarks.read_path --requests 500
+
+The data is inserted directly into a throwaway SQLite database, then every endpoint is
+called `--requests` times in a row through the ASGI app in-process, so the numbers are the
+server's own cost per request: query, row loading, validation and JSON encoding.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+LIMITS = (100, 1000)
+
+
+def populate(rows: int) -> str:
+    """Insert `rows` customers and accounts, and `rows` transactions on one account."""
+    from sqlalchemy import insert
+
+    from app.utils.database import SessionLocal, init_db
+    from app.utils.models import Account, Customer, Transaction, generate_uuid
+
+    warnings.simplefilter("ignore")  # the SQLite Decimal warning, once per statement
+    init_db()
+    now = datetime.now(timezone.utc)
+    customerIds = [generate_uuid() for _ in range(rows)]
+    accountIds = [generate_uuid() for _ in range(rows)]
+    with SessionLocal() as db:
+        db.execute(
+            insert(Customer.__table__),
+            [
+                {
+                    "customerId": customerId,
+                    "firstName": "Read",
+                    "lastName": "Path",
+                    "email": f"{customerId}@bench.example.com",
+                    "phoneNumber": None,
+                    "createdAt": now,
+                    "updatedAt": now,
+                }
+                for customerId in customerIds
+            ],
+        )
+        db.execute(
+            insert(Account.__table__),
+            [
+                {
+                    "accountId": accountId,
+                    "customerId": customerId,
+                    "name": "read path",
+                    "accountType": "checking",
+                    "currency": "USD",
+                    "balance": Decimal("1234.56"),
+                    "createdAt": now,
+                    "updatedAt": now,
+                }
+                for accountId, customerId in zip(accountIds, customerIds)
+            ],
+        )
+        db.execute(
+            insert(Transaction.__table__),
+            [
+                {
+                    "transactionId": generate_uuid(),
+                    "accountId": accountIds[0],
+                    "amount": Decimal(i % 1000 - 500).scaleb(-2),
+                    "name": "read path",
+                    "transferId": generate_uuid() if i % 2 else None,
+                    "currency": "USD",
+                    "date": now - timedelta(seconds=i),
+                    "createdAt": now - timedelta(seconds=i),
+                }
+                for i in range(rows)
+            ],
+        )
+        db.commit()
+    return accountIds[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and limit")
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    os.environ["MEOW_DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.setdefault("MEOW_METRICS_ENABLED", "0")
+    accountId = populate(args.rows)
+
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    endpoints = {
+        "transactions": f"/api/v2/transactions/account/{accountId}",
+        "accounts": "/api/v1/accounts/",
+        "customers": "/api/v1/customers/",
+    }
+    with TestClient(app) as client:
+        for name, path in endpoints.items():
+            for limit in LIMITS:
+                client.get(path, params={"limit": limit}).raise_for_status()  # warm up
+                started = time.perf_counter()
+                for _ in range(args.requests):
+                    client.get(path, params={"limit": limit})
+                elapsed = time.perf_counter() - started
+                print(
+                    f"{name:<13} limit={limit:<5} {elapsed / args.requests * 1000:>8.2f} ms/request  "
+                    f"{args.requests / elapsed:>8.1f} req/s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Latency of the search endpoints, against the LIKE scan they replace.
+
+    python -m benchmarks.search
+    python -m benchmarks.search --rows 10000000 --requests 50
+
+Transactions with varied names ("Transfer to <name>", "Card payment <merchant>", ...) are
+inserted directly into a throwaway SQLite database over `--accounts` accounts; the FTS
+triggers index them as they go, so the load time includes the index upkeep. Every query is
+then sent `--requests` times through the ASGI app in-process and the median and p95
+latency are reported, with the same query served by the LIKE fallback next to it.
+`--no-like` skips the fallback, which takes seconds per query at 10M rows.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import warnings
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+CHUNK_ROWS = 50000
+
+FIRST_NAMES = ["Alice", "Bob", "Chloé", "David", "Emma", "Farid", "Grace", "Hugo", "Ines", "Jonas"]
+MERCHANTS = ["Amazon", "Tesco", "Uber", "Netflix", "Shell", "Ikea", "Spotify", "Lidl", "Zara", "Apple"]
+TEMPLATES = [
+    "Transfer to {name}",
+    "Transfer from {name}",
+    "Card payment {merchant}",
+    "Refund {merchant} order {number}",
+    "Rent {month}",
+    "Salary {month} {name}",
+]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September"]
+
+# name, query parameters; the account is filled in for scoped queries
+QUERIES = [
+    ("common prefix", {"q": "trans"}),
+    ("two words", {"q": "transfer ali"}),
+    ("rare word", {"q": "refund 4242"}),
+    ("newest first", {"q": "card", "sort": "newest"}),
+    ("one account", {"q": "trans", "accountId": None}),
+]
+
+
+def transaction_name(rng: random.Random) -> str:
+    return rng.choice(TEMPLATES).format(
+        name=rng.choice(FIRST_NAMES) + str(rng.randrange(1000)),
+        merchant=rng.choice(MERCHANTS),
+        number=rng.randrange(100000),
+        month=rng.choice(MONTHS),
+    )
+
+
+def populate(rows: int, accountCount: int) -> list:
+    """Insert `accountCount` customers and accounts, and `rows` transactions over them."""
+    from sqlalchemy import insert
+
+    from app.utils.database import SessionLocal, init_db
+    from app.utils.models import Account, Customer, Transaction, generate_uuid
+
+    warnings.simplefilter("ignore")  # the SQLite Decimal warning, once per statement
+    init_db()
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc)
+    customerIds = [generate_uuid() for _ in range(accountCount)]
+    accountIds = [generate_uuid() for _ in range(accountCount)]
+    with SessionLocal() as db:
+        db.execute(
+            insert(Customer.__table__),
+            [
+                {
+                    "customerId": customerId,
+                    "firstName": rng.choice(FIRST_NAMES),
+                    "lastName": f"Search{i}",
+                    "email": f"{customerId}@bench.example.com",
+                    "phoneNumber": None,
+                    "createdAt": now,
+                    "updatedAt": now,
+                }
+                for i, customerId in enumerate(customerIds)
+            ],
+        )
+        db.execute(
+            insert(Account.__table__),
+            [
+                {
+                    "accountId": accountId,
+                    "customerId": customerId,
+                    "name": "search",
+                    "accountType": "checking",
+                    "currency": "USD",
+                    "balance": Decimal("1234.56"),
+                    "createdAt": now,
+                    "updatedAt": now,
+                }
+                for accountId, customerId in zip(accountIds, customerIds)
+            ],
+        )
+        db.commit()
+
+        started = time.perf_counter()
+        for offset in range(0, rows, CHUNK_ROWS):
+            db.execute(
+                insert(Transaction.__table__),
+                [
+                    {
+                        "transactionId": generate_uuid(),
+                        "accountId": rng.choice(accountIds),
+                        "amount": Decimal(i % 1000 - 500).scaleb(-2),
+                        "name": transaction_name(rng),
+                        "transferId": None,
+                        "currency": "USD",
+                        "date": now - timedelta(seconds=rows - i),
+                        "createdAt": now - timedelta(seconds=rows - i),
+                    }
+                    for i in range(offset, min(offset + CHUNK_ROWS, rows))
+                ],
+            )
+            db.commit()
+        elapsed = time.perf_counter() - started
+    print(f"Inserted {rows} transactions in {elapsed:.1f} s ({rows / elapsed:.0f} rows/s, index upkeep included)")
+    return accountIds
+
+
+def time_requests(client, path: str, params: dict, requests: int) -> list:
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        client.get(path, params=params).raise_for_status()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+@contextmanager
+def like_fallback():
+    """Serve searches by the LIKE fallback, as on a database without the index."""
+    from app.utils import search
+    from app.utils.database import engine
+
+    url = str(engine.url)
+    search._ftsAvailable[url] = False
+    try:
+        yield
+    finally:
+        search._ftsAvailable[url] = True
+
+
+def report(name: str, timings: list) -> None:
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<28} median {statistics.median(timings) * 1000:>9.2f} ms  p95 {p95 * 1000:>9.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=100, help="requests per query")
+    parser.add_argument("--no-like", action="store_true", help="skip the LIKE fallback")
+    args = parser.parse_args()
+
+    os.environ["MEOW_DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.setdefault("MEOW_METRICS_ENABLED", "0")
+    accountIds = populate(args.rows, args.accounts)
+
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as client:
+        for name, params in QUERIES:
+            if "accountId" in params:
+                params = dict(params, accountId=accountIds[0])
+            found = len(client.get("/api/v2/transactions/search", params=params).json())  # warm up
+            report(f"{name} ({found})", time_requests(client, "/api/v2/transactions/search", params, args.requests))
+            if not args.no_like:
+                with like_fallback():
+                    timings = time_requests(client, "/api/v2/transactions/search", params, max(args.requests // 10, 1))
+                report("  LIKE fallback", timings)
+
+        report("customers", time_requests(client, "/api/v1/customers/search", {"q": "gra search1"}, args.requests))
+
+
+if __name__ == "__main__":
+    main()
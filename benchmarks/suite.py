@@ -0,0 +1,351 @@
+"""
+Load-testing suite for the API: throughput and p50/p95/p99 latency per scenario, saved
+as JSON and compared against a baseline.
+
+    python -m benchmarks.suite                            # app in-process, httpx ASGI transport
+    python -m benchmarks.suite --uvicorn --workers 4      # a real uvicorn on a free port
+    python -m benchmarks.suite --url http://host:8000     # an API that is already running
+    python -m benchmarks.suite --save-baseline            # make this run the new baseline
+
+Scenarios (select with --scenario, repeatable):
+
+    create_accounts   POST a customer, then an account for it
+    transfers         transfers between random pairs of accounts
+    hot_transfers     every transfer debits or credits the same account (lock contention)
+    balance_reads     current balance of random accounts
+    history_paging    walk a long transaction history page by page with X-Next-Cursor
+
+Results go to benchmarks/results/latest.json. When a baseline exists, a scenario whose
+throughput dropped or whose p95 grew by more than --tolerance is reported as a
+regression and the command exits with status 1. In-process and uvicorn runs start
+from a throwaway SQLite database, or --database-url; --url runs add their data to
+whatever is there. --hot-slots N splits the hot account into N balance slots.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+SCENARIOS = ["create_accounts", "transfers", "hot_transfers", "balance_reads", "history_paging"]
+
+
+def percentile(sortedValues, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sortedValues:
+        return 0.0
+    rank = max(int(round(fraction * len(sortedValues) + 0.5)) - 1, 0)
+    return sortedValues[min(rank, len(sortedValues) - 1)]
+
+
+async def run_load(operation, requests: int, concurrency: int) -> dict:
+    """Run `operation(i)` `requests` times over `concurrency` workers; latency per call."""
+    latencies = []
+    errors = []
+    nextIndex = iter(range(requests))
+
+    async def worker():
+        for index in nextIndex:
+            started = time.perf_counter()
+            try:
+                await operation(index)
+            except Exception as e:  # a failed call still counts, it is reported below
+                errors.append(str(e))
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "firstError": errors[0] if errors else None,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50Ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95Ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99Ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def expect(response: httpx.Response, status: int = 200) -> httpx.Response:
+    if response.status_code != status:
+        raise RuntimeError(f"{response.request.method} {response.request.url.path}: {response.status_code} {response.text[:200]}")
+    return response
+
+
+async def create_account(client: httpx.AsyncClient, balance: str = "1000000000") -> str:
+    customer = expect(
+        await client.post(
+            "/api/v1/customers/",
+            json={"firstName": "Bench", "lastName": "Mark", "email": f"{uuid.uuid4().hex}@bench.example.com"},
+        ),
+        201,
+    ).json()
+    account = expect(
+        await client.post(
+            "/api/v1/accounts/",
+            json={"customerId": customer["customerId"], "name": "bench", "accountType": "checking", "balance": balance},
+        ),
+        201,
+    ).json()
+    return account["accountId"]
+
+
+async def transfer(client: httpx.AsyncClient, fromAccountId: str, toAccountId: str) -> None:
+    expect(
+        await client.post(
+            "/api/v2/transfers/",
+            json={"fromAccountId": fromAccountId, "toAccountId": toAccountId, "amount": "1.00"},
+        ),
+        201,
+    )
+
+
+async def run_scenario(name: str, client: httpx.AsyncClient, accounts, args) -> dict:
+    generator = random.Random(7)
+
+    if name == "create_accounts":
+        return await run_load(lambda i: create_account(client), args.requests, args.concurrency)
+
+    if name == "transfers":
+        async def operation(i):
+            fromAccountId, toAccountId = generator.sample(accounts, 2)
+            await transfer(client, fromAccountId, toAccountId)
+
+        return await run_load(operation, args.requests, args.concurrency)
+
+    if name == "hot_transfers":
+        hotAccountId = accounts[0]
+
+        async def operation(i):
+            otherAccountId = generator.choice(accounts[1:])
+            if i % 2:
+                await transfer(client, hotAccountId, otherAccountId)
+            else:
+                await transfer(client, otherAccountId, hotAccountId)
+
+        return await run_load(operation, args.requests, args.concurrency)
+
+    if name == "balance_reads":
+        async def operation(i):
+            expect(await client.get(f"/api/v1/accounts/{generator.choice(accounts)}/balance"))
+
+        return await run_load(operation, args.requests, args.concurrency)
+
+    if name == "history_paging":
+        # One long history, built with batch transfers, walked by `concurrency` readers
+        historyAccountId, counterpartId = accounts[0], accounts[1]
+        for offset in range(0, args.history, 5000):
+            expect(
+                await client.post(
+                    "/api/v2/transfers/batch",
+                    json={
+                        "transfers": [
+                            {"fromAccountId": counterpartId, "toAccountId": historyAccountId, "amount": "0.01"}
+                            for _ in range(min(5000, args.history - offset))
+                        ]
+                    },
+                ),
+                201,
+            )
+
+        cursors = {}
+
+        async def operation(i):
+            reader = i % args.concurrency
+            params = {"limit": 100}
+            if cursors.get(reader):
+                params["cursor"] = cursors[reader]
+            response = expect(
+                await client.get(f"/api/v2/transactions/account/{historyAccountId}", params=params)
+            )
+            cursors[reader] = response.headers.get("X-Next-Cursor")  # None restarts at page one
+
+        return await run_load(operation, args.requests, args.concurrency)
+
+    raise ValueError(f"Unknown scenario {name}")
+
+
+async def run_suite(client: httpx.AsyncClient, args) -> dict:
+    accounts = [await create_account(client) for _ in range(args.accounts)]
+    if args.hot_slots > 1:
+        subprocess.run(
+            [sys.executable, "-m", "app.commands.balance_slots", accounts[0], "--slots", str(args.hot_slots)],
+            env=os.environ.copy(),
+            check=True,
+        )
+    results = {}
+    for name in args.scenarios:
+        results[name] = await run_scenario(name, client, accounts, args)
+        print(format_result(name, results[name]), flush=True)
+    return results
+
+
+def format_result(name: str, result: dict) -> str:
+    return (
+        f"{name:<16} {result['throughput']:>9.1f} req/s  p50 {result['p50Ms']:>8.2f} ms  "
+        f"p95 {result['p95Ms']:>8.2f} ms  p99 {result['p99Ms']:>8.2f} ms  errors {result['errors']}"
+    )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of `results` against `baseline`, as printable lines."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        throughputChange = result["throughput"] / before["throughput"] - 1 if before["throughput"] else 0.0
+        p95Change = result["p95Ms"] / before["p95Ms"] - 1 if before["p95Ms"] else 0.0
+        print(f"{name:<16} throughput {throughputChange:>+7.1%}  p95 {p95Change:>+7.1%}")
+        if throughputChange < -tolerance:
+            regressions.append(f"{name}: throughput {before['throughput']} -> {result['throughput']} req/s")
+        if p95Change > tolerance:
+            regressions.append(f"{name}: p95 {before['p95Ms']} -> {result['p95Ms']} ms")
+    return regressions
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_uvicorn(workers: int) -> tuple:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=os.environ.copy(),
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(url + "/", timeout=1.0)
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise SystemExit("uvicorn did not start")
+
+
+async def run_in_process(args) -> dict:
+    from app.main import app
+    from app.utils.database import init_db
+
+    init_db()  # the ASGI transport does not run startup events
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        return await run_suite(client, args)
+
+
+async def run_against(url: str, args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60.0) as client:
+        return await run_suite(client, args)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="benchmark an API that is already running")
+    target.add_argument("--uvicorn", action="store_true", help="start uvicorn on a throwaway database")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--scenario", action="append", dest="scenarios", choices=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--history", type=int, default=20000, help="transactions in the paged history")
+    parser.add_argument("--output", type=Path, default=RESULTS_DIR / "latest.json")
+    parser.add_argument("--baseline", type=Path, default=RESULTS_DIR / "baseline.json")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative change")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--database-url", help="database of in-process and uvicorn runs (default: throwaway SQLite)")
+    parser.add_argument("--hot-slots", type=int, default=1, help="balance slots of the hot_transfers account")
+    args = parser.parse_args()
+    args.scenarios = args.scenarios or SCENARIOS
+    if args.url and (args.hot_slots > 1 or args.database_url):
+        parser.error("--hot-slots and --database-url need an in-process or uvicorn run")
+
+    if not args.url:
+        os.environ["MEOW_DATABASE_URL"] = args.database_url or (
+            f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+        )
+
+    if args.uvicorn:
+        process, url = start_uvicorn(args.workers)
+        try:
+            scenarios = asyncio.run(run_against(url, args))
+        finally:
+            process.terminate()
+            process.wait()
+        targetName = f"uvicorn --workers {args.workers}"
+    elif args.url:
+        scenarios = asyncio.run(run_against(args.url, args))
+        targetName = args.url
+    else:
+        scenarios = asyncio.run(run_in_process(args))
+        targetName = "in-process (httpx ASGI transport)"
+
+    results = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "target": targetName,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "accounts": args.accounts,
+            "hotSlots": args.hot_slots,
+        },
+        "scenarios": scenarios,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {args.output}")
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Saved as baseline {args.baseline}")
+        return
+
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        print(f"Compared with baseline {args.baseline} ({baseline['meta']['revision']}, {baseline['meta']['date']})")
+        regressions = compare(scenarios, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Tests run the app in-process against throwaway SQLite databases: the main database and one
+more shard, so the cross-shard paths are covered too. Settings are read when `app` is first
+imported, so the environment is set here, before any test module imports it.
+"""
+
+import json
+import os
+import tempfile
+import uuid
+import warnings
+
+import pytest
+
+directory = tempfile.mkdtemp(prefix="meow-tests-")
+os.environ["MEOW_DATABASE_URL"] = f"sqlite:///{directory}/main.db"
+os.environ["MEOW_SHARD_URLS"] = json.dumps([f"sqlite:///{directory}/shard1.db"])
+os.environ["MEOW_ARCHIVE_DIR"] = os.path.join(directory, "archive")
+os.environ["MEOW_METRICS_ENABLED"] = "0"
+
+warnings.filterwarnings("ignore", message=".*Decimal objects natively.*")
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def open_account(client):
+    """Open an account for a new customer, on `shard` when given; returns the account JSON."""
+    from app.utils.sharding import shard_for_email
+
+    def open_account(currency: str = "USD", balance: str = "100.00", shard: int = None) -> dict:
+        email = f"{uuid.uuid4().hex}@tests.example.com"
+        while shard is not None and shard_for_email(email) != shard:
+            email = f"{uuid.uuid4().hex}@tests.example.com"
+        customer = client.post(
+            "/api/v1/customers/", json={"firstName": "Test", "lastName": "Customer", "email": email}
+        )
+        assert customer.status_code == 201, customer.text
+        account = client.post(
+            "/api/v1/accounts/",
+            json={
+                "customerId": customer.json()["customerId"],
+                "name": f"account {email[:8]}",
+                "accountType": "checking",
+                "currency": currency,
+                "balance": balance,
+            },
+        )
+        assert account.status_code == 201, account.text
+        return account.json()
+
+    return open_account
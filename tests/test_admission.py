@@ -0,0 +1,70 @@
+import asyncio
+
+from app.utils.admission import ConcurrencyGate, TokenBuckets
+
+
+def test_gate_queues_in_order_and_turns_away_beyond_the_queue():
+    async def scenario():
+        gate = ConcurrencyGate(limit=1, queueSize=2, timeout=1.0)
+        assert await gate.acquire() is None
+        order = []
+
+        async def waiter(name):
+            refused = await gate.acquire()
+            order.append((name, refused))
+            if refused is None:
+                gate.release()
+
+        first = asyncio.create_task(waiter("first"))
+        second = asyncio.create_task(waiter("second"))
+        await asyncio.sleep(0)
+        assert await gate.acquire() == "queue_full"
+
+        gate.release()
+        await asyncio.gather(first, second)
+        assert order == [("first", None), ("second", None)]
+        assert gate.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_gate_refuses_past_the_deadline():
+    async def scenario():
+        gate = ConcurrencyGate(limit=1, queueSize=1, timeout=0.05)
+        assert await gate.acquire() is None
+        assert await gate.acquire() == "deadline"
+        gate.release()
+        assert gate.active == 0
+        assert await gate.acquire() is None
+
+    asyncio.run(scenario())
+
+
+def test_token_buckets_take_from_every_key_or_none(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("app.utils.admission.time.monotonic", lambda: clock[0])
+    buckets = TokenBuckets(rate=1.0, burst=2)
+
+    assert buckets.take(["a"]) == 0
+    assert buckets.take(["a"]) == 0
+    assert buckets.take(["a", "b"]) == 1.0  # a is empty, so b keeps its tokens
+    assert buckets.take(["b"]) == 0
+    assert buckets.take(["b"]) == 0
+
+    clock[0] += 0.5
+    assert buckets.take(["a"]) == 0.5
+    clock[0] += 0.5
+    assert buckets.take(["a"]) == 0
+
+
+def test_write_route_answers_429_with_retry_after_over_the_customer_rate(client, open_account, monkeypatch):
+    from app.utils import admission
+
+    fromAccount, toAccount = open_account(), open_account()
+    monkeypatch.setattr(admission, "buckets", TokenBuckets(rate=0.1, burst=1))
+    body = {"fromAccountId": fromAccount["accountId"], "toAccountId": toAccount["accountId"], "amount": "1.00"}
+
+    assert client.post("/api/v2/transfers/", json=body).status_code == 201
+    response = client.post("/api/v2/transfers/", json=body)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
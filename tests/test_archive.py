@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from app.utils import archive
+from app.utils.database import ShardWriteSessionLocal
+from app.utils.models import Transaction
+
+transactions = Transaction.__table__
+
+
+def history(client, accountId, **params):
+    response = client.get(f"/api/v2/transactions/account/{accountId}", params=params)
+    assert response.status_code == 200, response.text
+    return response
+
+
+@pytest.mark.parametrize("shard", [0, 1])
+def test_history_pages_run_from_the_table_into_the_archive(client, open_account, shard):
+    fromAccount, toAccount = open_account("USD", "100.00", shard), open_account("USD", "100.00", shard)
+    for _ in range(12):
+        response = client.post(
+            "/api/v2/transfers/",
+            json={"fromAccountId": fromAccount["accountId"], "toAccountId": toAccount["accountId"], "amount": "1.00"},
+        )
+        assert response.status_code == 201, response.text
+
+    # Back-date the first eight debits into two old months, a day apart each
+    now = datetime.now(timezone.utc)
+    debits = [row["transactionId"] for row in reversed(history(client, fromAccount["accountId"]).json())]
+    with ShardWriteSessionLocal[shard]() as db:
+        for position, transactionId in enumerate(debits[:8]):
+            monthAgo = 130 if position < 4 else 100
+            db.execute(
+                update(transactions)
+                .where(transactions.c.transactionId == transactionId)
+                .values(date=now - timedelta(days=monthAgo - position))
+            )
+        db.commit()
+    expected = [row["transactionId"] for row in history(client, fromAccount["accountId"]).json()]
+    assert len(expected) == 12
+
+    with ShardWriteSessionLocal[shard]() as db:
+        assert archive.archive_shard(db, now - timedelta(days=60)) >= 8
+
+    # Table rows first, then the archived months, newest first, with cursors
+    paged, cursor = [], None
+    while True:
+        response = history(client, fromAccount["accountId"], limit=5, **({"cursor": cursor} if cursor else {}))
+        paged += [row["transactionId"] for row in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert paged == expected
+
+    # and with skip, including a page that starts inside the archive
+    skipped = []
+    for skip in range(0, 12, 5):
+        skipped += [row["transactionId"] for row in history(client, fromAccount["accountId"], skip=skip, limit=5).json()]
+    assert skipped == expected
+    assert [row["transactionId"] for row in history(client, fromAccount["accountId"], skip=9, limit=2).json()] == expected[9:11]
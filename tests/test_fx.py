@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+
+@pytest.fixture(scope="module", autouse=True)
+def usd_jpy_rate(client):
+    response = client.post(
+        "/api/v1/fx-rates/",
+        json={
+            "baseCurrency": "USD",
+            "quoteCurrency": "JPY",
+            "rate": "150",
+            "effectiveFrom": (datetime.now(timezone.utc) - timedelta(days=1)).isoformat(),
+        },
+    )
+    assert response.status_code == 201, response.text
+
+
+def transfer(client, fromAccount, toAccount, amount):
+    return client.post(
+        "/api/v2/transfers/",
+        json={"fromAccountId": fromAccount["accountId"], "toAccountId": toAccount["accountId"], "amount": amount},
+    )
+
+
+@pytest.mark.parametrize("shards", [(0, 0), (0, 1)])
+def test_whole_jpy_amount_written_with_cents_converts(client, open_account, shards):
+    jpyAccount, usdAccount = open_account("JPY", "10000", shards[0]), open_account("USD", "100.00", shards[1])
+    response = transfer(client, jpyAccount, usdAccount, "1500.00")
+    assert response.status_code == 201, response.text
+    assert Decimal(response.json()["creditedAmount"]) == Decimal("10.00")
+
+    response = transfer(client, usdAccount, jpyAccount, "10.00")
+    assert response.status_code == 201, response.text
+    assert Decimal(response.json()["creditedAmount"]) == Decimal("1500")
+
+
+def test_whole_jpy_amount_written_with_cents_converts_in_a_batch(client, open_account):
+    # A batch only takes transfers within one shard
+    jpyAccount, usdAccount = open_account("JPY", "10000", 0), open_account("USD", "100.00", 0)
+    response = client.post(
+        "/api/v2/transfers/batch",
+        json={
+            "transfers": [
+                {"fromAccountId": jpyAccount["accountId"], "toAccountId": usdAccount["accountId"], "amount": "10.00"},
+                {"fromAccountId": jpyAccount["accountId"], "toAccountId": usdAccount["accountId"], "amount": "10.50"},
+            ]
+        },
+    )
+    results = response.json()["results"]
+    assert results[0]["status"] == "success", results[0]
+    assert results[1]["status"] == "failed"
+    assert "at most 0 decimal places for JPY" in results[1]["message"]
+
+
+def test_jpy_fraction_is_refused_across_currencies(client, open_account):
+    jpyAccount, usdAccount = open_account("JPY", "10000"), open_account("USD", "100.00")
+    response = transfer(client, jpyAccount, usdAccount, "10.50")
+    assert response.status_code == 400
+    assert "at most 0 decimal places for JPY" in response.json()["detail"]
+
+
+def test_summary_leaves_out_currencies_without_a_rate(client, open_account):
+    usdAccount = open_account("USD", "10.00")
+    response = client.post(
+        "/api/v1/accounts/",
+        json={
+            "customerId": usdAccount["customerId"],
+            "name": "francs",
+            "accountType": "savings",
+            "currency": "CHF",
+            "balance": "5.00",
+        },
+    )
+    assert response.status_code == 201, response.text
+
+    summary = client.get(f"/api/v1/customers/{usdAccount['customerId']}/summary?currency=JPY")
+    assert summary.status_code == 200, summary.text
+    body = summary.json()
+    assert Decimal(body["totalBalance"]) == Decimal("1500")
+    assert body["currency"] == "JPY"
+    assert {currency: Decimal(total) for currency, total in body["balances"].items()} == {
+        "USD": Decimal("10.00"),
+        "CHF": Decimal("5.00"),
+    }
+    assert body["unconvertedCurrencies"] == ["CHF"]
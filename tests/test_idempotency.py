@@ -0,0 +1,83 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from app.utils import idempotency
+from app.utils.config import settings
+from app.utils.database import ShardWriteSessionLocal
+from app.utils.models import IdempotencyKey
+from app.utils.sharding import shard_of
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    idempotency.idempotency_cache.clear()
+
+
+def transfer(client, fromAccount, toAccount, key, amount="1.00"):
+    return client.post(
+        "/api/v2/transfers/",
+        json={"fromAccountId": fromAccount["accountId"], "toAccountId": toAccount["accountId"], "amount": amount},
+        headers={"Idempotency-Key": key},
+    )
+
+
+def test_retry_replays_the_original_response(client, open_account):
+    fromAccount, toAccount = open_account(), open_account()
+    first = transfer(client, fromAccount, toAccount, "retry")
+    idempotency.idempotency_cache.clear()  # from the table, then from the cache
+    for _ in range(2):
+        retry = transfer(client, fromAccount, toAccount, "retry")
+        assert retry.status_code == 201
+        assert retry.headers[idempotency.REPLAYED_HEADER] == "true"
+        assert retry.json()["transferId"] == first.json()["transferId"]
+
+
+def test_key_reused_for_another_request_from_the_account_is_rejected(client, open_account):
+    fromAccount, toAccount = open_account(), open_account()
+    assert transfer(client, fromAccount, toAccount, "reused").status_code == 201
+    assert transfer(client, fromAccount, toAccount, "reused", amount="2.00").status_code == 422
+
+
+@pytest.mark.parametrize("shard", [0, 1])
+def test_key_is_scoped_to_the_source_account(client, open_account, shard):
+    toAccount = open_account(shard=0)
+    first = transfer(client, open_account(shard=0), toAccount, f"scoped-{shard}")
+    second = transfer(client, open_account(shard=shard), toAccount, f"scoped-{shard}")
+    assert second.status_code == 201
+    assert idempotency.REPLAYED_HEADER not in second.headers
+    assert second.json()["transferId"] != first.json()["transferId"]
+
+
+def test_cached_key_is_not_replayed_after_the_stored_key_expired(client, open_account):
+    fromAccount, toAccount = open_account(), open_account()
+    first = transfer(client, fromAccount, toAccount, "expiring")
+    key = idempotency.scoped_key(fromAccount["accountId"], "expiring")
+    with ShardWriteSessionLocal[shard_of(fromAccount["accountId"])]() as db:
+        db.execute(
+            update(IdempotencyKey.__table__)
+            .where(IdempotencyKey.__table__.c.key == key)
+            .values(expiresAt=datetime.now(timezone.utc) + timedelta(seconds=1))
+        )
+        db.commit()
+    idempotency.idempotency_cache.clear()
+
+    assert transfer(client, fromAccount, toAccount, "expiring").headers[idempotency.REPLAYED_HEADER] == "true"
+    time.sleep(1.1)
+    retry = transfer(client, fromAccount, toAccount, "expiring")
+    assert idempotency.REPLAYED_HEADER not in retry.headers
+    assert retry.json()["transferId"] != first.json()["transferId"]
+
+
+def test_remembered_key_expires_with_the_stored_key(client, open_account, monkeypatch):
+    monkeypatch.setattr(settings, "idempotency_key_ttl_hours", 1 / 3600)
+    fromAccount, toAccount = open_account(), open_account()
+    first = transfer(client, fromAccount, toAccount, "remembered")
+    assert idempotency.idempotency_cache.get(idempotency.scoped_key(fromAccount["accountId"], "remembered"))
+
+    time.sleep(1.1)
+    retry = transfer(client, fromAccount, toAccount, "remembered")
+    assert idempotency.REPLAYED_HEADER not in retry.headers
+    assert retry.json()["transferId"] != first.json()["transferId"]
@@ -0,0 +1,107 @@
+from decimal import Decimal
+
+import pytest
+
+from app.utils.money import MAX_AMOUNT, MAX_DIGITS
+
+
+def test_sqlite_numeric_storage_limits_amounts_to_15_digits():
+    assert MAX_DIGITS == 15
+    assert MAX_AMOUNT == Decimal("1E13")
+
+
+def test_balance_at_the_limit_is_stored_exactly(client, open_account):
+    account = open_account(balance="9999999999999.99")
+    assert account["balance"] == "9999999999999.99"
+
+    balance = client.get(f"/api/v1/accounts/{account['accountId']}/balance")
+    assert balance.json()["balance"] == "9999999999999.99"
+
+
+@pytest.mark.parametrize("balance", ["10000000000000.00", "1234567890123456.78"])
+def test_balance_beyond_what_storage_holds_is_rejected(client, open_account, balance):
+    customerId = open_account()["customerId"]
+    response = client.post(
+        "/api/v1/accounts/",
+        json={"customerId": customerId, "name": "too large", "accountType": "checking", "balance": balance},
+    )
+    assert response.status_code == 422
+
+
+def test_transfer_amount_beyond_what_storage_holds_is_rejected(client, open_account):
+    fromAccount, toAccount = open_account(), open_account()
+    response = client.post(
+        "/api/v2/transfers/",
+        json={
+            "fromAccountId": fromAccount["accountId"],
+            "toAccountId": toAccount["accountId"],
+            "amount": "1234567890123456.78",
+        },
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize(
+    "amount, places",
+    [("10", 0), ("10.00", 0), ("10.50", 1), ("10.05", 2), ("0.00", 0), ("1E+3", 0), ("0.001", 3)],
+)
+def test_decimal_places_ignores_trailing_zeros(amount, places):
+    from app.utils.money import decimal_places
+
+    assert decimal_places(Decimal(amount)) == places
+
+
+def test_zero_decimal_currency_takes_whole_amounts_written_with_cents(client, open_account):
+    fromAccount, toAccount = open_account("JPY", "1000.00"), open_account("JPY", "1")
+    response = client.post(
+        "/api/v2/transfers/",
+        json={"fromAccountId": fromAccount["accountId"], "toAccountId": toAccount["accountId"], "amount": "10.00"},
+    )
+    assert response.status_code == 201, response.text
+
+
+def test_zero_decimal_currency_refuses_fractions(client, open_account):
+    fromAccount, toAccount = open_account("JPY", "1000"), open_account("JPY", "1")
+    response = client.post(
+        "/api/v2/transfers/",
+        json={"fromAccountId": fromAccount["accountId"], "toAccountId": toAccount["accountId"], "amount": "10.50"},
+    )
+    assert response.status_code == 400
+    assert "at most 0 decimal places for JPY" in response.json()["detail"]
+
+
+def test_new_account_in_a_three_decimal_currency_is_refused(client, open_account):
+    customerId = open_account()["customerId"]
+    response = client.post(
+        "/api/v1/accounts/",
+        json={"customerId": customerId, "name": "dinars", "accountType": "checking", "currency": "KWD", "balance": "5"},
+    )
+    assert response.status_code == 422
+    assert "more than 2 decimal places" in response.text
+
+
+def test_existing_account_in_a_three_decimal_currency_still_reads(client, open_account):
+    from sqlalchemy import update
+
+    from app.utils.database import ShardWriteSessionLocal
+    from app.utils.models import Account
+    from app.utils.sharding import shard_of
+
+    account = open_account()
+    with ShardWriteSessionLocal[shard_of(account["accountId"])]() as db:  # opened before the check existed
+        db.execute(update(Account.__table__).where(Account.accountId == account["accountId"]).values(currency="KWD"))
+        db.commit()
+
+    customer = client.get(f"/api/v1/customers/{account['customerId']}")
+    assert customer.status_code == 200, customer.text
+    assert customer.json()["accounts"][0]["currency"] == "KWD"
+
+
+def test_balance_finer_than_the_currency_is_refused(client, open_account):
+    customerId = open_account()["customerId"]
+    response = client.post(
+        "/api/v1/accounts/",
+        json={"customerId": customerId, "name": "yen", "accountType": "checking", "currency": "JPY", "balance": "5.50"},
+    )
+    assert response.status_code == 422
+    assert "at most 0 decimal places for JPY" in response.text
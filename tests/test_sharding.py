@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import insert, select
+
+from app.utils import sharding
+from app.utils.database import ShardSessionLocal, ShardWriteSessionLocal
+from app.utils.models import ShardTransfer, generate_uuid
+
+shardTransfers = ShardTransfer.__table__
+
+
+def balance(client, account) -> Decimal:
+    return Decimal(client.get(f"/api/v1/accounts/{account['accountId']}/balance").json()["balance"])
+
+
+def intent_status(transferId: str) -> str:
+    with ShardSessionLocal[0]() as db:
+        return db.scalar(select(shardTransfers.c.status).where(shardTransfers.c.transferId == transferId))
+
+
+def test_cross_shard_transfer_commits_both_legs(client, open_account):
+    fromAccount, toAccount = open_account(shard=0), open_account(shard=1)
+    response = client.post(
+        "/api/v2/transfers/",
+        json={"fromAccountId": fromAccount["accountId"], "toAccountId": toAccount["accountId"], "amount": "10.00"},
+    )
+    assert response.status_code == 201, response.text
+    assert response.json()["status"] == "success"
+    assert balance(client, fromAccount) == Decimal("90.00")
+    assert balance(client, toAccount) == Decimal("110.00")
+    assert intent_status(response.json()["transferId"]) == "completed"
+
+
+def test_recovery_credits_pending_transfers_past_one_it_cannot_complete(client, open_account, monkeypatch):
+    fromAccount, toAccount = open_account(shard=0), open_account(shard=1)
+
+    # An intent whose destination account is gone, recovered before the good one
+    now = datetime.now(timezone.utc)
+    brokenId = generate_uuid(0)
+    with ShardWriteSessionLocal[0]() as db:
+        db.execute(
+            insert(shardTransfers).values(
+                transferId=brokenId,
+                fromAccountId=fromAccount["accountId"],
+                toAccountId=generate_uuid(1),
+                toShard=1,
+                amount=Decimal("1.00"),
+                currency="USD",
+                name="Transfer to a closed account",
+                creditTransactionId=generate_uuid(1),
+                status="prepared",
+                createdAt=now,
+            )
+        )
+        db.commit()
+
+    # A worker that stops between the two phases
+    def stopped(fromDb, toDb, intent):
+        raise RuntimeError("worker stopped")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(sharding, "complete_transfer", stopped)
+        response = client.post(
+            "/api/v2/transfers/",
+            json={"fromAccountId": fromAccount["accountId"], "toAccountId": toAccount["accountId"], "amount": "10.00"},
+        )
+    assert response.json()["status"] == "pending"
+    assert balance(client, toAccount) == Decimal("100.00")
+
+    assert sharding.recover_transfers() == 1
+    assert balance(client, toAccount) == Decimal("110.00")
+    assert intent_status(response.json()["transferId"]) == "completed"
+    assert intent_status(brokenId) == "prepared"
+
+    # Running it again writes nothing twice
+    assert sharding.recover_transfers() == 0
+    assert balance(client, toAccount) == Decimal("110.00")